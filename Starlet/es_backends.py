@@ -0,0 +1,15 @@
+from elasticsearch import RequestsHttpConnection
+from requests.adapters import HTTPAdapter
+
+
+class PooledRequestsHttpConnection(RequestsHttpConnection):
+    """
+    Соединение через requests (нужно для подписи AWS4Auth) с пулом
+    keep-alive соединений размера maxsize, как у соединения urllib3
+    """
+
+    def __init__(self, *args, maxsize=10, **kwargs):
+        super().__init__(*args, **kwargs)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     # Приложения созданные мной
     'users.apps.UsersConfig',
     'films.apps.FilmsConfig',
@@ -212,7 +213,6 @@ if IS_DEPLOYED:
     DEFAULT_FILE_STORAGE = 'Starlet.storage_backends.MediaStorage'
 
 
-from elasticsearch import Elasticsearch, RequestsHttpConnection
 from requests_aws4auth import AWS4Auth
 
 ES_HOST = config('ELASTIC_SEARCH_HOST')
@@ -226,15 +226,135 @@ AWS_REGION = config('AWS_REGION')
 http_auth = AWS4Auth(AWS_ACCESS_KEY, AWS_SECRET_KEY, AWS_REGION, AWS_SERVICE)
 
 
+# Общие настройки клиента: пул keep-alive соединений и таймаут по умолчанию,
+# без повторов запроса, чтобы ошибка Elastic search не умножала задержку
+ELASTICSEARCH_CLIENT = {
+    'timeout': 10,
+    'maxsize': 25,
+    'max_retries': 0,
+    'retry_on_timeout': False,
+}
+
 ELASTICSEARCH_DSL = {
     'default': {
         'hosts': [{'host': 'localhost', 'port': '9200'}],
+        **ELASTICSEARCH_CLIENT,
+    },
+}
+
+# Таймауты запросов к Elastic search в секундах по видам операций
+ELASTICSEARCH_TIMEOUTS = {
+    'search': 0.5,
+    'suggest': 0.15,
+    'bulk': 60,
+}
+
+# Поиск обращается сразу к запасному движку на RESET_TIMEOUT секунд
+# после FAILURE_THRESHOLD ошибок Elastic search подряд
+ELASTICSEARCH_BREAKER = {
+    'FAILURE_THRESHOLD': 5,
+    'RESET_TIMEOUT': 30,
+}
+
+# Поисковые движки в порядке приоритета, следующий используется при ошибке предыдущего.
+# Без Elasticsearch и pg_trgm можно использовать 'films.search.memory.MemoryTrigramBackend'
+SEARCH_BACKENDS = [
+    'films.search.elastic.ElasticsearchBackend',
+    'films.search.postgres.TrigramSearchBackend',
+]
+
+# Файл триграммного индекса для MemoryTrigramBackend, общий для процессов через mmap.
+# Создается командой build_memory_index, без файла индекс строится из базы в каждом процессе.
+# MAX_CANDIDATES - сколько лучших совпадений проверяется фильтрами и фасетами в базе
+SEARCH_MEMORY_INDEX = {
+    'PATH': os.path.join(BASE_DIR, 'search-index.bin'),
+    'RELOAD_INTERVAL': 10,
+    'MAX_CANDIDATES': 1000,
+}
+
+# Профили анализаторов названий и имен для индексов: 'trigram', 'edge_ngram' или 'shingle'.
+# Применяются при пересоздании индекса командой index_movies
+SEARCH_ANALYZERS = {
+    'movie': 'trigram',
+    'actor': 'trigram',
+}
+
+# Откуда берутся результаты поиска в Elasticsearch: 'index' - карточки из _source документов,
+# 'database' - объекты из базы по найденным id, для проверки согласованности индекса
+SEARCH_RESULTS_SOURCE = 'index'
+
+# Очередь индексации: 'thread' - фоновый поток в каждом процессе,
+# 'database' - таблица IndexingTask и команда process_indexing_queue.
+# Очередь потока отправляет оставшиеся объекты при выходе процесса,
+# дожидаясь начатой отправки не дольше SHUTDOWN_TIMEOUT секунд
+INDEXING_QUEUE = {
+    'MODE': 'thread',
+    'DELAY': 1.0,
+    'MAX_ATTEMPTS': 5,
+    'SHUTDOWN_TIMEOUT': 10.0,
+}
+
+# Общий кеш процессов: версии кешированных ответов и поколения индексов поиска
+# должны быть видны всем воркерам gunicorn, иначе сброс доходит только до процесса,
+# изменившего данные. Без REDIS_URL кеш хранится в памяти процесса, что подходит
+# только для одного процесса и тестов
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'OPTIONS': {'CLIENT_CLASS': 'django_redis.client.DefaultClient'},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Кеш результатов поиска: количество запросов в памяти процесса и время жизни в секундах,
+# результаты запасного движка живут FALLBACK_TIMEOUT секунд. Сброс после индексации
+# хранится в CACHES['default'] и доходит до всех процессов, только если этот кеш общий
+SEARCH_CACHE = {
+    'MAX_SIZE': 1024,
+    'TIMEOUT': 300,
+    'FALLBACK_TIMEOUT': 10,
+}
+
+# Загрузка страниц TMDB парсером: одновременные запросы, таймаут запроса в секундах
+# и процессы для разбора HTML. HOST можно заменить на локальный сервер с сохраненными страницами.
+# Профили людей, загруженные меньше PERSON_MAX_AGE дней назад, повторно не загружаются.
+# CACHE: дисковый кеш страниц размером до MAX_SIZE байт, TTL в секундах по типам страниц,
+# в режиме OFFLINE страницы берутся только из кеша.
+# IMAGES: потоки и таймаут загрузки постеров и фото после загрузки фильмов в базу
+TMDB_CRAWLER = {
+    'HOST': 'https://www.themoviedb.org',
+    'CONCURRENCY': 10,
+    'TIMEOUT': 30,
+    'PARSE_PROCESSES': 4,
+    'PERSON_MAX_AGE': 30,
+    'CACHE': {
+        'PATH': os.path.join(BASE_DIR, 'tmdb-cache'),
+        'MAX_SIZE': 512 * 1024 * 1024,
+        'TTL': {
+            'list': 6 * 60 * 60,
+            'movie': 7 * 24 * 60 * 60,
+            'person': 30 * 24 * 60 * 60,
+        },
+        'OFFLINE': False,
+    },
+    'IMAGES': {
+        'WORKERS': 8,
+        'TIMEOUT': 30,
     },
 }
 
 # Настройки Heroku
 if os.getcwd() == '/app':
     import dj_database_url
+    from .es_backends import PooledRequestsHttpConnection
     DATABASES = {
         'default': dj_database_url.config(default='postgres://localhost')
     }
@@ -248,6 +368,7 @@ if os.getcwd() == '/app':
             'http_auth' : http_auth,
             'use_ssl' : True,
             'verify_certs' : True,
-            'connection_class' : RequestsHttpConnection
+            'connection_class' : PooledRequestsHttpConnection,
+            **ELASTICSEARCH_CLIENT,
         },
     }
@@ -0,0 +1,168 @@
+import hashlib
+import uuid
+from calendar import timegm
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.utils.translation import get_language
+from rest_framework.response import Response
+
+from .translations import get_fallback_language
+
+
+RESPONSE_CACHE_TIMEOUT = getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 60 * 60)
+# Идентификатор версии списка объектов, например списка коллекций
+LIST = 'list'
+
+
+def get_languages(language=None):
+    """
+    Языки, ответы на которых зависят от перевода на language.
+    Изменение перевода на языке по умолчанию затрагивает все языки
+    """
+    if language is None or language == get_fallback_language():
+        return [code for code, name in settings.LANGUAGES]
+    return [language]
+
+
+def version_key(kind, ident, language):
+    return f'films:response:{kind}:{ident}:{language}'
+
+
+def get_version(kind, ident, language):
+    # Версия кешированных ответов объекта, новая после каждой инвалидации
+    key = version_key(kind, ident, language)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+    return version
+
+
+def response_key(kind, ident, request):
+    language = get_language()
+    url = hashlib.md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+    return f'{version_key(kind, ident, language)}:{get_version(kind, ident, language)}:{url}'
+
+
+def invalidate(kind, idents, language=None):
+    # Сбрасывает кешированные ответы объектов для затронутых языков
+    cache.delete_many([
+        version_key(kind, ident, code)
+        for ident in idents
+        for code in get_languages(language)
+    ])
+
+
+def cached_response(kind, lookup):
+    """
+    Кеширует данные ответа view по значению аргумента lookup из URL,
+    активному языку и параметрам запроса
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            key = response_key(kind, kwargs[lookup], request)
+            data = cache.get(key)
+            if data is not None:
+                return Response(data)
+            response = method(view, request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response.data, RESPONSE_CACHE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional_response(get_last_modified, kind=None, lookup=None):
+    """
+    Отдает ETag и Last-Modified по дате обновления, которую возвращает
+    get_last_modified, и отвечает 304 до сериализации данных.
+    В ETag входит версия кеша объекта, которая меняется при изменении
+    переводов и связей, не затрагивающих поле updated. Без lookup
+    используется одна версия kind для всего списка
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return method(view, request, *args, **kwargs)
+            last_modified = get_last_modified(**kwargs)
+            if last_modified is None:
+                return method(view, request, *args, **kwargs)
+
+            language = get_language()
+            version = get_version(kind, kwargs[lookup] if lookup else LIST, language) if kind else ''
+            timestamp = timegm(last_modified.utctimetuple())
+            etag = quote_etag(hashlib.md5(
+                f'{last_modified.isoformat()}:{version}:{language}:{request.get_full_path()}'.encode('utf-8')
+            ).hexdigest())
+
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if response is None:
+                response = method(view, request, *args, **kwargs)
+                if response.status_code == 200:
+                    response['ETag'] = etag
+                    response['Last-Modified'] = http_date(timestamp)
+            return response
+        return wrapper
+    return decorator
+
+
+def translation_slugs(model, ids):
+    # Слаги всех переводов объектов parler
+    translations = model._parler_meta.root_model.objects.filter(master_id__in=ids)
+    return set(translations.values_list('slug', flat=True))
+
+
+def invalidate_movies(ids, language=None):
+    """
+    Сбрасывает страницы фильмов и страницы, в которых фильмы выводятся
+    в списках: коллекции, жанры и фильмографии актеров
+    """
+    from .models import Movie, Genre, Person, Collection
+
+    ids = list(ids)
+    if not ids:
+        return
+    invalidate('movie', Movie.objects.filter(id__in=ids).values_list('slug', flat=True), language)
+    invalidate_collections(Collection.objects.filter(movies__in=ids).values_list('id', flat=True), language)
+    invalidate('genre', translation_slugs(Genre, Genre.objects.filter(movies__in=ids).values('id')), language)
+    invalidate('actor', translation_slugs(Person, Person.objects.filter(movie_cast__in=ids).values('id')), language)
+
+
+def invalidate_persons(ids, language=None):
+    # Сбрасывает страницы людей и страницы фильмов, в которых они участвуют
+    from .models import Movie, Person
+
+    ids = list(ids)
+    if not ids:
+        return
+    invalidate('actor', translation_slugs(Person, ids), language)
+    movies = Movie.objects.filter(Q(cast__in=ids) | Q(directors__in=ids)).distinct()
+    invalidate('movie', movies.values_list('slug', flat=True), language)
+
+
+def invalidate_genres(ids, language=None):
+    # Сбрасывает страницы жанров и страницы фильмов этих жанров
+    from .models import Movie, Genre
+
+    ids = list(ids)
+    if not ids:
+        return
+    invalidate('genre', translation_slugs(Genre, ids), language)
+    invalidate('movie', Movie.objects.filter(genres__in=ids).values_list('slug', flat=True), language)
+
+
+def invalidate_collections(ids, language=None):
+    # Сбрасывает страницы коллекций и версию списка коллекций, в котором выводятся их фильмы
+    ids = list(ids)
+    if not ids:
+        return
+    invalidate('collection', ids, language)
+    invalidate('collections', [LIST], language)
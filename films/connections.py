@@ -0,0 +1,105 @@
+import threading
+import time
+
+from django.conf import settings
+from elasticsearch.exceptions import ConnectionError, TransportError
+from elasticsearch_dsl import connections
+
+
+ELASTICSEARCH_TIMEOUTS = getattr(settings, 'ELASTICSEARCH_TIMEOUTS', {})
+ELASTICSEARCH_BREAKER = getattr(settings, 'ELASTICSEARCH_BREAKER', {})
+
+
+def get_client(alias='default'):
+    """
+    Общий клиент процесса с пулом keep-alive соединений. Клиент создается
+    django_elasticsearch_dsl из settings.ELASTICSEARCH_DSL
+    """
+    return connections.get_connection(alias)
+
+
+def get_timeout(operation):
+    # Таймаут запроса в секундах для вида операции: search, suggest, bulk
+    return ELASTICSEARCH_TIMEOUTS.get(operation, 10)
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+def is_failure(error):
+    """
+    Ошибка недоступности Elastic search: нет соединения, таймаут
+    или ответ 5xx. Ошибки запроса клиента (4xx) размыкатель не учитывает
+    """
+    if isinstance(error, ConnectionError):
+        return True
+    return isinstance(error, TransportError) and isinstance(error.status_code, int) and error.status_code >= 500
+
+
+class CircuitBreaker:
+    """
+    После failure_threshold ошибок подряд запросы к Elastic search
+    не выполняются reset_timeout секунд. Затем пропускается один
+    пробный запрос: при успехе запросы возобновляются, при ошибке
+    ожидание начинается заново
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened is None:
+                return True
+            if self.probing or time.monotonic() - self.opened < self.reset_timeout:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.opened is not None or self.failures >= self.failure_threshold:
+                self.opened = time.monotonic()
+
+    def release(self):
+        # Пробный запрос завершился ошибкой, не связанной с доступностью
+        with self.lock:
+            self.probing = False
+
+    def call(self, func, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpen('Elasticsearch circuit is open')
+        try:
+            result = func(*args, **kwargs)
+        except TransportError as e:
+            if is_failure(e):
+                self.record_failure()
+            else:
+                # Elastic search ответил, ошибка в самом запросе
+                self.record_success()
+            raise
+        except Exception:
+            self.release()
+            raise
+        self.record_success()
+        return result
+
+
+breaker = CircuitBreaker(
+    failure_threshold=ELASTICSEARCH_BREAKER.get('FAILURE_THRESHOLD', 5),
+    reset_timeout=ELASTICSEARCH_BREAKER.get('RESET_TIMEOUT', 30),
+)
@@ -0,0 +1,191 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import aiohttp
+import django
+from django.conf import settings
+from django.utils import translation
+from django.utils.translation import gettext as _, get_language
+
+from . import tmdb_parse
+from .tmdb_cache import PageCache
+
+
+TMDB_CRAWLER = getattr(settings, 'TMDB_CRAWLER', {})
+HOST = TMDB_CRAWLER.get('HOST', tmdb_parse.HOST)
+CONCURRENCY = TMDB_CRAWLER.get('CONCURRENCY', 10)
+TIMEOUT = TMDB_CRAWLER.get('TIMEOUT', 30)
+PARSE_PROCESSES = TMDB_CRAWLER.get('PARSE_PROCESSES', 4)
+PERSON_MAX_AGE = TMDB_CRAWLER.get('PERSON_MAX_AGE', 30)
+CACHE = TMDB_CRAWLER.get('CACHE', {})
+OFFLINE = CACHE.get('OFFLINE', False)
+
+
+def get_cache():
+    # Дисковый кеш страниц из настроек, без PATH кеш не используется
+    if not CACHE.get('PATH'):
+        return None
+    return PageCache(CACHE['PATH'], CACHE.get('MAX_SIZE', 512 * 1024 * 1024), CACHE.get('TTL'))
+
+
+def parse_page(func, html, language, *args):
+    # Разбор страницы в процессе пула: переводы в функциях разбора зависят от языка
+    with translation.override(language):
+        return func(html, *args)
+
+
+class Crawler:
+    """
+    Асинхронная загрузка страниц TMDB. Все запросы идут через одну сессию
+    с общим пулом соединений, одновременно загружается не больше
+    concurrency страниц фильмов и людей, у каждого запроса есть таймаут.
+    HTML разбирается в пуле процессов, чтобы не блокировать загрузку.
+    Профили людей с TMDB id из known не загружаются. Страницы из кеша cache
+    используются, пока не устарели, затем проверяются условным запросом,
+    в режиме offline страницы берутся только из кеша. Кеш читается
+    и записывается в отдельном потоке, чтобы дисковые операции
+    не блокировали цикл событий
+    """
+
+    def __init__(self, language=None, host=HOST, concurrency=CONCURRENCY, timeout=TIMEOUT, processes=PARSE_PROCESSES,
+                 known=(), cache=None, offline=OFFLINE):
+        self.language = language or get_language()
+        self.host = host
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.processes = processes
+        self.known = set(known)
+        self.cache = cache
+        self.offline = offline
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            headers=tmdb_parse.HEADERS,
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.executor = ProcessPoolExecutor(self.processes, initializer=django.setup)
+        # Один поток: PageCache не рассчитан на одновременные вызовы
+        self.cache_executor = ThreadPoolExecutor(1)
+        self.people = {}
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.executor.shutdown()
+        self.cache_executor.shutdown()
+
+    async def run_cache(self, method, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.cache_executor, method, *args)
+
+    async def fetch(self, url, params=None):
+        # Текст страницы или None при ошибке, превышении таймаута и отсутствии в кеше в режиме offline
+        entry = await self.run_cache(self.cache.get, url, params) if self.cache else None
+        if entry and (self.offline or self.cache.is_fresh(entry)):
+            return entry['body']
+        if self.offline:
+            print(f'Not cached: {url}')
+            return None
+        headers = self.cache.get_validators(entry) if entry else {}
+        async with self.semaphore:
+            try:
+                async with self.session.get(url, params=params, headers=headers) as response:
+                    if response.status == 304 and entry:
+                        await self.run_cache(self.cache.revalidated, url, params, entry, response.headers)
+                        return entry['body']
+                    if response.status != 200:
+                        print(f'Error {response.status}: {url}')
+                        return None
+                    html = await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f'Error {e!r}: {url}')
+                return None
+        if self.cache:
+            await self.run_cache(self.cache.put, url, params, html, response.headers)
+        return html
+
+    async def parse(self, url, func, html, *args):
+        # Результат разбора или None: ошибка на одной странице не прерывает загрузку остальных
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor, parse_page, func, html, self.language, *args)
+        except Exception as e:
+            print(f'Error {e!r}: {url}')
+            return None
+
+    async def get_links(self, page):
+        url = f'{self.host}/movie/'
+        html = await self.fetch(url, {'page': page, 'language': self.language})
+        if html is None:
+            return []
+        return await self.parse(url, tmdb_parse.get_links, html, self.host) or []
+
+    async def fetch_person(self, link, tmdb_id):
+        html = await self.fetch(link)
+        if html is None:
+            return None
+        person = await self.parse(link, tmdb_parse.get_person, html)
+        if person is None:
+            return None
+        person['tmdb_id'] = tmdb_id
+        return person
+
+    async def get_person(self, link):
+        """
+        Профиль человека по ссылке. Для известных людей возвращается
+        только TMDB id, профиль каждого человека загружается один раз
+        """
+        tmdb_id = tmdb_parse.get_tmdb_id(link)
+        if tmdb_id is None:
+            return await self.fetch_person(link, None)
+        if tmdb_id in self.known:
+            return {'tmdb_id': tmdb_id}
+        if tmdb_id not in self.people:
+            self.people[tmdb_id] = asyncio.ensure_future(self.fetch_person(link, tmdb_id))
+        return await self.people[tmdb_id]
+
+    async def get_people(self, links, error):
+        people = await asyncio.gather(*(self.get_person(link) for link in links))
+        if None in people:
+            print(error)
+        return [person for person in people if person is not None]
+
+    async def get_directors(self, links):
+        return await self.get_people(links, _('Error in parsing directors'))
+
+    async def get_cast(self, links):
+        return await self.get_people(links, _('Error in parsing cast'))
+
+    async def get_movie(self, link):
+        """
+        Данные фильма со страницы link. Страницы режиссеров и актеров
+        загружаются параллельно, порядок актеров сохраняется
+        """
+        html = await self.fetch(link)
+        movie = await self.parse(link, tmdb_parse.get_movie, html, self.host) if html is not None else None
+        if movie is None:
+            print(_('Error in parsing content'))
+            return None
+        movie['directors'], movie['cast'] = await asyncio.gather(
+            self.get_directors(movie['directors']),
+            self.get_cast(movie['cast']),
+        )
+        return movie
+
+    async def crawl(self, quantity):
+        # Фильмы с первых quantity страниц списка популярных фильмов
+        pages = await asyncio.gather(*(self.get_links(page) for page in range(1, quantity + 1)))
+        links = [link for links in pages for link in links]
+        movies = await asyncio.gather(*(self.get_movie(link) for link in links))
+        return [movie for movie in movies if movie is not None]
+
+
+def crawl(quantity, **options):
+    options.setdefault('cache', get_cache())
+
+    async def run():
+        async with Crawler(**options) as crawler:
+            return await crawler.crawl(quantity)
+    return asyncio.run(run())
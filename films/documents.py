@@ -1,4 +1,8 @@
-from elasticsearch_dsl import Document, Index, Text, Integer, analyzer, tokenizer, Nested, InnerDoc, Keyword
+import copy
+
+from django.conf import settings
+from elasticsearch_dsl import (Document, Index, Text, Integer, analyzer, tokenizer, Nested, InnerDoc, Keyword,
+                               Completion, Float, Date, Object)
 from elasticsearch_dsl.analysis import token_filter
 
 # edge_ngram_completion_filter = token_filter(
@@ -22,12 +26,50 @@ my_analyzer = analyzer('my_analyzer',
     filter=['lowercase',]
 )
 
+# Префиксы слов от 1 до 20 символов, запрос разбирается на целые слова
+edge_ngram_analyzer = analyzer('edge_ngram_analyzer',
+    tokenizer=tokenizer('edge_ngram_tokenizer', 'edge_ngram', min_gram=1, max_gram=20,
+                        token_chars=['letter', 'digit']),
+    filter=['lowercase']
+)
+prefix_search_analyzer = analyzer('prefix_search_analyzer', tokenizer='standard', filter=['lowercase'])
+
+# Пары и тройки слов подряд для подъема точных совпадений фраз
+shingle_analyzer = analyzer('shingle_analyzer',
+    tokenizer='standard',
+    filter=['lowercase', token_filter('word_shingle', 'shingle', min_shingle_size=2, max_shingle_size=3)]
+)
+
+# Профили анализаторов текстовых полей: параметры поля Text
+ANALYZER_PROFILES = {
+    'trigram': lambda: {'analyzer': my_analyzer},
+    'edge_ngram': lambda: {'analyzer': edge_ngram_analyzer, 'search_analyzer': prefix_search_analyzer},
+    'shingle': lambda: {'analyzer': 'standard', 'fields': {'shingles': Text(analyzer=shingle_analyzer)}},
+}
+
+SEARCH_ANALYZERS = getattr(settings, 'SEARCH_ANALYZERS', {})
+
+
+def text_field(profile, **kwargs):
+    return Text(**ANALYZER_PROFILES[profile](), **kwargs)
+
+
 class MovieDocument(Document):
-    orig_title = Text(
-        analyzer=my_analyzer
-    )
-    translations = Text(analyzer=my_analyzer, multi=True)  #  fields={'raw': Keyword()},
+    orig_title = text_field(SEARCH_ANALYZERS.get('movie', 'trigram'))
+    translations = text_field(SEARCH_ANALYZERS.get('movie', 'trigram'), multi=True)  #  fields={'raw': Keyword()},
     id = Integer()
+    slug = Keyword(index=False)
+    image = Keyword(index=False)
+    suggest = Completion()
+    imdb_rating = Float()
+    release_date = Date()
+    release_year = Integer()
+    age_limit = Keyword()
+    # Слаги жанров на всех языках для фильтра и id жанров для фасета
+    genres = Keyword(multi=True)
+    genre_ids = Integer(multi=True)
+    # Карточки списка по языкам: {язык: {id, title, description, country, tagline, poster}}
+    cards = Object(enabled=False)
 
     class Meta:
         index = 'movie'
@@ -38,8 +80,13 @@ class MovieDocument(Document):
 
 
 class ActorDocument(Document):
-    name = Text(analyzer=my_analyzer, multi=True)
+    name = text_field(SEARCH_ANALYZERS.get('actor', 'trigram'), multi=True)
     id = Integer()
+    slug = Keyword(index=False)
+    image = Keyword(index=False)
+    suggest = Completion()
+    # Карточки списка по языкам: {язык: {name, slug}}
+    cards = Object(enabled=False)
 
     class Meta:
         index = 'actor'
@@ -47,3 +94,29 @@ class ActorDocument(Document):
 
     class Index:
         name = 'actor'
+
+
+# Текстовые поля документов, анализатор которых задается профилем
+TEXT_FIELDS = {
+    MovieDocument: {'orig_title': {}, 'translations': {'multi': True}},
+    ActorDocument: {'name': {'multi': True}},
+}
+
+
+def get_profile(document):
+    return SEARCH_ANALYZERS.get(document._index._name, 'trigram')
+
+
+def build_index(document, name, profile=None):
+    """
+    Индекс name с настройками и маппингом документа, текстовые поля
+    которого используют профиль анализатора profile
+    """
+    profile = profile or get_profile(document)
+    index = Index(name)
+    index.settings(**document._index._settings)
+    mapping = copy.deepcopy(document._doc_type.mapping)
+    for field, params in TEXT_FIELDS[document].items():
+        mapping.field(field, text_field(profile, **params))
+    index.mapping(mapping)
+    return index
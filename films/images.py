@@ -0,0 +1,162 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+
+from . import cache
+from .indexing import enqueue_many
+from .models import MovieTranslations, Person, TMDBImage
+from .tmdb_parse import HEADERS
+
+
+IMAGES = getattr(settings, 'TMDB_CRAWLER', {}).get('IMAGES', {})
+WORKERS = IMAGES.get('WORKERS', 8)
+TIMEOUT = IMAGES.get('TIMEOUT', 30)
+CHUNK_SIZE = 64 * 1024
+# Изображения меньше этого размера не записываются во временный файл на диске
+SPOOL_SIZE = 1024 * 1024
+
+
+class ImageLoader:
+    """
+    Скачивание изображений TMDB в хранилище. Изображение читается
+    по частям во временный файл с подсчетом хеша и сохраняется
+    под именем из хеша, поэтому одинаковые изображения хранятся один раз.
+    Соединения переиспользуются пулом на workers потоков
+    """
+
+    def __init__(self, workers=WORKERS, timeout=TIMEOUT):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def get_lock(self, digest):
+        # Одинаковые изображения из разных потоков сохраняются по очереди
+        with self.lock:
+            return self.locks.setdefault(digest, threading.Lock())
+
+    def download(self, url, field):
+        """
+        Скачивает изображение в хранилище поля field.
+        Возвращает хеш содержимого и имя файла или None при ошибке
+        """
+        with tempfile.SpooledTemporaryFile(SPOOL_SIZE) as file:
+            digest = hashlib.sha256()
+            try:
+                with self.session.get(url, stream=True, timeout=self.timeout) as response:
+                    if response.status_code != 200:
+                        print(f'Error {response.status_code}: {url}')
+                        return None
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        digest.update(chunk)
+                        file.write(chunk)
+            except requests.RequestException as e:
+                print(f'Error {e!r}: {url}')
+                return None
+
+            digest = digest.hexdigest()
+            extension = os.path.splitext(urlparse(url).path)[1].lower()
+            name = f'{field.upload_to}{digest[:2]}/{digest}{extension}'
+            try:
+                with self.get_lock(digest):
+                    if not field.storage.exists(name):
+                        file.seek(0)
+                        name = field.storage.save(name, File(file))
+            except Exception as e:
+                # Ошибка хранилища пропускает только это изображение
+                print(f'Error {e!r}: {url}')
+                return None
+        return digest, name
+
+    def close(self):
+        self.session.close()
+
+
+def without_conflicts(photos):
+    """
+    Фото людей без нарушения unique_together (photo, birth_date):
+    одинаковые изображения хранятся в одном файле, поэтому у людей
+    с одной датой рождения фото может совпасть. Такие люди пропускаются
+    """
+    birth_dates = dict(Person.objects.filter(id__in=photos).values_list('id', 'birth_date'))
+    taken = set(
+        Person.objects.filter(photo__in=set(photos.values())).exclude(id__in=photos)
+        .values_list('photo', 'birth_date')
+    )
+    result = {}
+    for pk, name in sorted(photos.items()):
+        birth_date = birth_dates.get(pk)
+        if birth_date is not None and (name, birth_date) in taken:
+            print(f'Skipped photo {name} of person {pk}: another person born {birth_date} has it')
+            continue
+        taken.add((name, birth_date))
+        result[pk] = name
+    return result
+
+
+def save_images(images, workers=WORKERS):
+    """
+    Сохраняет постеры и фото после загрузки фильмов в базу.
+    Пути TMDB, которые уже сохранены, берутся из базы без скачивания,
+    остальные изображения скачиваются пулом из workers потоков.
+    Поля обновляются пачками в одной транзакции
+    """
+    started = time.monotonic()
+    poster = MovieTranslations._meta.get_field('poster')
+    photo = Person._meta.get_field('photo')
+    targets = [(poster, (movie_id, language), url) for movie_id, language, url in images['posters']]
+    targets += [(photo, pk, url) for pk, url in images['photos']]
+
+    paths = {url: urlparse(url).path for field, key, url in targets}
+    stored = dict(TMDBImage.objects.filter(path__in=set(paths.values())).values_list('path', 'name'))
+    missing = {}
+    for field, key, url in targets:
+        if paths[url] not in stored:
+            missing.setdefault(url, field)
+
+    loader = ImageLoader(workers)
+    try:
+        with ThreadPoolExecutor(workers) as executor:
+            results = executor.map(lambda item: loader.download(*item), missing.items())
+            downloaded = [
+                TMDBImage(path=paths[url], digest=result[0], name=result[1])
+                for url, result in zip(missing, results) if result
+            ]
+    finally:
+        loader.close()
+    stored.update((image.path, image.name) for image in downloaded)
+
+    posters = {key: stored[paths[url]] for field, key, url in targets if field is poster and paths[url] in stored}
+    photos = {key: stored[paths[url]] for field, key, url in targets if field is photo and paths[url] in stored}
+    with transaction.atomic():
+        photos = without_conflicts(photos)
+        TMDBImage.objects.bulk_create(downloaded, ignore_conflicts=True)
+        translations = MovieTranslations.objects.filter(movie_id__in={movie_id for movie_id, language in posters})
+        translations = [t for t in translations if (t.movie_id, t.language_code) in posters]
+        for translation in translations:
+            translation.poster = posters[(translation.movie_id, translation.language_code)]
+        MovieTranslations.objects.bulk_update(translations, ['poster'])
+        Person.objects.bulk_update([Person(id=pk, photo=name) for pk, name in photos.items()], ['photo'])
+
+        # Пакетные запросы не отправляют сигналы, индексация и сброс кеша после фиксации
+        movie_ids = {translation.movie_id for translation in translations}
+        enqueue_many('movie', movie_ids)
+        enqueue_many('person', photos)
+        transaction.on_commit(lambda: cache.invalidate_movies(movie_ids))
+        transaction.on_commit(lambda: cache.invalidate_persons(photos))
+
+    elapsed = time.monotonic() - started
+    print(f'Saved {len(posters) + len(photos)} images, {len(downloaded)} downloaded in {elapsed:.2f} sec')
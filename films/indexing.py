@@ -0,0 +1,316 @@
+import atexit
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from elasticsearch.helpers import bulk, parallel_bulk
+
+from .connections import get_client, get_timeout
+from .documents import MovieDocument, ActorDocument, build_index
+from .search.cache import bump_generation
+from .search.memory import memory_index
+
+
+INDEXING_QUEUE = getattr(settings, 'INDEXING_QUEUE', {})
+MODE = INDEXING_QUEUE.get('MODE', 'thread')
+DELAY = INDEXING_QUEUE.get('DELAY', 1.0)
+BATCH_SIZE = INDEXING_QUEUE.get('BATCH_SIZE', 500)
+THREAD_COUNT = INDEXING_QUEUE.get('THREAD_COUNT', 4)
+MAX_ATTEMPTS = INDEXING_QUEUE.get('MAX_ATTEMPTS', 5)
+RETRY_DELAY = INDEXING_QUEUE.get('RETRY_DELAY', 2.0)
+# Сколько секунд при выходе процесса ждать отправку, начатую фоновым потоком
+SHUTDOWN_TIMEOUT = INDEXING_QUEUE.get('SHUTDOWN_TIMEOUT', 10.0)
+
+DOCUMENTS = {'movie': MovieDocument, 'person': ActorDocument}
+
+_queue = None
+
+
+def get_models():
+    from .models import Movie, Person
+    return {'movie': Movie, 'person': Person}
+
+
+def get_prefetch(kind):
+    # Связи, которые нужны для документа индекса
+    return ('translations', 'genres__translations') if kind == 'movie' else ('translations',)
+
+
+def build_actions(kind, ids):
+    """
+    Действия bulk для объектов: документ для существующих объектов
+    и удаление из индекса для удаленных
+    """
+    model = get_models()[kind]
+    index = DOCUMENTS[kind]._index._name
+    found = set()
+    for obj in model.objects.filter(id__in=ids).prefetch_related(*get_prefetch(kind)):
+        found.add(obj.id)
+        yield obj.get_document().to_dict(include_meta=True)
+    for pk in set(ids) - found:
+        yield {'_op_type': 'delete', '_index': index, '_id': pk}
+
+
+def flush(kind, ids):
+    """
+    Отправляет объекты в Elastic search одним bulk запросом.
+    Возвращает id, которые не удалось проиндексировать
+    """
+    ids = set(ids)
+    try:
+        success, errors = bulk(
+            get_client(),
+            build_actions(kind, ids),
+            raise_on_error=False,
+            request_timeout=get_timeout('bulk'),
+        )
+    except Exception as e:
+        print(e)
+        return ids
+
+    failed = set()
+    for error in errors:
+        op_type, item = next(iter(error.items()))
+        if op_type == 'delete' and item.get('status') == 404:
+            continue
+        failed.add(int(item['_id']))
+    if len(failed) < len(ids):
+        bump_generation(kind)
+    return failed
+
+
+class ThreadQueue:
+    """
+    Очередь индексации в памяти процесса. Фоновый поток ждет DELAY секунд,
+    чтобы собрать повторные сохранения одних и тех же объектов,
+    и отправляет их bulk запросом. Неудачные отправки повторяются
+    с увеличивающейся задержкой. При выходе процесса close отправляет
+    оставшиеся объекты, не дожидаясь фонового потока
+    """
+
+    def __init__(self):
+        self.pending = {kind: set() for kind in get_models()}
+        self.condition = threading.Condition()
+        self.thread = None
+        self.attempts = 0
+        self.busy = False
+
+    def put(self, kind, ids):
+        with self.condition:
+            self.pending[kind].update(ids)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='indexing-queue', daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    def take(self):
+        with self.condition:
+            while not any(self.pending.values()):
+                self.condition.wait()
+        time.sleep(DELAY)
+        with self.condition:
+            batch, self.pending = self.pending, {kind: set() for kind in self.pending}
+            self.busy = True
+        return batch
+
+    def run(self):
+        while True:
+            failed = {kind: flush(kind, ids) for kind, ids in self.take().items() if ids}
+            close_old_connections()
+            retry = any(failed.values())
+            if retry:
+                self.attempts += 1
+            else:
+                self.attempts = 0
+            if self.attempts >= MAX_ATTEMPTS:
+                print(f'Indexing failed after {self.attempts} attempts: {failed}')
+                self.attempts = 0
+                retry = False
+            with self.condition:
+                if retry:
+                    for kind, ids in failed.items():
+                        self.pending[kind].update(ids)
+                self.busy = False
+                self.condition.notify_all()
+            if retry:
+                time.sleep(RETRY_DELAY * 2 ** (self.attempts - 1))
+
+    def close(self, timeout=SHUTDOWN_TIMEOUT):
+        """
+        Дожидается отправки, которую уже начал фоновый поток,
+        и сразу отправляет накопленные объекты, включая ожидающие повтора
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: not self.busy, timeout)
+            batch, self.pending = self.pending, {kind: set() for kind in self.pending}
+        for kind, ids in batch.items():
+            if ids:
+                failed = flush(kind, ids)
+                if failed:
+                    print(f'Indexing of {kind} {sorted(failed)} failed at shutdown')
+
+
+class DatabaseQueue:
+    """
+    Очередь индексации в таблице IndexingTask, которую обрабатывает
+    команда process_indexing_queue в отдельном процессе
+    """
+
+    def put(self, kind, ids):
+        from .models import IndexingTask
+
+        now = timezone.now()
+        IndexingTask.objects.bulk_create(
+            [IndexingTask(kind=kind, object_id=pk, updated=now) for pk in ids],
+            ignore_conflicts=True,
+        )
+        IndexingTask.objects.filter(kind=kind, object_id__in=ids).update(updated=now)
+
+    def process(self, batch_size=BATCH_SIZE):
+        """
+        Индексирует накопленные объекты, возвращает количество
+        обработанных задач. Задачи, обновленные во время отправки,
+        остаются в очереди до следующего прохода
+        """
+        from .models import IndexingTask
+
+        started = timezone.now()
+        tasks = list(IndexingTask.objects.filter(updated__lte=started)[:batch_size])
+        ids = {}
+        for task in tasks:
+            ids.setdefault(task.kind, set()).add(task.object_id)
+
+        failed = {kind: flush(kind, kind_ids) for kind, kind_ids in ids.items()}
+        done, retry = [], []
+        for task in tasks:
+            if task.object_id not in failed[task.kind]:
+                done.append(task.id)
+            elif task.attempts + 1 >= MAX_ATTEMPTS:
+                print(f'Indexing {task} failed after {task.attempts + 1} attempts')
+                done.append(task.id)
+            else:
+                retry.append(task.id)
+
+        queryset = IndexingTask.objects.filter(updated__lte=started)
+        queryset.filter(id__in=done).delete()
+        queryset.filter(id__in=retry).update(attempts=F('attempts') + 1)
+        return len(tasks)
+
+
+def get_queue():
+    global _queue
+    if _queue is None:
+        if MODE == 'database':
+            _queue = DatabaseQueue()
+        else:
+            _queue = ThreadQueue()
+            atexit.register(_queue.close)
+    return _queue
+
+
+def enqueue_many(kind, ids):
+    # Объекты попадают в очередь и в индекс процесса только после фиксации транзакции
+    ids = list(ids)
+    if not ids:
+        return
+    transaction.on_commit(lambda: get_queue().put(kind, ids))
+    transaction.on_commit(lambda: memory_index.update(kind, ids))
+
+
+def enqueue(kind, pk):
+    enqueue_many(kind, [pk])
+
+
+def create_versioned_index(document, using='default', profile=None):
+    """
+    Создает новый индекс с настройками и маппингом документа и профилем
+    анализатора profile, имя индекса состоит из имени алиаса и времени создания
+    """
+    alias = document._index._name
+    name = f'{alias}-{timezone.now():%Y%m%d%H%M%S%f}'
+    build_index(document, name, profile).create(using=using)
+    return name
+
+
+def swap_alias(client, alias, index):
+    """
+    Атомарно переключает алиас на новый индекс и возвращает
+    индексы, на которые он указывал раньше. Индекс со старой схемы,
+    имя которого совпадает с алиасом, удаляется в том же запросе
+    """
+    actions = [{'add': {'index': index, 'alias': alias}}]
+    old = []
+    if client.indices.exists_alias(name=alias):
+        old = [name for name in client.indices.get_alias(name=alias) if name != index]
+        actions += [{'remove': {'index': name, 'alias': alias}} for name in old]
+    elif client.indices.exists(index=alias):
+        actions.append({'remove_index': {'index': alias}})
+    client.indices.update_aliases(body={'actions': actions})
+    return old
+
+
+def get_checkpoint(alias):
+    from .models import IndexingCheckpoint
+
+    return IndexingCheckpoint.objects.filter(index=alias).values_list('last_run', flat=True).first()
+
+
+def save_checkpoint(alias, last_run):
+    from .models import IndexingCheckpoint
+
+    IndexingCheckpoint.objects.update_or_create(index=alias, defaults={'last_run': last_run})
+
+
+def iterate_chunks(queryset, chunk_size=BATCH_SIZE):
+    """
+    Обходит queryset порциями по первичному ключу. В отличие от iterator()
+    prefetch_related выполняется для каждой порции одним запросом
+    """
+    queryset = queryset.order_by('pk')
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(pk__gt=last)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield from chunk
+        last = chunk[-1].pk
+
+
+def export_actions(queryset, index, chunk_size=BATCH_SIZE):
+    """
+    Действия bulk для всех объектов queryset в индекс index. Переводы
+    загружаются одним запросом на порцию, к Elastic search при этом
+    обращений нет
+    """
+    kind = next(kind for kind, model in get_models().items() if model is queryset.model)
+    queryset = queryset.prefetch_related(*get_prefetch(kind))
+    for obj in iterate_chunks(queryset, chunk_size):
+        action = obj.get_document().to_dict(include_meta=True)
+        action['_index'] = index
+        yield action
+
+
+def bulk_index(client, actions, chunk_size=BATCH_SIZE, thread_count=THREAD_COUNT):
+    """
+    Отправляет действия в Elastic search параллельными bulk запросами.
+    Возвращает количество успешных документов, список ошибок и время в секундах
+    """
+    started = time.monotonic()
+    success, errors = 0, []
+    results = parallel_bulk(
+        client, actions,
+        chunk_size=chunk_size,
+        thread_count=thread_count,
+        raise_on_error=False,
+        request_timeout=get_timeout('bulk'),
+    )
+    for ok, item in results:
+        if ok:
+            success += 1
+        else:
+            errors.append(item)
+    return success, errors, time.monotonic() - started
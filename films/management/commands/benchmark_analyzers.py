@@ -0,0 +1,118 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from elasticsearch import Elasticsearch
+from films.models import Movie, Person
+from films.documents import MovieDocument, ActorDocument, ANALYZER_PROFILES, build_index
+from films.indexing import export_actions, bulk_index, BATCH_SIZE, THREAD_COUNT
+from films.search.elastic import MOVIE_FIELDS, PERSON_FIELDS
+from films.connections import get_client
+
+
+INDEXES = {
+    MovieDocument._index._name: (Movie, MovieDocument, MOVIE_FIELDS),
+    ActorDocument._index._name: (Person, ActorDocument, PERSON_FIELDS),
+}
+
+
+class Command(BaseCommand):
+    """
+    Сравнение профилей анализаторов на данных из базы: для каждого профиля
+    создается временный индекс, в который загружаются объекты, затем
+    измеряются размер индекса, скорость индексации и задержка запросов.
+    Данные для сравнения - фикстура films/fixtures/benchmark_movies.json:
+    500 фильмов и 300 человек с переводами на ru и en
+    python manage.py loaddata benchmark_movies
+    python manage.py benchmark_analyzers --limit 200
+    python manage.py benchmark_analyzers --host http://localhost:9200 --profile edge_ngram
+    """
+
+    help = 'Compares analyzer profiles by index size, indexing throughput and query latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', help='Elasticsearch URL, the default connection is used if omitted')
+        parser.add_argument('--index', action='append', choices=list(INDEXES),
+                            help='Index to benchmark, all indexes by default')
+        parser.add_argument('--profile', action='append', choices=list(ANALYZER_PROFILES),
+                            help='Analyzer profile to benchmark, all profiles by default')
+        parser.add_argument('--limit', type=int, help='Maximum number of objects to index')
+        parser.add_argument('--queries', type=int, default=100,
+                            help='Number of objects whose titles are used as queries')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs of every query')
+        parser.add_argument('--chunk-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--threads', type=int, default=THREAD_COUNT)
+        parser.add_argument('--keep', action='store_true', help='Do not delete the benchmark indexes')
+
+    def get_queryset(self, model, limit):
+        queryset = model.objects.all()
+        if limit:
+            queryset = queryset.filter(pk__in=list(
+                model.objects.order_by('pk').values_list('pk', flat=True)[:limit]
+            ))
+        return queryset
+
+    def get_queries(self, es, index, quantity):
+        """
+        Запросы из названий проиндексированных объектов: первые три буквы,
+        первое слово и название целиком
+        """
+        response = es.search(index=index, body={'size': quantity, '_source': ['suggest']})
+        queries = []
+        for hit in response['hits']['hits']:
+            for title in hit['_source'].get('suggest', [])[:1]:
+                words = title.split()
+                if words:
+                    queries += [title[:3], words[0], title]
+        return queries
+
+    def measure(self, es, index, fields, queries, repeat):
+        # Задержка запросов в миллисекундах по часам клиента и полю took ответа
+        wall, took = [], []
+        for query in queries * repeat:
+            body = {'query': {'multi_match': {'query': query, 'fields': fields}}, 'size': 10, '_source': ['id']}
+            started = time.monotonic()
+            response = es.search(index=index, body=body)
+            wall.append((time.monotonic() - started) * 1000)
+            took.append(response['took'])
+        return wall, took
+
+    def percentile(self, values, fraction):
+        values = sorted(values)
+        return values[min(int(len(values) * fraction), len(values) - 1)]
+
+    def benchmark(self, es, name, profile, options):
+        model, document, fields = INDEXES[name]
+        index = f'benchmark-{name}-{profile}'
+        if es.indices.exists(index=index):
+            es.indices.delete(index=index)
+        build_index(document, index, profile).create(using=es)
+        try:
+            actions = export_actions(self.get_queryset(model, options['limit']), index, options['chunk_size'])
+            success, errors, elapsed = bulk_index(es, actions, options['chunk_size'], options['threads'])
+            es.indices.refresh(index=index)
+            es.indices.forcemerge(index=index, max_num_segments=1)
+            stats = es.indices.stats(index=index, metric='store')
+            size = stats['_all']['primaries']['store']['size_in_bytes']
+
+            queries = self.get_queries(es, index, options['queries'])
+            wall, took = self.measure(es, index, fields, queries, options['repeat']) if queries else ([0], [0])
+            print(
+                f'{name:6} {profile:10} '
+                f'docs {success:7} errors {len(errors):4} '
+                f'size {size / 1024 / 1024:8.2f} MB {size / max(success, 1):7.0f} B/doc '
+                f'rate {success / elapsed if elapsed else 0:7.0f} docs/sec '
+                f'latency p50 {statistics.median(wall):6.1f} ms p95 {self.percentile(wall, 0.95):6.1f} ms '
+                f'took p50 {statistics.median(took):5.0f} ms'
+            )
+        finally:
+            if not options['keep']:
+                es.indices.delete(index=index)
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be positive')
+        es = Elasticsearch([options['host']]) if options['host'] else get_client()
+        for name in options['index'] or INDEXES:
+            for profile in options['profile'] or ANALYZER_PROFILES:
+                self.benchmark(es, name, profile, options)
@@ -0,0 +1,29 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from films.search.memory import INDEX_PATH, build_segments, write_segments
+
+
+class Command(BaseCommand):
+    """
+    Команда для построения файла триграммного индекса MemoryTrigramBackend.
+    Процессы перечитывают файл после его замены
+    python manage.py build_memory_index
+    """
+
+    help = 'Builds the in-process trigram search index file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=INDEX_PATH, help='Index file, SEARCH_MEMORY_INDEX PATH by default')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not path:
+            raise CommandError('Index path is not configured')
+        started = time.monotonic()
+        segments = build_segments()
+        write_segments(path, segments)
+        for kind, segment in segments.items():
+            print(f'Indexed {len(segment.ids)} {kind} documents.')
+        print(f'Wrote {os.path.getsize(path) / 1024 / 1024:.2f} MB to {path} in {time.monotonic() - started:.1f}s.')
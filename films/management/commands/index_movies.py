@@ -1,76 +1,127 @@
-from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from elasticsearch_dsl import Search, Index, connections
-from elasticsearch.helpers import bulk
-from elasticsearch import Elasticsearch, RequestsHttpConnection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from films.models import Movie, Person
-from films.documents import MovieDocument, ActorDocument
-from requests_aws4auth import AWS4Auth
+from films.documents import MovieDocument, ActorDocument, ANALYZER_PROFILES
+from films.indexing import (create_versioned_index, swap_alias, get_checkpoint, save_checkpoint,
+                            export_actions, bulk_index, BATCH_SIZE, THREAD_COUNT)
+from films.connections import get_client
+
 
 class Command(BaseCommand):
     """
-    Команда для обновления всех индексов Elastic search
+    Команда для обновления всех индексов Elastic search. Алиас переключается
+    и время запуска сохраняется только при индексации без ошибок.
+    С --since удаленные из базы объекты из индекса не удаляются:
+    удаления отправляет очередь индексации, полная пересборка их учитывает
     python manage.py index_movies
+    python manage.py index_movies --since
+    python manage.py index_movies --analyzer movie=edge_ngram
     """
 
     help = 'Indexes Movies and Persons in Elastic Search'
-    def handle(self, *args, **options):
-        if settings.IS_DEPLOYED:
-            region = settings.AWS_REGION
-            service = 'es'
-            awsauth = AWS4Auth(settings.AWS_ACCESS_KEY, settings.AWS_SECRET_KEY, region, service)
-            es = Elasticsearch(
-                [{'host': settings.ES_HOST, 'port': settings.ES_PORT, 'url_prefix': 'es', 'use_ssl': True}],
-                index="movie",
-                http_auth = awsauth,
-                use_ssl = True,
-                verify_certs = True,
-                connection_class = RequestsHttpConnection
-            )
-        else:
-            es = Elasticsearch(
-                [{'host': 'localhost', 'port': '9200'}],
-                index="movie",
-            )
-        movie_index = Index('movie', using='default')
-        movie_index.document(MovieDocument)
-        if movie_index.exists():
-            movie_index.delete()
-            print('Deleted movie index.')
-        MovieDocument.init()
-        result = bulk(
-            client=es,
-            actions=(movie.indexing() for movie in Movie.objects.all().iterator())
-        )
-        print('Indexed movies.')
-        print(result)
 
-        if settings.IS_DEPLOYED:
-            region = settings.AWS_REGION
-            service = 'es'
-            awsauth = AWS4Auth(settings.AWS_ACCESS_KEY, settings.AWS_SECRET_KEY, region, service)
-            es = Elasticsearch(
-                [{'host': settings.ES_HOST, 'port': settings.ES_PORT, 'url_prefix': 'es', 'use_ssl': True}],
-                index="actor",
-                http_auth = awsauth,
-                use_ssl = True,
-                verify_certs = True,
-                connection_class = RequestsHttpConnection
-            )
-        else:
-            es = Elasticsearch(
-                [{'host': 'localhost', 'port': '9200'}],
-                index="actor",
-            )
-        actor_index = Index('actor', using='default')
-        actor_index.document(ActorDocument)
-        if actor_index.exists():
-            actor_index.delete()
-            print('Deleted actor index.')
-        ActorDocument.init()
-        result = bulk(
-            client=es,
-            actions=(actor.indexing() for actor in Person.objects.all().iterator())
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since', nargs='?', const='checkpoint',
+            help='Reindex only rows updated after the given ISO datetime '
+                 'or, without a value, after the last successful run. '
+                 'Documents of deleted rows are not removed, run a full rebuild for that'
         )
-        print('Indexed actors.')
-        print(result)
+        parser.add_argument('--chunk-size', type=int, default=BATCH_SIZE,
+                            help='Documents per bulk request and per translations query')
+        parser.add_argument('--threads', type=int, default=THREAD_COUNT,
+                            help='Number of parallel bulk threads')
+        parser.add_argument(
+            '--analyzer', action='append', default=[],
+            help='Analyzer profile of the rebuilt indexes: PROFILE for all indexes '
+                 f'or INDEX=PROFILE, one of {", ".join(ANALYZER_PROFILES)}'
+        )
+
+    def get_profiles(self, values):
+        profiles = {}
+        for value in values:
+            index, _, profile = value.rpartition('=')
+            if profile not in ANALYZER_PROFILES:
+                raise CommandError(f'Unknown analyzer profile: {profile}')
+            for document in (MovieDocument, ActorDocument):
+                if index in ('', document._index._name):
+                    profiles[document] = profile
+        return profiles
+
+    def get_since(self, option, alias):
+        if option == 'checkpoint':
+            return get_checkpoint(alias)
+        since = parse_datetime(option)
+        if since is None:
+            raise CommandError(f'Invalid datetime: {option}')
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
+
+    def index(self, es, queryset, index):
+        # Ошибки индексации прерывают команду до переключения алиаса и сохранения времени запуска
+        actions = export_actions(queryset, index, self.chunk_size)
+        success, errors, elapsed = bulk_index(es, actions, self.chunk_size, self.threads)
+        rate = success / elapsed if elapsed else 0
+        print(f'Indexed {success} documents into {index} in {elapsed:.1f}s ({rate:.0f} docs/sec).')
+        for error in errors[:10]:
+            print(error)
+        if errors:
+            raise CommandError(f'Failed to index {len(errors)} documents into {index}.')
+
+    def rebuild(self, es, model, document, profile=None):
+        """
+        Индексирует все объекты в новый индекс и переключает на него алиас,
+        поиск во время индексации продолжает работать со старым индексом
+        """
+        alias = document._index._name
+        started = timezone.now()
+        index = create_versioned_index(document, profile=profile)
+        print(f'Created {index} index.')
+        try:
+            self.index(es, model.objects.all(), index)
+        except CommandError:
+            # Неполный индекс не заменяет рабочий, алиас остается на старом индексе
+            es.indices.delete(index=index)
+            print(f'Deleted {index} index, {alias} is unchanged.')
+            raise
+
+        old = swap_alias(es, alias, index)
+        print(f'Alias {alias} points to {index}.')
+        try:
+            # Объекты, измененные во время индексации, могли попасть в старый индекс
+            self.index(es, model.objects.filter(updated__gte=started), alias)
+        finally:
+            # Старые индексы не нужны и при ошибке: новый полон на момент started
+            for name in old:
+                es.indices.delete(index=name)
+                print(f'Deleted {name} index.')
+        return started
+
+    def update(self, es, model, document, since):
+        alias = document._index._name
+        started = timezone.now()
+        queryset = model.objects.filter(updated__gte=since)
+        print(f'Updating {alias} since {since.isoformat()}.')
+        self.index(es, queryset, alias)
+        return started
+
+    def handle(self, *args, **options):
+        self.chunk_size = options['chunk_size']
+        self.threads = options['threads']
+        profiles = self.get_profiles(options['analyzer'])
+        if profiles and options['since']:
+            raise CommandError('--analyzer requires a full rebuild and cannot be used with --since')
+        es = get_client()
+        for model, document in ((Movie, MovieDocument), (Person, ActorDocument)):
+            alias = document._index._name
+            since = self.get_since(options['since'], alias) if options['since'] else None
+            if options['since'] and since is None:
+                print(f'No checkpoint for {alias}, rebuilding the whole index.')
+            if since is None:
+                started = self.rebuild(es, model, document, profiles.get(document))
+            else:
+                started = self.update(es, model, document, since)
+            save_checkpoint(alias, started)
+            print(f'Indexed {alias}.')
@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from films.indexing import DatabaseQueue, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Команда для обработки очереди индексации при INDEXING_QUEUE['MODE'] = 'database'
+    python manage.py process_indexing_queue
+    """
+
+    help = 'Flushes pending Movies and Persons to Elastic search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Process the queue once and exit')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        queue = DatabaseQueue()
+        while True:
+            processed = queue.process(options['batch_size'])
+            if processed:
+                print(f'Processed {processed} indexing tasks.')
+            if options['once'] and processed < options['batch_size']:
+                break
+            if processed < options['batch_size']:
+                time.sleep(options['interval'])
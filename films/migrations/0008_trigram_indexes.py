@@ -0,0 +1,28 @@
+# Generated by Django 2.2.16 on 2026-10-18 14:05
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0007_auto_20201116_1642'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='movie',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['orig_title'], name='movie_orig_title_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='movietranslations',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['title'], name='movie_translation_title_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='persontranslation',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='person_translation_name_trgm', opclasses=['gin_trgm_ops']),
+        ),
+    ]
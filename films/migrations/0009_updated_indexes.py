@@ -0,0 +1,25 @@
+# Generated by Django 2.2.16 on 2026-10-18 14:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0008_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='collection',
+            index=models.Index(fields=['updated', 'id'], name='collection_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['updated', 'id'], name='movie_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['updated', 'id'], name='person_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.16 on 2026-10-18 14:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0009_updated_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexingTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('movie', 'Фильм'), ('person', 'Человек')], max_length=10, verbose_name='Тип')),
+                ('object_id', models.PositiveIntegerField(verbose_name='ID объекта')),
+                ('updated', models.DateTimeField(verbose_name='Дата обновления')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Попытки')),
+            ],
+            options={
+                'verbose_name': 'Задача индексации',
+                'verbose_name_plural': 'Задачи индексации',
+                'ordering': ['updated'],
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+    ]
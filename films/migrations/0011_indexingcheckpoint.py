@@ -0,0 +1,25 @@
+# Generated by Django 2.2.16 on 2026-10-18 14:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0010_indexingtask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexingCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.CharField(max_length=50, unique=True, verbose_name='Индекс')),
+                ('last_run', models.DateTimeField(verbose_name='Последний запуск')),
+            ],
+            options={
+                'verbose_name': 'Контрольная точка индексации',
+                'verbose_name_plural': 'Контрольные точки индексации',
+            },
+        ),
+    ]
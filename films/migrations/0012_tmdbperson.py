@@ -0,0 +1,27 @@
+# Generated by Django 2.2.16 on 2026-10-18 14:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0011_indexingcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TMDBPerson',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tmdb_id', models.PositiveIntegerField(unique=True, verbose_name='ID на TMDB')),
+                ('fetched', models.DateTimeField(verbose_name='Дата загрузки профиля')),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tmdb', to='films.Person', verbose_name='Человек')),
+            ],
+            options={
+                'verbose_name': 'Человек TMDB',
+                'verbose_name_plural': 'Люди TMDB',
+            },
+        ),
+    ]
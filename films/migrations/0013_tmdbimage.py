@@ -0,0 +1,26 @@
+# Generated by Django 2.2.16 on 2026-10-18 14:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0012_tmdbperson'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TMDBImage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=200, unique=True, verbose_name='Путь на TMDB')),
+                ('name', models.CharField(max_length=200, verbose_name='Файл')),
+                ('digest', models.CharField(db_index=True, max_length=64, verbose_name='Хеш содержимого')),
+            ],
+            options={
+                'verbose_name': 'Изображение TMDB',
+                'verbose_name_plural': 'Изображения TMDB',
+            },
+        ),
+    ]
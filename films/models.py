@@ -1,10 +1,12 @@
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.conf import settings
 from pytils.translit import slugify
 from .documents import MovieDocument, ActorDocument
+from .translations import pick_translation, get_lookup_languages, get_fallback_language
 from parler.models import TranslatableModel, TranslatedFields
-from django.utils.translation import get_language, get_language_info
+from django.utils.translation import get_language_info
 from django.utils.translation import gettext_lazy as _
 
 
@@ -40,6 +42,10 @@ class Movie(models.Model):
         unique_together = [
             ('orig_title', 'release_date'),
         ]
+        indexes = [
+            GinIndex(fields=['orig_title'], name='movie_orig_title_trgm', opclasses=['gin_trgm_ops']),
+            models.Index(fields=['updated', 'id'], name='movie_updated_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         super(Movie, self).save()
@@ -53,20 +59,37 @@ class Movie(models.Model):
         return self.cast.all()[:8]
 
     def get_translate(self):
-        return self.translations.get(language_code=get_language())
+        if not hasattr(self, '_translation'):
+            translations = self.translations.all()
+            if 'translations' not in getattr(self, '_prefetched_objects_cache', {}):
+                translations = translations.filter(language_code__in=get_lookup_languages())
+            self._translation = pick_translation(translations)
+        return self._translation
 
     def get_available_translations(self):
         return self.translations.all()
 
-    def indexing(self):
+    def get_document(self):
+        translations = list(self.translations.all())
+        genres = list(self.genres.all())
+        poster = pick_translation([t for t in translations if t.poster], get_fallback_language())
         doc = MovieDocument(
             meta={'id': self.id},
-            translations=[t.title for t in self.translations.all()],
+            translations=[t.title for t in translations],
             orig_title=self.orig_title,
-            id=self.id
+            id=self.id,
+            slug=self.slug,
+            image=poster.poster.name if poster else None,
+            suggest=list({self.orig_title, *(t.title for t in translations)}),
+            imdb_rating=self.imdb_rating,
+            release_date=self.release_date,
+            release_year=self.release_date.year if self.release_date else None,
+            age_limit=self.age_limit,
+            genres=[t.slug for genre in genres for t in genre.translations.all()],
+            genre_ids=[genre.id for genre in genres],
+            cards={t.language_code: t.get_card() for t in translations}
         )
-        doc.save()
-        return doc.to_dict(include_meta=True)
+        return doc
 
 
 class MovieTranslations(models.Model):
@@ -90,6 +113,9 @@ class MovieTranslations(models.Model):
         unique_together = [
             ('movie', 'language_code'),
         ]
+        indexes = [
+            GinIndex(fields=['title'], name='movie_translation_title_trgm', opclasses=['gin_trgm_ops']),
+        ]
 
     def __str__(self):
         return self.title
@@ -97,6 +123,17 @@ class MovieTranslations(models.Model):
     def translate_detail(self):
         return get_language_info(self.language_code)
 
+    def get_card(self):
+        # Поля перевода для карточки фильма в поисковом индексе
+        return {
+            'id': self.id,
+            'title': self.title,
+            'description': self.description,
+            'country': self.country,
+            'tagline': self.tagline,
+            'poster': self.poster.name or None,
+        }
+
 
 class Genre(TranslatableModel):
     """Жанр фильма"""
@@ -128,7 +165,10 @@ class Person(TranslatableModel):
         biography = models.TextField(max_length=3000, null=True, blank=True,
                                      verbose_name=_('Биография')),
         birth_place = models.CharField(max_length=50, null=True, blank=True,
-                                       verbose_name=_('Место рождения'))
+                                       verbose_name=_('Место рождения')),
+        meta={'indexes': [
+            GinIndex(fields=['name'], name='person_translation_name_trgm', opclasses=['gin_trgm_ops']),
+        ]}
     )
     photo = models.ImageField(upload_to='movie/actors/', null=True, blank=True,
                               verbose_name=_('Фото'))
@@ -139,6 +179,9 @@ class Person(TranslatableModel):
         verbose_name_plural = _('Люди')
         verbose_name = _('Человек')
         ordering = ['-updated']
+        indexes = [
+            models.Index(fields=['updated', 'id'], name='person_updated_idx'),
+        ]
         unique_together = [
             ('photo', 'birth_date'),
         ]
@@ -151,14 +194,18 @@ class Person(TranslatableModel):
         self.slug = slugify(f'{self.id}-{self.name}')
         super(Person, self).save()
 
-    def indexing(self):
+    def get_document(self):
+        translations = list(self.translations.all())
         doc = ActorDocument(
             meta={'id': self.id},
-            name=[t.name for t in self.translations.all()],
-            id=self.id
+            name=[t.name for t in translations],
+            id=self.id,
+            slug=self.safe_translation_getter('slug', language_code=get_fallback_language(), any_language=True),
+            image=self.photo.name or None,
+            suggest=list({t.name for t in translations}),
+            cards={t.language_code: {'name': t.name, 'slug': t.slug} for t in translations}
         )
-        doc.save()
-        return doc.to_dict(include_meta=True)
+        return doc
 
 
 class Collection(models.Model):
@@ -177,9 +224,79 @@ class Collection(models.Model):
         verbose_name_plural = _('Коллекции')
         verbose_name = _('Коллекция')
         ordering = ['-updated']
+        indexes = [
+            models.Index(fields=['updated', 'id'], name='collection_updated_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
     def get_films(self):
+        if hasattr(self, '_films'):
+            return self._films
         return self.movies.all()[:8]
+
+
+class IndexingTask(models.Model):
+    """Объект, ожидающий переиндексации в Elastic search"""
+    KINDS = (
+        ('movie', _('Фильм')),
+        ('person', _('Человек')),
+    )
+    kind = models.CharField(max_length=10, choices=KINDS, verbose_name=_('Тип'))
+    object_id = models.PositiveIntegerField(verbose_name=_('ID объекта'))
+    updated = models.DateTimeField(verbose_name=_('Дата обновления'))
+    attempts = models.PositiveIntegerField(default=0, verbose_name=_('Попытки'))
+
+    class Meta:
+        verbose_name_plural = _('Задачи индексации')
+        verbose_name = _('Задача индексации')
+        ordering = ['updated']
+        unique_together = [
+            ('kind', 'object_id'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id}'
+
+
+class IndexingCheckpoint(models.Model):
+    """Время последней успешной индексации для инкрементального обновления"""
+    index = models.CharField(max_length=50, unique=True, verbose_name=_('Индекс'))
+    last_run = models.DateTimeField(verbose_name=_('Последний запуск'))
+
+    class Meta:
+        verbose_name_plural = _('Контрольные точки индексации')
+        verbose_name = _('Контрольная точка индексации')
+
+    def __str__(self):
+        return f'{self.index} {self.last_run}'
+
+
+class TMDBPerson(models.Model):
+    """Соответствие человека на TMDB человеку в базе для повторного парсинга"""
+    tmdb_id = models.PositiveIntegerField(unique=True, verbose_name=_('ID на TMDB'))
+    person = models.ForeignKey(Person, on_delete=models.CASCADE, related_name='tmdb',
+                               verbose_name=_('Человек'))
+    fetched = models.DateTimeField(verbose_name=_('Дата загрузки профиля'))
+
+    class Meta:
+        verbose_name_plural = _('Люди TMDB')
+        verbose_name = _('Человек TMDB')
+
+    def __str__(self):
+        return f'{self.tmdb_id} {self.person_id}'
+
+
+class TMDBImage(models.Model):
+    """Изображение TMDB, уже сохраненное в хранилище"""
+    path = models.CharField(max_length=200, unique=True, verbose_name=_('Путь на TMDB'))
+    name = models.CharField(max_length=200, verbose_name=_('Файл'))
+    digest = models.CharField(max_length=64, db_index=True, verbose_name=_('Хеш содержимого'))
+
+    class Meta:
+        verbose_name_plural = _('Изображения TMDB')
+        verbose_name = _('Изображение TMDB')
+
+    def __str__(self):
+        return self.path
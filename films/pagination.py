@@ -0,0 +1,186 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .search import get_size
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по курсору из значений полей сортировки последней строки.
+    Следующая страница выбирается условием (поле, id) < (значение, id),
+    а не OFFSET, поэтому глубокие страницы стоят столько же, сколько первая
+    """
+    ordering = ('-updated', '-id')
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+
+        cursor = self.decode_cursor(request)
+        self.reverse = cursor is not None and cursor['reverse']
+        ordering = self.get_ordering(self.reverse)
+
+        queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            queryset = queryset.filter(self.get_keyset_filter(ordering, cursor['position']))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_ordering(self, reverse=False):
+        if not reverse:
+            return list(self.ordering)
+        return [field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering]
+
+    def get_keyset_filter(self, ordering, position):
+        # (a, b) < (x, y) раскрывается в a < x OR (a = x AND b < y)
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def get_fields(self):
+        return [self.model._meta.get_field(field.lstrip('-')) for field in self.ordering]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            values = data['p']
+            fields = self.get_fields()
+            if len(values) != len(fields):
+                raise ValueError
+            position = [field.to_python(value) for field, value in zip(fields, values)]
+            return {'reverse': bool(data['r']), 'position': position}
+        except Exception:
+            raise ParseError(self.invalid_cursor_message)
+
+    def encode_cursor(self, instance, reverse):
+        values = [field.value_to_string(instance) for field in self.get_fields()]
+        data = json.dumps({'r': int(reverse), 'p': values}, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_data(self, data):
+        return OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ])
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+
+class RatingKeysetPagination(KeysetPagination):
+    # Постраничный вывод фильмов от высокого рейтинга IMDB к низкому
+    ordering = ('-imdb_rating', '-id')
+
+
+class SearchPagination:
+    """
+    Постраничный вывод результатов поиска. Курсор следующей страницы
+    содержит значения сортировки последнего результата (релевантность, id),
+    которые передаются движку как search_after, поэтому глубокие страницы
+    не используют from/size. Курсор ведет только вперед. Общее количество
+    результатов считается только при параметре total
+    """
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    total_query_param = 'total'
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_search(self, method, query, request, **options):
+        self.base_url = request.build_absolute_uri()
+        self.page = method(
+            query, self.get_page_size(request), self.decode_cursor(request), self.get_total(request), **options
+        )
+        return self.page.results
+
+    def get_page_size(self, request):
+        # Старый параметр q задает размер, если page_size не передан
+        params = request.query_params
+        return get_size(params.get(self.page_size_query_param, params.get('q')))
+
+    def get_total(self, request):
+        return request.query_params.get(self.total_query_param, '').lower() in ('1', 'true')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            score, pk = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            return [float(score), int(pk)]
+        except Exception:
+            raise ParseError(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if self.page.after is None:
+            return None
+        data = json.dumps(self.page.after, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_paginated_data(self, data):
+        result = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', None),
+        ])
+        if self.page.total is not None:
+            result['count'] = self.page.total
+        result['results'] = data
+        return result
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
@@ -1,14 +1,24 @@
-from datetime import date
-from multiprocessing import Pool
-from .tmdb_parse import get_html, get_links, parse_content
-from .models import Movie, Person, Genre, MovieTranslations
-from urllib.parse import urlparse
-import requests
-from django.core.files.base import ContentFile
+import time
+from datetime import date, timedelta
+from uuid import uuid4
+from . import cache
+from .crawler import crawl, PERSON_MAX_AGE
+from .images import save_images
+from .indexing import enqueue_many
+from .models import Movie, Person, Genre, MovieTranslations, TMDBPerson
+from django.db import connection, transaction
+from django.utils import timezone
 from django.utils.translation import get_language, get_language_info
+from pytils.translit import slugify
 
 
-URL = 'https://www.themoviedb.org/movie/'
+# Фильмов в одной транзакции загрузки
+BATCH_SIZE = 100
+# Строк в одном запросе INSERT
+INSERT_BATCH_SIZE = 500
+GenreTranslation = Genre._parler_meta.root_model
+PersonTranslation = Person._parler_meta.root_model
+PERSON_FIELDS = ('name', 'slug', 'career', 'gender', 'biography', 'birth_place')
 
 
 def get_formated_date(data):
@@ -23,173 +33,323 @@ def get_formated_date(data):
     return formated_date
 
 
-def save_img(url, model):
-    name = urlparse(url).path.split('/')[-1]
-    response = requests.get(url)
-    if response.status_code == 200:
-        model.save(name, ContentFile(response.content), save=True)
-        return True
-    return False
-
-
-def get_or_create_person(data):
-    try:
-        person = Person.objects.get(translations__name=data['name'])
-        created = False
-    except:
-        person  = Person.objects.create(
-            name=data['name'],
-            biography = data['biography'],
-            career = data['career'],
-            gender =  data['gender'],
-            birth_date = get_formated_date(data['birth_date']),
-            birth_place = data['birth_place']
+def get_known_people(max_age=PERSON_MAX_AGE):
+    # TMDB id людей, профили которых загружены меньше max_age дней назад
+    since = timezone.now() - timedelta(days=max_age)
+    return set(TMDBPerson.objects.filter(fetched__gte=since).values_list('tmdb_id', flat=True))
+
+
+def get_release_date(movie, language):
+    # Дата выхода из частей даты, в английской версии месяц идет первым
+    parts = movie['release_date']
+    if not parts:
+        return None
+    if language == 'en':
+        parts = [parts[1], parts[0], parts[2]]
+    return get_formated_date(parts[::-1])
+
+
+def insert(objects):
+    """
+    Создает объекты одной модели пачками. id новых строк возвращает
+    только PostgreSQL, на других базах объекты сохраняются по одному
+    """
+    if not objects:
+        return objects
+    model = type(objects[0])
+    if connection.features.can_return_ids_from_bulk_insert:
+        return model.objects.bulk_create(objects, INSERT_BATCH_SIZE)
+    for obj in objects:
+        super(model, obj).save()
+    return objects
+
+
+def resolve_genres(titles, language, stats):
+    """
+    id жанров по названиям на любом языке, недостающие жанры
+    создаются с переводом на language
+    """
+    ids = {}
+    for title, pk in GenreTranslation.objects.filter(title__in=titles).values_list('title', 'master_id'):
+        ids.setdefault(title, pk)
+    missing = [title for title in titles if title not in ids]
+    genres = insert([Genre() for title in missing])
+    GenreTranslation.objects.bulk_create([
+        GenreTranslation(master_id=genre.id, language_code=language, title=title, slug=slugify(title))
+        for genre, title in zip(genres, missing)
+    ], INSERT_BATCH_SIZE)
+    ids.update((title, genre.id) for genre, title in zip(genres, missing))
+    stats['rows'] += 2 * len(missing)
+    return ids
+
+
+def person_key(data):
+    # Человек в порции определяется TMDB id, без него именем
+    return data.get('tmdb_id') or data['name']
+
+
+def translate_person(pk, data, language, translation=None):
+    translation = translation or PersonTranslation(master_id=pk, language_code=language)
+    translation.name = data['name']
+    translation.slug = slugify(f'{pk}-{data["name"]}')
+    translation.career = data['career']
+    translation.gender = data['gender']
+    translation.biography = data['biography']
+    translation.birth_place = data['birth_place']
+    return translation
+
+
+def update_people(people, language, stats):
+    # Обновление устаревших профилей {id: данные} и их переводов на language
+    if not people:
+        return
+    now = timezone.now()
+    Person.objects.bulk_update([
+        Person(id=pk, birth_date=get_formated_date(data['birth_date']), updated=now)
+        for pk, data in people.items()
+    ], ['birth_date', 'updated'], INSERT_BATCH_SIZE)
+    existing = {
+        translation.master_id: translation
+        for translation in PersonTranslation.objects.filter(master_id__in=people, language_code=language)
+    }
+    PersonTranslation.objects.bulk_update([
+        translate_person(pk, people[pk], language, translation) for pk, translation in existing.items()
+    ], PERSON_FIELDS, INSERT_BATCH_SIZE)
+    PersonTranslation.objects.bulk_create([
+        translate_person(pk, data, language) for pk, data in people.items() if pk not in existing
+    ], INSERT_BATCH_SIZE)
+    stats['rows'] += 2 * len(people)
+
+
+def resolve_people(people, language, stats):
+    """
+    Люди порции {ключ: данные} по TMDB id, затем по имени. Недостающие
+    люди создаются с переводом на language, загруженные заново профили
+    обновляются. Возвращает {ключ: (id, создан)} и id обновленных людей
+    """
+    now = timezone.now()
+    tmdb_ids = [key for key in people if isinstance(key, int)]
+    known = dict(TMDBPerson.objects.filter(tmdb_id__in=tmdb_ids).values_list('tmdb_id', 'person_id'))
+    result = {key: (known[key], False) for key in people if key in known}
+    refreshed = {known[key]: people[key] for key in result if 'name' in people[key]}
+
+    unknown = {key: data for key, data in people.items() if key not in known and 'name' in data}
+    names = {}
+    translations = PersonTranslation.objects.filter(name__in=[data['name'] for data in unknown.values()])
+    for name, pk in translations.values_list('name', 'master_id'):
+        names.setdefault(name, pk)
+    result.update((key, (names[data['name']], False)) for key, data in unknown.items() if data['name'] in names)
+
+    missing = [key for key in unknown if key not in result]
+    persons = insert([
+        Person(birth_date=get_formated_date(people[key]['birth_date'])) for key in missing
+    ])
+    PersonTranslation.objects.bulk_create([
+        translate_person(person.id, people[key], language) for key, person in zip(missing, persons)
+    ], INSERT_BATCH_SIZE)
+    result.update((key, (person.id, True)) for key, person in zip(missing, persons))
+    stats['rows'] += 2 * len(missing)
+
+    update_people(refreshed, language, stats)
+    mapped = [key for key in unknown if isinstance(key, int)]
+    TMDBPerson.objects.bulk_create([
+        TMDBPerson(tmdb_id=key, person_id=result[key][0], fetched=now) for key in mapped
+    ], INSERT_BATCH_SIZE, ignore_conflicts=True)
+    TMDBPerson.objects.filter(tmdb_id__in=[known_id for known_id in known if 'name' in people[known_id]]).update(fetched=now)
+    stats['rows'] += len(mapped) + len(refreshed)
+    return result, set(refreshed)
+
+
+def get_person_names(people, ids, language):
+    # Имена людей для отчета: из загруженных профилей или из базы
+    names = {pk: people[key]['name'] for key, (pk, created) in ids.items() if 'name' in people[key]}
+    missing = {pk for pk, created in ids.values() if pk not in names}
+    for pk, name, code in PersonTranslation.objects.filter(master_id__in=missing).values_list(
+            'master_id', 'name', 'language_code'):
+        if pk not in names or code == language:
+            names[pk] = name
+    return names
+
+
+def load_batch(movies, language, stats):
+    """
+    Загружает порцию фильмов: жанры, люди и фильмы находятся
+    запросами IN, недостающие строки и связи создаются пачками.
+    Возвращает подробности по фильмам, постеры и фото для загрузки
+    """
+    details, images = {}, {'posters': [], 'photos': []}
+    now = timezone.now()
+
+    genres = resolve_genres(sorted({genre for movie in movies for genre in movie['genres']}), language, stats)
+    people = {}
+    for movie in movies:
+        for data in movie['directors'] + movie['cast']:
+            key = person_key(data)
+            if key not in people or 'name' in data:
+                people[key] = data
+    person_ids, refreshed = resolve_people(people, language, stats)
+    names = get_person_names(people, person_ids, language)
+    for key, (pk, is_created) in person_ids.items():
+        if is_created and people[key].get('photo'):
+            images['photos'].append((pk, people[key]['photo']))
+
+    existing = {}
+    for film in Movie.objects.filter(orig_title__in=[movie['orig_title'] for movie in movies]):
+        existing.setdefault(film.orig_title, film)
+    new = [movie for movie in movies if movie['orig_title'] not in existing]
+    films = insert([
+        Movie(
+            orig_title=movie['orig_title'],
+            slug=uuid4().hex,
+            release_date=get_release_date(movie, language),
+            age_limit=movie['age_limit'],
+            imdb_rating=movie['imdb_rating'],
+            duration=movie['duration'],
+            fullness=50,
         )
-        created = True
-    return person, created
-
-
-def load_to_db(movies):
-    movie_details = {}
+        for movie in new
+    ])
+    for film in films:
+        film.slug = slugify(f'{film.id}-{film.orig_title}')
+    Movie.objects.bulk_update(films, ['slug'], INSERT_BATCH_SIZE)
+    created = {film.orig_title: film for film in films}
+    stats['rows'] += len(films)
+
+    incomplete = [film.id for film in existing.values() if film.fullness <= 60]
+    translated = set(MovieTranslations.objects.filter(
+        movie_id__in=incomplete, language_code=language
+    ).values_list('movie_id', flat=True))
+    filled = {
+        name: set(getattr(Movie, name).through.objects.filter(
+            movie_id__in=incomplete
+        ).values_list('movie_id', flat=True))
+        for name in ('genres', 'directors', 'cast')
+    }
+
+    translations, updated = [], []
+    links = {'genres': {}, 'directors': {}, 'cast': {}}
+    created_people = {pk for pk, is_created in person_ids.values() if is_created}
+
+    def link(name, film, ids, detail=None):
+        for pk in ids:
+            links[name].setdefault((film.id, pk))
+        if detail is not None:
+            detail[name] = {
+                names.get(pk): 'created' if pk in created_people else 'added' for pk in ids
+            }
 
     for movie in movies:
         print(f'Loading {movie["translated_title"]}')
-
-        if get_language() == 'en':
-            movie['release_date'] = [movie['release_date'][1], movie['release_date'][0], movie['release_date'][2]]
-        film, created = Movie.objects.get_or_create(
-            orig_title=movie['orig_title'],
-            defaults={
-                'release_date': get_formated_date(movie['release_date'][::-1]),
-                'age_limit': movie['age_limit'],
-                'imdb_rating': movie['imdb_rating'],
-                'duration': movie['duration'],
-                'fullness': 50,
-            }
+        detail = details[movie['translated_title']] = {
+            'status': 'created' if movie['orig_title'] in created else 'exists',
+            'changed': 'no changes',
+            'genres': 'no changes',
+        }
+        directors = [person_ids[key][0] for key in map(person_key, movie['directors']) if key in person_ids]
+        cast = [person_ids[key][0] for key in map(person_key, movie['cast'][::-1]) if key in person_ids]
+        genre_ids = [genres[genre] for genre in movie['genres']]
+        translation = MovieTranslations(
+            language_code=language,
+            title=movie['translated_title'],
+            description=movie['description'],
+            tagline=movie['tagline']
         )
 
-        movie_details[movie['translated_title']] = {}
-        movie_detail = movie_details[movie['translated_title']]
-        movie_detail['status'] = 'created' if created else 'exists'
-        movie_detail['changed'] = 'no changes'
-        movie_detail['genres'] = 'no changes'
-
-        if created:
-            translate = MovieTranslations.objects.create(
-                language_code=get_language(),
-                movie=film,
-                title=movie['translated_title'],
-                description=movie['description'],
-                tagline=movie['tagline']
-            )
-            poster = save_img(movie['poster'], translate.poster)
-
-            for genre in movie['genres']:
-                try:
-                    genre_obj = Genre.objects.get(translations__title=genre)
-                except:
-                    genre_obj  = Genre.objects.create(title=genre)
-                film.genres.add(genre_obj)
-
-            for director in movie['directors']:
-                persona, created = get_or_create_person(director)
-                film.directors.add(persona)
-
-                if created and director['photo'] is not None:
-                    saved = save_img(director['photo'], persona.photo)
-
-            for person in movie['cast'][::-1]:
-                persona, created = get_or_create_person(person)
-                film.cast.add(persona)
-
-                if created and person['photo'] is not None:
-                    saved = save_img(person['photo'], persona.photo)
-
-        elif film.fullness <= 60:
-            movie_detail['changed'] = []
-
-            movie_translate, created = MovieTranslations.objects.get_or_create(
-                language_code=get_language(),
-                movie=film,
-                defaults={
-                    'title': movie['translated_title'],
-                    'description': movie['description'],
-                    'tagline': movie['tagline']
-                }
-            )
-            poster = save_img(movie['poster'], movie_translate.poster)
-            if created:
-                film.fullness += 5
-
-            if not film.age_limit or film.age_limit == '0+':
-                film.age_limit = movie['age_limit']
-                movie_detail['changed'].append('age_limit')
-            if not film.imdb_rating:
-                film.imdb_rating = movie['imdb_rating']
-                movie_detail['changed'].append('imdb_rating')
-            if not film.release_date:
-                film.release_date = get_formated_date(movie['release_date'][::-1])
-                movie_detail['changed'].append('release_date')
-            if not film.duration:
-                film.duration = movie['duration']
-                movie_detail['changed'].append('duration')
-
-            if not film.genres.all():
-                movie_detail['genres'] = {}
-
-                for genre in movie['genres']:
-                    try:
-                        genre_obj = Genre.objects.get(translations__title=genre)
-                    except:
-                        genre_obj  = Genre.objects.create(title=genre)
-                    film.genres.add(genre_obj)
-
-            if not film.directors.all():
-                movie_detail['directors'] = {}
-
-                for director in movie['directors']:
-                    persona, created = get_or_create_person(director)
-                    movie_detail['directors'][persona.name] = 'created' if created else 'added'
-                    film.directors.add(persona)
-
-                    if created and director['photo'] is not None:
-                        saved = save_img(director['photo'], persona.photo)
-
-            if not film.cast.all():
-                movie_detail['cast'] = {}
-
-                for person in movie['cast'][::-1]:
-                    persona, created = get_or_create_person(person)
-
-                    movie_detail['cast'][persona.name] = 'created' if created else 'added'
-                    film.cast.add(persona)
-
-                    if created and person['photo'] is not None:
-                        saved = save_img(person['photo'], persona.photo)
-
-            film.save()
-    return movie_details
+        if movie['orig_title'] in created:
+            film = created[movie['orig_title']]
+            translation.movie = film
+            translations.append(translation)
+            images['posters'].append((film.id, language, movie['poster']))
+            link('genres', film, genre_ids)
+            link('directors', film, directors)
+            link('cast', film, cast)
+            continue
+
+        film = existing[movie['orig_title']]
+        if film.fullness > 60:
+            continue
+
+        detail['changed'] = []
+        if film.id not in translated:
+            translation.movie = film
+            translations.append(translation)
+            film.fullness += 5
+        images['posters'].append((film.id, language, movie['poster']))
+
+        if not film.age_limit or film.age_limit == '0+':
+            film.age_limit = movie['age_limit']
+            detail['changed'].append('age_limit')
+        if not film.imdb_rating:
+            film.imdb_rating = movie['imdb_rating']
+            detail['changed'].append('imdb_rating')
+        if not film.release_date:
+            film.release_date = get_release_date(movie, language)
+            detail['changed'].append('release_date')
+        if not film.duration:
+            film.duration = movie['duration']
+            detail['changed'].append('duration')
+        film.updated = now
+        updated.append(film)
+
+        if film.id not in filled['genres']:
+            detail['genres'] = {}
+            link('genres', film, genre_ids)
+        if film.id not in filled['directors']:
+            link('directors', film, directors, detail)
+        if film.id not in filled['cast']:
+            link('cast', film, cast, detail)
+
+    MovieTranslations.objects.bulk_create(translations, INSERT_BATCH_SIZE)
+    Movie.objects.bulk_update(
+        updated, ['age_limit', 'imdb_rating', 'release_date', 'duration', 'fullness', 'updated'], INSERT_BATCH_SIZE
+    )
+    for name, field in (('genres', 'genre_id'), ('directors', 'person_id'), ('cast', 'person_id')):
+        through = getattr(Movie, name).through
+        through.objects.bulk_create([
+            through(movie_id=movie_id, **{field: pk}) for movie_id, pk in links[name]
+        ], INSERT_BATCH_SIZE, ignore_conflicts=True)
+        stats['rows'] += len(links[name])
+    stats['rows'] += len(translations) + len(updated)
+
+    # Пакетные запросы не отправляют сигналы, индексация и сброс кеша после фиксации
+    movie_ids = [film.id for film in films] + [film.id for film in updated]
+    enqueue_many('movie', movie_ids)
+    enqueue_many('person', created_people | refreshed)
+    transaction.on_commit(lambda: cache.invalidate_movies(movie_ids))
+    transaction.on_commit(lambda: cache.invalidate_persons(refreshed))
+    return details, images
+
+
+def load_to_db(movies, batch_size=BATCH_SIZE):
+    """
+    Загружает фильмы в базу порциями по batch_size, каждая порция
+    в своей транзакции. Повторы фильма в списке пропускаются.
+    Возвращает подробности по фильмам и изображения для загрузки
+    """
+    started = time.monotonic()
+    language = get_language()
+    stats = {'rows': 0}
+    unique = {}
+    for movie in movies:
+        unique.setdefault(movie['orig_title'], movie)
+    movies = list(unique.values())
 
+    details, images = {}, {'posters': [], 'photos': []}
+    for start in range(0, len(movies), batch_size):
+        with transaction.atomic():
+            batch_details, batch_images = load_batch(movies[start:start + batch_size], language, stats)
+        details.update(batch_details)
+        for name, items in batch_images.items():
+            images[name] += items
 
-def parse(quantity=1):
-    movie_links = []
-    for page in range(1, quantity+1):
-        params = {
-            'page': page,
-            'language': get_language()
-        }
-        html = get_html(URL, params)
-        if html.status_code == 200:
-            movie_links.extend(get_links(html.text))
-        else:
-            print('Error')
-
-    # movies = []
-    # for link in movie_links:
-    #     movies.append(parse_content(link))
+    elapsed = time.monotonic() - started
+    print(f'Loaded {len(movies)} movies, {stats["rows"]} rows in {elapsed:.2f} sec '
+          f'({stats["rows"] / elapsed if elapsed else 0:.0f} rows/sec)')
+    return details, images
 
-    with Pool(10) as p:
-        movies = p.map(parse_content, movie_links)
 
-    details = load_to_db(movies)
+def parse(quantity=1):
+    movies = crawl(quantity, known=get_known_people())
+    details, images = load_to_db(movies)
+    save_images(images)
     return details
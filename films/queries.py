@@ -0,0 +1,103 @@
+from django.db import connection
+from django.db.models import Max, OuterRef, Subquery
+from .models import Movie, Person, Genre, Collection
+from .translations import translated_prefetch, resolve_translations
+
+
+def movie_detail_queryset():
+    """
+    Фильмы со всеми связями для страницы фильма. Количество запросов
+    не зависит от размера актерского состава и списка жанров
+    """
+    return Movie.objects.prefetch_related(
+        'translations',
+        translated_prefetch('cast', Person.objects.all()),
+        translated_prefetch('directors', Person.objects.all()),
+        translated_prefetch('genres', Genre.objects.all()),
+    )
+
+
+def prefetch_collection_films(collections, limit=8):
+    """
+    Загружает первые limit фильмов для каждой коллекции одним оконным
+    запросом (ROW_NUMBER по коллекции) и сохраняет их в атрибуте _films
+    """
+    collections = list(collections)
+    if not collections:
+        return collections
+
+    qn = connection.ops.quote_name
+    through = Collection.movies.through._meta
+    collection_column = qn(through.get_field('collection').column)
+    movie_column = qn(through.get_field('movie').column)
+    sql = (
+        'SELECT * FROM ('
+        'SELECT {movie}.*, {through}.{collection_column} AS collection_rank_id, '
+        'ROW_NUMBER() OVER (PARTITION BY {through}.{collection_column} '
+        'ORDER BY {movie}.{updated} DESC, {movie}.{id} DESC) AS collection_rank '
+        'FROM {through} INNER JOIN {movie} ON {movie}.{id} = {through}.{movie_column} '
+        'WHERE {through}.{collection_column} IN ({placeholders})'
+        ') ranked WHERE collection_rank <= %s '
+        'ORDER BY collection_rank_id, collection_rank'
+    ).format(
+        movie=qn(Movie._meta.db_table),
+        through=qn(through.db_table),
+        collection_column=collection_column,
+        movie_column=movie_column,
+        updated=qn(Movie._meta.get_field('updated').column),
+        id=qn(Movie._meta.pk.column),
+        placeholders=', '.join(['%s'] * len(collections)),
+    )
+    params = [collection.id for collection in collections] + [limit]
+
+    films = {collection.id: [] for collection in collections}
+    movies = list(Movie.objects.raw(sql, params))
+    for movie in movies:
+        films[movie.collection_rank_id].append(movie)
+    resolve_translations(movies)
+    for collection in collections:
+        collection._films = films[collection.id]
+    return collections
+
+
+def latest(values):
+    # Самая поздняя из дат обновления, None если дат нет
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def latest_related(relation):
+    # Последнее обновление людей фильма отдельным подзапросом, без соединения актеров с режиссерами
+    people = Person.objects.filter(**{relation: OuterRef('pk')}).order_by('-updated')
+    return Subquery(people.values('updated')[:1])
+
+
+def movie_last_modified(slug):
+    return latest(Movie.objects.filter(slug=slug).values_list(
+        'updated', latest_related('movie_cast'), latest_related('movie_director')
+    ).first() or ())
+
+
+def actor_last_modified(slug):
+    return latest(Person.objects.filter(translations__slug=slug).aggregate(
+        Max('updated'), Max('movie_cast__updated')
+    ).values())
+
+
+def genre_last_modified(slug):
+    return latest(Movie.objects.filter(genres__translations__slug=slug).aggregate(
+        Max('updated')
+    ).values())
+
+
+def collection_last_modified(pk):
+    return latest(Collection.objects.filter(pk=pk).aggregate(
+        Max('updated'), Max('movies__updated')
+    ).values())
+
+
+def collections_last_modified():
+    return latest([
+        Collection.objects.aggregate(Max('updated'))['updated__max'],
+        Movie.objects.aggregate(Max('updated'))['updated__max'],
+    ])
@@ -0,0 +1,114 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .cache import result_cache
+from .filters import parse_filters, freeze, describe_facets
+from .hydration import hydrate_movies, hydrate_persons, movie_from_source, person_from_source
+
+
+DEFAULT_SIZE = 10
+MAX_SIZE = 100
+
+METHODS = {'movie': 'search_movies', 'person': 'search_persons'}
+HYDRATORS = {'movie': hydrate_movies, 'person': hydrate_persons}
+FROM_SOURCE = {'movie': movie_from_source, 'person': person_from_source}
+
+_backends = None
+
+
+def get_size(value, default=DEFAULT_SIZE):
+    # Количество результатов из параметра запроса в допустимых пределах
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return min(max(size, 1), MAX_SIZE)
+
+
+def get_backends():
+    # Поисковые движки из settings.SEARCH_BACKENDS в порядке приоритета
+    global _backends
+    if _backends is None:
+        _backends = [import_string(path)() for path in settings.SEARCH_BACKENDS]
+    return _backends
+
+
+def run_backends(method, query, *args, **kwargs):
+    """
+    Выполняет поиск первым доступным движком, при ошибке движка
+    переходит к следующему. Возвращает результат и признак того,
+    что ответил запасной движок
+    """
+    backends = get_backends()
+    for backend in backends[:-1]:
+        try:
+            return getattr(backend, method)(query, *args, **kwargs), backend is not backends[0]
+        except Exception as e:
+            print(e)
+    return getattr(backends[-1], method)(query, *args, **kwargs), len(backends) > 1
+
+
+def get_timeout(fallback):
+    # Результаты запасного движка кешируются ненадолго, чтобы после восстановления основного не отдавать их
+    return result_cache.fallback_timeout if fallback else None
+
+
+def pack(page):
+    """
+    Страница для кеша результатов: _source документов для объектов,
+    построенных из индекса, иначе id объектов
+    """
+    return page._replace(results=tuple(getattr(obj, '_source', obj.id) for obj in page.results))
+
+
+def unpack(kind, page):
+    # Объекты страницы из кеша: из _source без обращения к базе или из базы по id
+    if page.results and isinstance(page.results[0], dict):
+        return page._replace(results=[FROM_SOURCE[kind](source) for source in page.results])
+    return page._replace(results=HYDRATORS[kind](page.results))
+
+
+def search(kind, query, size, after=None, total=False, **options):
+    """
+    Поиск с кешем результатов: из кеша берутся _source или id страницы
+    в порядке релевантности, объекты строятся так же, как при поиске
+    """
+    key = freeze((size, after, total, options))
+    page = result_cache.get(kind, query, key)
+    if page is not None:
+        return unpack(kind, page)
+    page, fallback = run_backends(METHODS[kind], query, size, after, total, **options)
+    result_cache.set(kind, query, key, pack(page), get_timeout(fallback))
+    return page
+
+
+def search_movies(query, size=DEFAULT_SIZE, after=None, total=False, filters=None, facets=False):
+    # Без фильтров и фасетов ключ кеша совпадает с ключом search_all
+    options = {}
+    if filters:
+        options['filters'] = filters
+    if facets:
+        options['facets'] = True
+    return search('movie', query, size, after, total, **options)
+
+
+def search_persons(query, size=DEFAULT_SIZE, after=None, total=False):
+    return search('person', query, size, after, total)
+
+
+def search_all(query, size=DEFAULT_SIZE):
+    """
+    Первые страницы фильмов и людей. Если ни одной нет в кеше, движок
+    получает обе за одно обращение, иначе ищется только недостающая
+    """
+    key = freeze((size, None, False, {}))
+    cached = {kind: result_cache.get(kind, query, key) for kind in METHODS}
+    if not any(cached.values()):
+        pages, fallback = run_backends('search_all', query, size)
+        pages = dict(zip(METHODS, pages))
+        for kind, page in pages.items():
+            result_cache.set(kind, query, key, pack(page), get_timeout(fallback))
+        return pages
+    return {
+        kind: unpack(kind, page) if page else search(kind, query, size)
+        for kind, page in cached.items()
+    }
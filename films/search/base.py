@@ -0,0 +1,27 @@
+from collections import namedtuple
+
+
+# Страница результатов поиска: объекты, значения сортировки последнего
+# результата для search_after следующей страницы, общее количество
+# и фасеты {фасет: [(значение, количество)]}
+SearchPage = namedtuple('SearchPage', ['results', 'after', 'total', 'facets'], defaults=(None,))
+
+
+class SearchBackend:
+    """
+    Базовый класс поискового движка. Движок возвращает страницу фильмов
+    или людей в порядке релевантности, не длиннее size. Страница начинается
+    после результата со значениями сортировки after, общее количество
+    результатов считается только при total=True. Фильмы отбираются
+    фильтрами filters из films.search.filters, фасеты считаются при facets=True
+    """
+
+    def search_movies(self, query, size, after=None, total=False, filters=None, facets=False):
+        raise NotImplementedError
+
+    def search_persons(self, query, size, after=None, total=False):
+        raise NotImplementedError
+
+    def search_all(self, query, size):
+        # Первые страницы фильмов и людей, движок может получить их одним запросом
+        return self.search_movies(query, size), self.search_persons(query, size)
@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import get_language
+
+
+SEARCH_CACHE = getattr(settings, 'SEARCH_CACHE', {})
+
+
+def normalize(query):
+    # Запрос без учета регистра и лишних пробелов
+    return ' '.join(query.casefold().split())
+
+
+def generation_key(kind):
+    return f'films:search:generation:{kind}'
+
+
+def get_generation(kind):
+    return cache.get(generation_key(kind), 0)
+
+
+def bump_generation(kind):
+    """
+    Увеличивает поколение индекса в кеше Django, после чего ранее
+    сохраненные результаты поиска по этому индексу больше не используются
+    """
+    key = generation_key(kind)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+class SearchResultCache:
+    """
+    Кеш результатов поиска в памяти процесса. Хранит страницы в виде
+    упорядоченных карточек _source из индекса или списков id, если движок
+    вернул объекты из базы, вытесняет давно использованные записи (LRU)
+    и записи старше timeout. Страницы запасного движка хранятся
+    fallback_timeout секунд. Поколение индекса в ключе берется из кеша
+    Django: сброс доходит до других процессов, только если CACHES['default']
+    общий для них, с LocMemCache остальные процессы видят изменения через timeout
+    """
+
+    def __init__(self, max_size=1024, timeout=300, fallback_timeout=10):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.fallback_timeout = fallback_timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, kind, query, options):
+        return (kind, normalize(query), get_language(), options, get_generation(kind))
+
+    def get(self, kind, query, options):
+        key = self.make_key(kind, query, options)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, kind, query, options, page, timeout=None):
+        key = self.make_key(kind, query, options)
+        timeout = self.timeout if timeout is None else timeout
+        with self.lock:
+            self.entries[key] = (time.monotonic() + timeout, page)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'timeout': self.timeout,
+            }
+
+
+result_cache = SearchResultCache(
+    max_size=SEARCH_CACHE.get('MAX_SIZE', 1024),
+    timeout=SEARCH_CACHE.get('TIMEOUT', 300),
+    fallback_timeout=SEARCH_CACHE.get('FALLBACK_TIMEOUT', 10),
+)
@@ -0,0 +1,149 @@
+from django.conf import settings
+from elasticsearch_dsl import A, MultiSearch, Q
+
+from ..connections import breaker, get_timeout
+from ..documents import MovieDocument, ActorDocument
+from .base import SearchBackend, SearchPage
+from .filters import RATING_RANGES
+from .hydration import hydrate_movies, hydrate_persons, movie_from_source, person_from_source
+
+
+# Подполя shingles есть только в индексах с профилем анализатора shingle
+MOVIE_FIELDS = ['orig_title', 'orig_title.shingles', 'translations', 'translations.shingles']
+PERSON_FIELDS = ['name', 'name.shingles']
+MOVIE_SOURCE = ['id', 'orig_title', 'slug', 'age_limit', 'imdb_rating', 'release_date', 'cards']
+PERSON_SOURCE = ['id', 'image', 'cards']
+
+# Агрегации фасетов фильмов
+FACETS = {
+    'genre': lambda: A('terms', field='genre_ids', size=100),
+    'year': lambda: A('terms', field='release_year', size=200, order={'_key': 'desc'}),
+    'rating': lambda: A('range', field='imdb_rating',
+                        ranges=[{'key': str(threshold), 'from': threshold} for threshold in RATING_RANGES]),
+    'age_limit': lambda: A('terms', field='age_limit', size=50),
+}
+
+
+def filter_queries(filters):
+    # Условия фильтра для каждой группы фильтров
+    queries = {}
+    if 'genre' in filters:
+        queries['genre'] = Q('terms', genres=list(filters['genre']))
+    if 'year' in filters:
+        year_from, year_to = filters['year']
+        queries['year'] = Q('range', release_year={
+            key: value for key, value in (('gte', year_from), ('lte', year_to)) if value is not None
+        })
+    if 'rating' in filters:
+        queries['rating'] = Q('range', imdb_rating={'gte': filters['rating']})
+    if 'age_limit' in filters:
+        queries['age_limit'] = Q('terms', age_limit=list(filters['age_limit']))
+    return queries
+
+
+def add_filters(s, filters, facets=False):
+    """
+    Фильтры применяются к результатам через post_filter, а каждый фасет
+    считается в том же запросе с фильтрами остальных групп, чтобы
+    выбранное значение не скрывало другие значения своего фасета
+    """
+    queries = filter_queries(filters or {})
+    if queries:
+        s = s.post_filter('bool', filter=list(queries.values()))
+    if facets:
+        for name, aggregation in FACETS.items():
+            others = [query for key, query in queries.items() if key != name]
+            s.aggs.bucket(name, 'filter', filter=Q('bool', filter=others)).bucket('values', aggregation())
+    return s
+
+
+def get_facets(response):
+    # Пары (значение, количество) из агрегаций фасетов
+    aggregations = response.to_dict().get('aggregations')
+    if not aggregations:
+        return None
+    facets = {}
+    for name in FACETS:
+        buckets = aggregations[name]['values']['buckets']
+        facets[name] = [(bucket['key'], bucket['doc_count']) for bucket in buckets if bucket['doc_count']]
+    facets['rating'] = [(int(key), count) for key, count in facets['rating']]
+    return facets
+
+
+def make_search(document, query, fields, size, source, after=None, total=False, filters=None, facets=False):
+    """
+    Запрос страницы найденных документов в порядке релевантности.
+    Результаты сортируются по (_score, id), следующая страница запрашивается
+    через search_after со значениями сортировки последнего результата, а не from.
+    Из _source запрашиваются только поля source, track_total_hits включается
+    только при total=True
+    """
+    s = document.search()
+    s = s.query('multi_match', query=query, fields=fields)
+    s = s.sort('_score', {'id': 'asc'})
+    s = s.source(source).extra(size=size, track_total_hits=total)
+    if after:
+        s = s.extra(search_after=list(after))
+    return add_filters(s, filters, facets)
+
+
+def get_page(response, size, total=False):
+    # Страница _source документов и фасеты из ответа Elasticsearch
+    hits = response.to_dict()['hits']
+    last = hits['hits'][-1]['sort'] if len(hits['hits']) == size else None
+    count = hits['total']['value'] if total else None
+    return SearchPage([hit['_source'] for hit in hits['hits']], last, count, get_facets(response))
+
+
+def search_sources(document, query, fields, size, source, after=None, total=False, filters=None, facets=False):
+    """
+    Возвращает страницу _source найденных документов. Пока размыкатель
+    открыт, запрос сразу завершается ошибкой CircuitOpen
+    """
+    s = make_search(document, query, fields, size, source, after, total, filters, facets)
+    s = s.params(request_timeout=get_timeout('search'))
+    return get_page(breaker.call(s.execute), size, total)
+
+
+class ElasticsearchBackend(SearchBackend):
+    """
+    Поиск по индексам movie и actor в Elasticsearch. В режиме 'index'
+    результаты собираются из карточек в _source без обращения к базе,
+    в режиме 'database' объекты загружаются из базы по найденным id,
+    например для проверки согласованности индекса
+    """
+
+    def __init__(self, source=None):
+        self.source = source or getattr(settings, 'SEARCH_RESULTS_SOURCE', 'index')
+
+    def get_source(self, source):
+        return ['id'] if self.source == 'database' else source
+
+    def movie_page(self, page):
+        if self.source == 'database':
+            return page._replace(results=hydrate_movies([source['id'] for source in page.results]))
+        return page._replace(results=[movie_from_source(source) for source in page.results])
+
+    def person_page(self, page):
+        if self.source == 'database':
+            return page._replace(results=hydrate_persons([source['id'] for source in page.results]))
+        return page._replace(results=[person_from_source(source) for source in page.results])
+
+    def search_movies(self, query, size, after=None, total=False, filters=None, facets=False):
+        source = self.get_source(MOVIE_SOURCE)
+        return self.movie_page(search_sources(
+            MovieDocument, query, MOVIE_FIELDS, size, source, after, total, filters, facets
+        ))
+
+    def search_persons(self, query, size, after=None, total=False):
+        source = self.get_source(PERSON_SOURCE)
+        return self.person_page(search_sources(ActorDocument, query, PERSON_FIELDS, size, source, after, total))
+
+    def search_all(self, query, size):
+        # Фильмы и люди одним запросом _msearch к индексам movie и actor
+        ms = MultiSearch(using='default')
+        ms = ms.add(make_search(MovieDocument, query, MOVIE_FIELDS, size, self.get_source(MOVIE_SOURCE)))
+        ms = ms.add(make_search(ActorDocument, query, PERSON_FIELDS, size, self.get_source(PERSON_SOURCE)))
+        ms = ms.params(request_timeout=get_timeout('search'))
+        movies, persons = breaker.call(ms.execute)
+        return self.movie_page(get_page(movies, size)), self.person_page(get_page(persons, size))
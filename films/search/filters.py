@@ -0,0 +1,126 @@
+from django.db.models import Count, Q
+from django.db.models.functions import ExtractYear
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+
+from ..models import Movie, Genre
+from ..translations import translations_prefetch
+
+
+# Пороги фасета рейтинга: фильмы с рейтингом IMDB не ниже порога
+RATING_RANGES = (9, 8, 7, 6, 5)
+FACETS = ('genre', 'year', 'rating', 'age_limit')
+
+
+def get_list(params, name):
+    # Значения параметра через запятую или повтором параметра
+    return [value for item in params.getlist(name) for value in item.split(',') if value]
+
+
+def get_number(params, name, convert):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return convert(value)
+    except ValueError:
+        raise ValidationError({name: _('Invalid number')})
+
+
+def parse_filters(params):
+    """
+    Фильтры поиска фильмов из параметров запроса, сгруппированные
+    по фасетам: genre, year (year_from, year_to), rating (rating_from),
+    age_limit. Пустые фильтры не включаются
+    """
+    filters = {
+        'genre': get_list(params, 'genre'),
+        'year': (get_number(params, 'year_from', int), get_number(params, 'year_to', int)),
+        'rating': get_number(params, 'rating_from', float),
+        'age_limit': get_list(params, 'age_limit'),
+    }
+    if filters['year'] == (None, None):
+        filters['year'] = None
+    return {name: value for name, value in filters.items() if value}
+
+
+def freeze(value):
+    # Фильтры и параметры поиска в виде, пригодном для ключа кеша
+    if isinstance(value, dict):
+        return tuple(sorted((name, freeze(item)) for name, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def filter_conditions(filters):
+    # Условия ORM для каждой группы фильтров
+    conditions = {}
+    if 'genre' in filters:
+        genres = Movie.genres.through.objects.filter(genre__translations__slug__in=filters['genre'])
+        conditions['genre'] = Q(id__in=genres.values('movie_id'))
+    if 'year' in filters:
+        year_from, year_to = filters['year']
+        condition = Q()
+        if year_from is not None:
+            condition &= Q(release_date__year__gte=year_from)
+        if year_to is not None:
+            condition &= Q(release_date__year__lte=year_to)
+        conditions['year'] = condition
+    if 'rating' in filters:
+        conditions['rating'] = Q(imdb_rating__gte=filters['rating'])
+    if 'age_limit' in filters:
+        conditions['age_limit'] = Q(age_limit__in=filters['age_limit'])
+    return conditions
+
+
+def filter_movies(queryset, filters, exclude=None):
+    # Применяет все фильтры, кроме группы exclude
+    for name, condition in filter_conditions(filters).items():
+        if name != exclude:
+            queryset = queryset.filter(condition)
+    return queryset
+
+
+def count_facets(queryset, filters):
+    """
+    Фасеты по фильмам queryset: каждый фасет считается с фильтрами
+    остальных групп, как в Elasticsearch. Возвращает пары (значение, количество)
+    """
+    def movies(name):
+        return filter_movies(queryset, filters, exclude=name)
+
+    genres = Movie.genres.through.objects.filter(movie_id__in=movies('genre').values('id'))
+    years = movies('year').filter(release_date__isnull=False).annotate(year=ExtractYear('release_date'))
+    ratings = movies('rating').aggregate(**{
+        str(threshold): Count('id', filter=Q(imdb_rating__gte=threshold)) for threshold in RATING_RANGES
+    })
+    return {
+        'genre': list(genres.values('genre_id').annotate(count=Count('movie_id'))
+                      .order_by('-count').values_list('genre_id', 'count')),
+        'year': list(years.values('year').annotate(count=Count('id')).order_by('-year').values_list('year', 'count')),
+        'rating': [(int(key), count) for key, count in ratings.items() if count],
+        'age_limit': list(movies('age_limit').exclude(age_limit=None).values('age_limit')
+                          .annotate(count=Count('id')).order_by('-count').values_list('age_limit', 'count')),
+    }
+
+
+def describe_facets(facets):
+    """
+    Фасеты для ответа API: жанры выводятся слагом и названием
+    на активном языке, остальные значения как есть
+    """
+    if facets is None:
+        return None
+    genres = Genre.objects.prefetch_related(translations_prefetch(Genre)).in_bulk(
+        [pk for pk, count in facets['genre']]
+    )
+    result = {
+        name: [{'value': value, 'count': count} for value, count in facets[name]]
+        for name in FACETS if name != 'genre'
+    }
+    result['genre'] = [
+        {'value': genres[pk].slug, 'title': genres[pk].title, 'count': count}
+        for pk, count in facets['genre'] if pk in genres
+    ]
+    return result
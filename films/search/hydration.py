@@ -0,0 +1,59 @@
+from decimal import Decimal
+
+from django.utils.dateparse import parse_date
+from django.utils.translation import get_language
+
+from ..models import Movie, MovieTranslations, Person
+from ..translations import pick_translation, resolve_translations, translations_prefetch
+
+
+def hydrate(queryset, ids):
+    # Загружает объекты по id одним запросом, сохраняя порядок ids
+    objects = queryset.in_bulk(ids)
+    return [objects[pk] for pk in ids if pk in objects]
+
+
+def hydrate_movies(ids):
+    movies = hydrate(Movie.objects.all(), ids)
+    resolve_translations(movies)
+    return movies
+
+
+def hydrate_persons(ids):
+    return hydrate(Person.objects.prefetch_related(translations_prefetch(Person)), ids)
+
+
+def movie_from_source(source, language=None):
+    """
+    Несохраненный фильм из _source документа индекса с переводом
+    активного языка в _translation. Сериализуется так же, как фильм
+    из базы, без запросов к базе
+    """
+    release_date = source.get('release_date')
+    movie = Movie(
+        id=source['id'],
+        orig_title=source.get('orig_title'),
+        slug=source.get('slug'),
+        age_limit=source.get('age_limit'),
+        imdb_rating=Decimal(str(source.get('imdb_rating', 0))),
+        release_date=parse_date(release_date) if release_date else None,
+    )
+    translations = [
+        MovieTranslations(movie_id=movie.id, language_code=code, **card)
+        for code, card in source.get('cards', {}).items()
+    ]
+    movie._translation = pick_translation(translations, language)
+    movie._source = source
+    return movie
+
+
+def person_from_source(source, language=None):
+    # Несохраненный человек из _source документа индекса с переводами в кеше parler
+    person = Person(id=source['id'], photo=source.get('image') or '')
+    for code, card in source.get('cards', {}).items():
+        person.set_current_language(code)
+        person.name = card.get('name')
+        person.slug = card.get('slug')
+    person.set_current_language(language or get_language())
+    person._source = source
+    return person
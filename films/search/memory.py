@@ -0,0 +1,339 @@
+import heapq
+import json
+import math
+import mmap
+import os
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
+
+from django.conf import settings
+
+from ..models import Movie, Person
+from .base import SearchBackend, SearchPage
+from .filters import filter_movies, count_facets
+from .hydration import hydrate_movies, hydrate_persons
+
+
+MEMORY_INDEX = getattr(settings, 'SEARCH_MEMORY_INDEX', {})
+INDEX_PATH = MEMORY_INDEX.get('PATH')
+RELOAD_INTERVAL = MEMORY_INDEX.get('RELOAD_INTERVAL', 10)
+# Сколько лучших совпадений проверяется фильтрами и фасетами в базе
+MAX_CANDIDATES = MEMORY_INDEX.get('MAX_CANDIDATES', 1000)
+
+MAGIC = b'FILMSTRGM1'
+K1 = 1.2
+B = 0.75
+
+# Поля документов как в индексах Elasticsearch
+FIELDS = {'movie': ('orig_title', 'translations'), 'person': ('name',)}
+MODELS = {'movie': Movie, 'person': Person}
+
+
+def trigrams(text):
+    # Триграммы как у анализатора my_analyzer: ngram 3-3 по всем символам в нижнем регистре
+    text = text.lower()
+    return [text[i:i + 3] for i in range(len(text) - 2)]
+
+
+def get_texts(kind, obj):
+    # Тексты полей объекта по уже загруженным переводам
+    translations = list(obj.translations.all())
+    if kind == 'movie':
+        return {'orig_title': [obj.orig_title], 'translations': [t.title for t in translations]}
+    return {'name': [t.name for t in translations]}
+
+
+def analyze(texts):
+    # Частоты триграмм и длина каждого поля
+    result = {}
+    for field, values in texts.items():
+        counts = Counter(term for value in values if value for term in trigrams(value))
+        result[field] = (counts, sum(counts.values()))
+    return result
+
+
+def load_documents(kind, ids=None):
+    # Пары (id, тексты полей) из базы порциями с переводами
+    from ..indexing import iterate_chunks
+
+    queryset = MODELS[kind].objects.prefetch_related('translations')
+    if ids is not None:
+        queryset = queryset.filter(id__in=ids)
+    for obj in iterate_chunks(queryset):
+        yield obj.id, get_texts(kind, obj)
+
+
+def bm25(tf, length, average, idf):
+    return idf * tf / (tf + K1 * (1 - B + B * length / average))
+
+
+class Segment:
+    """
+    Неизменяемая часть индекса одного типа объектов. Документы нумеруются
+    по порядку, для каждого поля хранятся длины и списки вхождений триграмм:
+    номера документов и частоты в компактных массивах array или
+    в срезах memory-mapped файла
+    """
+
+    def __init__(self, ids, fields, read=None):
+        self.ids = ids
+        self.fields = fields
+        self.read = read or (lambda postings: postings)
+        self.average = {
+            field: (sum(lengths) / len(lengths) if len(lengths) else 0) or 1
+            for field, (lengths, terms) in fields.items()
+        }
+
+    @classmethod
+    def build(cls, kind, documents):
+        ids = array('I')
+        fields = {field: (array('I'), {}) for field in FIELDS[kind]}
+        for ordinal, (pk, texts) in enumerate(documents):
+            ids.append(pk)
+            for field, (counts, length) in analyze(texts).items():
+                lengths, terms = fields[field]
+                lengths.append(length)
+                for term, tf in counts.items():
+                    ordinals, tfs = terms.setdefault(term, (array('I'), array('H')))
+                    ordinals.append(ordinal)
+                    tfs.append(min(tf, 0xFFFF))
+        return cls(ids, fields)
+
+    def postings(self, field, term):
+        postings = self.fields[field][1].get(term)
+        return self.read(postings) if postings is not None else ((), ())
+
+
+def align(offset, size=8):
+    return offset + -offset % size
+
+
+def write_segments(path, segments):
+    """
+    Сохраняет сегменты в файл: заголовок JSON со словарем триграмм
+    и смещениями, затем выровненные массивы. Файл заменяется атомарно,
+    чтобы процессы, уже открывшие старый файл, продолжали с ним работать
+    """
+    chunks, offset = [], 0
+
+    def put(values):
+        nonlocal offset
+        data = values.tobytes()
+        chunks.append(data + b'\0' * (align(len(data)) - len(data)))
+        offset += align(len(data))
+        return offset - align(len(data))
+
+    header = {'byteorder': sys.byteorder, 'kinds': {}}
+    for kind, segment in segments.items():
+        fields = {}
+        for field, (lengths, terms) in segment.fields.items():
+            fields[field] = {
+                'lengths': [put(lengths), len(lengths)],
+                'terms': {term: [put(ordinals), put(tfs), len(ordinals)] for term, (ordinals, tfs) in terms.items()},
+            }
+        header['kinds'][kind] = {'ids': [put(segment.ids), len(segment.ids)], 'fields': fields}
+
+    encoded = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    start = align(len(MAGIC) + 8 + len(encoded))
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(MAGIC + len(encoded).to_bytes(8, 'little') + encoded)
+        f.write(b'\0' * (start - len(MAGIC) - 8 - len(encoded)))
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(temporary, path)
+
+
+def read_segments(path):
+    """
+    Открывает файл индекса через mmap. Массивы не копируются в память
+    процесса: страницы файла общие для всех процессов, открывших его
+    """
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'{path} is not a search index file')
+    size = int.from_bytes(mapped[len(MAGIC):len(MAGIC) + 8], 'little')
+    header = json.loads(mapped[len(MAGIC) + 8:len(MAGIC) + 8 + size].decode('utf-8'))
+    if header['byteorder'] != sys.byteorder:
+        raise ValueError(f'{path} was built with {header["byteorder"]} byte order')
+    view = memoryview(mapped)[align(len(MAGIC) + 8 + size):]
+
+    def values(offset, count, code):
+        return view[offset:offset + count * array(code).itemsize].cast(code)
+
+    def read(postings):
+        ordinals, tfs, count = postings
+        return values(ordinals, count, 'I'), values(tfs, count, 'H')
+
+    segments = {}
+    for kind, data in header['kinds'].items():
+        fields = {
+            field: (values(*info['lengths'], 'I'), info['terms'])
+            for field, info in data['fields'].items()
+        }
+        segments[kind] = Segment(values(*data['ids'], 'I'), fields, read)
+    return segments
+
+
+def build_segments():
+    return {kind: Segment.build(kind, load_documents(kind)) for kind in FIELDS}
+
+
+class KindIndex:
+    """
+    Сегмент одного типа объектов и изменения после его построения.
+    Измененные и удаленные объекты исключаются из сегмента,
+    новые версии хранятся отдельно и оцениваются перебором
+    """
+
+    def __init__(self, kind, segment):
+        self.kind = kind
+        self.segment = segment
+        self.removed = set()
+        self.added = {}
+
+    def update(self, documents, ids):
+        added = {pk: analyze(texts) for pk, texts in documents}
+        for pk in ids:
+            self.removed.add(pk)
+            self.added.pop(pk, None)
+        self.added.update(added)
+
+    def score(self, terms):
+        """
+        Оценки документов как у multi_match best_fields: сумма BM25
+        совпавших триграмм в каждом поле, у документа лучшее поле
+        """
+        segment, added = self.segment, dict(self.added)
+        total = len(segment.ids) + len(added)
+        scores = {}
+        for field in FIELDS[self.kind]:
+            lengths = segment.fields[field][0]
+            average = segment.average[field]
+            field_scores = {}
+            for term, repeats in terms.items():
+                ordinals, tfs = segment.postings(field, term)
+                matched = [(pk, doc[field]) for pk, doc in added.items() if term in doc[field][0]]
+                frequency = len(ordinals) + len(matched)
+                if not frequency:
+                    continue
+                idf = repeats * math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+                for ordinal, tf in zip(ordinals, tfs):
+                    pk = segment.ids[ordinal]
+                    if pk not in self.removed:
+                        field_scores[pk] = field_scores.get(pk, 0) + bm25(tf, lengths[ordinal], average, idf)
+                for pk, (counts, length) in matched:
+                    field_scores[pk] = field_scores.get(pk, 0) + bm25(counts[term], length, average, idf)
+            for pk, score in field_scores.items():
+                if score > scores.get(pk, 0):
+                    scores[pk] = score
+        return scores
+
+    def match(self, query):
+        return self.score(Counter(trigrams(query)))
+
+
+def rank(scores, size, after=None, total=False):
+    # Страница id по убыванию оценки, следующая страница после (оценка, id) из after
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    if after:
+        score, last = after
+        ranked = [(pk, s) for pk, s in ranked if s < score or (s == score and pk > last)]
+    page = ranked[:size]
+    last = [page[-1][1], page[-1][0]] if len(page) == size else None
+    return SearchPage([pk for pk, score in page], last, len(scores) if total else None)
+
+
+def top(scores, size):
+    # Лучшие size документов в порядке rank, остальные отбрасываются
+    if len(scores) <= size:
+        return scores
+    return dict(heapq.nsmallest(size, scores.items(), key=lambda item: (-item[1], item[0])))
+
+
+class MemoryIndex:
+    """
+    Индекс процесса: при наличии файла path открывается через mmap
+    и перечитывается, когда файл заменен, иначе строится из базы
+    при первом поиске. Изменения объектов после загрузки
+    применяются к индексу этого процесса
+    """
+
+    def __init__(self, path=INDEX_PATH, reload_interval=RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.kinds = None
+        self.mtime = None
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def get_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns if self.path else None
+        except OSError:
+            return None
+
+    def load(self):
+        mtime = self.get_mtime()
+        segments = read_segments(self.path) if mtime else build_segments()
+        self.kinds = {kind: KindIndex(kind, segment) for kind, segment in segments.items()}
+        self.mtime = mtime
+
+    def get(self, kind):
+        with self.lock:
+            now = time.monotonic()
+            if self.kinds is None:
+                self.load()
+                self.checked = now
+            elif self.path and now - self.checked > self.reload_interval:
+                self.checked = now
+                mtime = self.get_mtime()
+                if mtime and mtime != self.mtime:
+                    self.load()
+            return self.kinds[kind]
+
+    def match(self, kind, query):
+        # Оценки всех документов kind, совпавших с запросом
+        return self.get(kind).match(query)
+
+    def update(self, kind, ids):
+        # Изменения до первого поиска не нужны, индекс еще не загружен
+        if self.kinds is None:
+            return
+        documents = list(load_documents(kind, ids))
+        with self.lock:
+            self.kinds[kind].update(documents, ids)
+
+
+memory_index = MemoryIndex()
+
+
+class MemoryTrigramBackend(SearchBackend):
+    """
+    Поиск по триграммному индексу в памяти процесса без Elasticsearch.
+    Фильтры и фасеты считаются в базе только по max_candidates лучшим
+    совпадениям, чтобы размер запроса не зависел от числа совпавших фильмов
+    """
+
+    max_candidates = MAX_CANDIDATES
+
+    def search_movies(self, query, size, after=None, total=False, filters=None, facets=False):
+        scores = memory_index.match('movie', query)
+        if filters or facets:
+            scores = top(scores, self.max_candidates)
+            candidates = Movie.objects.filter(id__in=list(scores))
+        if filters:
+            allowed = set(filter_movies(candidates, filters).values_list('id', flat=True))
+            scores = {pk: score for pk, score in scores.items() if pk in allowed}
+        page = rank(scores, size, after, total)
+        if facets:
+            page = page._replace(facets=count_facets(candidates, filters or {}))
+        return page._replace(results=hydrate_movies(page.results))
+
+    def search_persons(self, query, size, after=None, total=False):
+        page = rank(memory_index.match('person', query), size, after, total)
+        return page._replace(results=hydrate_persons(page.results))
@@ -0,0 +1,71 @@
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from ..models import Movie, MovieTranslations, Person
+from .base import SearchBackend, SearchPage
+from .filters import filter_movies, count_facets
+from .hydration import hydrate_movies, hydrate_persons
+
+
+def match_sql(sources, query):
+    """
+    Совпадения по триграммам из нескольких источников (модель, поле id,
+    поле текста). Условие % в каждом источнике обслуживается
+    GIN индексом gin_trgm_ops на поле текста
+    """
+    qn = connection.ops.quote_name
+    sql = ' UNION ALL '.join(
+        f'SELECT {qn(key)} AS id, similarity({qn(field)}, %s) AS similarity '
+        f'FROM {qn(model._meta.db_table)} WHERE {qn(field)} %% %s'
+        for model, key, field in sources
+    )
+    return sql, [query, query] * len(sources)
+
+
+def similar(sources, query, size, after=None, total=False, queryset=None):
+    """
+    Страница id с лучшей триграммной схожестью. Следующая страница
+    выбирается условием (схожесть, id) после значений after,
+    queryset ограничивает id, например фильтрами поиска
+    """
+    matches, params = match_sql(sources, query)
+    if queryset is not None:
+        subquery, subparams = queryset.order_by().values('id').query.sql_with_params()
+        matches = f'SELECT * FROM ({matches}) AS candidates WHERE id IN ({subquery})'
+        params = params + list(subparams)
+    having = ''
+    if after:
+        # similarity возвращает real: значение курсора приводится к нему же, иначе
+        # при сравнении с double равные оценки не совпадают и строки пропускаются
+        having = 'HAVING MAX(similarity) < CAST(%s AS real) OR (MAX(similarity) = CAST(%s AS real) AND id > %s)'
+    sql = (
+        f'SELECT id, MAX(similarity) FROM ({matches}) AS matches GROUP BY id {having} '
+        f'ORDER BY 2 DESC, id LIMIT %s'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + ([after[0], after[0], after[1]] if after else []) + [size])
+        rows = cursor.fetchall()
+        count = None
+        if total:
+            cursor.execute(f'SELECT COUNT(DISTINCT id) FROM ({matches}) AS matches', params)
+            count = cursor.fetchone()[0]
+    last = [rows[-1][1], rows[-1][0]] if len(rows) == size else None
+    return SearchPage([pk for pk, similarity in rows], last, count)
+
+
+class TrigramSearchBackend(SearchBackend):
+    # Поиск по триграммам pg_trgm в PostgreSQL, ранжированный по схожести
+
+    def search_movies(self, query, size, after=None, total=False, filters=None, facets=False):
+        sources = [(Movie, 'id', 'orig_title'), (MovieTranslations, 'movie_id', 'title')]
+        queryset = filter_movies(Movie.objects.all(), filters) if filters else None
+        page = similar(sources, query, size, after, total, queryset)
+        if facets:
+            matches, params = match_sql(sources, query)
+            found = Movie.objects.filter(id__in=RawSQL(f'SELECT id FROM ({matches}) AS matches', params))
+            page = page._replace(facets=count_facets(found, filters or {}))
+        return page._replace(results=hydrate_movies(page.results))
+
+    def search_persons(self, query, size, after=None, total=False):
+        sources = [(Person._parler_meta.root_model, 'master_id', 'name')]
+        page = similar(sources, query, size, after, total)
+        return page._replace(results=hydrate_persons(page.results))
@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from elasticsearch_dsl import Search
+
+from ..connections import breaker, get_timeout
+from ..documents import MovieDocument, ActorDocument
+
+
+SUGGEST = getattr(settings, 'SEARCH_SUGGEST', {})
+SUGGEST_SIZE = SUGGEST.get('SIZE', 5)
+SUGGEST_MAX_SIZE = SUGGEST.get('MAX_SIZE', 10)
+
+TYPES = {
+    MovieDocument._index._name: 'movie',
+    ActorDocument._index._name: 'actor',
+}
+
+
+def get_type(index):
+    # Тип подсказки по имени индекса: алиас или версия алиаса вида <алиас>-<время создания>
+    if index in TYPES:
+        return TYPES[index]
+    alias = index.rsplit('-', 1)[0]
+    return TYPES.get(alias, alias)
+
+
+def image_url(name):
+    return default_storage.url(name) if name else None
+
+
+def suggest(text, size=SUGGEST_SIZE):
+    """
+    Подсказки по началу названия фильма или имени человека из поля
+    completion индексов movie и actor за один запрос к Elasticsearch.
+    Данные берутся из индекса без обращения к базе. При превышении
+    таймаута suggest, ошибке Elasticsearch или открытом размыкателе
+    возвращается пустой список
+    """
+    size = min(size, SUGGEST_MAX_SIZE)
+    s = Search(index=list(TYPES), using='default')
+    s = s.source(['slug', 'image']).extra(size=0)
+    s = s.suggest('names', text, completion={'field': 'suggest', 'size': size, 'skip_duplicates': True})
+    s = s.params(request_timeout=get_timeout('suggest'))
+    try:
+        response = breaker.call(s.execute)
+    except Exception as e:
+        print(e)
+        return []
+    return [
+        {
+            'type': get_type(option._index),
+            'title': option.text,
+            'slug': option._source.slug,
+            # Поля со значением None не сохраняются в _source
+            'poster': image_url(getattr(option._source, 'image', None)),
+        }
+        for option in response.suggest.names[0].options
+    ]
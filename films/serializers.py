@@ -1,5 +1,7 @@
+from django.db import models
 from rest_framework import serializers
 from .models import Movie, Genre, Person, Collection, MovieTranslations
+from .translations import resolve_translations
 from users.serializers import UserListSerializer
 
 
@@ -47,6 +49,15 @@ class MovieTranslateSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class MovieListTranslatedSerializer(serializers.ListSerializer):
+    # Сериализация списка фильмов с загрузкой переводов одним запросом
+
+    def to_representation(self, data):
+        movies = list(data.all() if isinstance(data, models.Manager) else data)
+        resolve_translations(movies)
+        return super().to_representation(movies)
+
+
 class MovieListSerializer(serializers.ModelSerializer):
     # Сериализация для списка фильмов
     get_translate = MovieTranslateSerializer()
@@ -54,25 +65,36 @@ class MovieListSerializer(serializers.ModelSerializer):
     class Meta:
         model = Movie
         fields = ('orig_title', 'slug', 'age_limit', 'imdb_rating', 'release_date', 'get_translate')
+        list_serializer_class = MovieListTranslatedSerializer
 
 
-class GenreDetailSerializer(serializers.ModelSerializer):
-    # Сериализация жанра
+class SuggestionSerializer(serializers.Serializer):
+    # Сериализация подсказки поиска из индекса Elasticsearch
+    type = serializers.CharField()
+    title = serializers.CharField()
+    slug = serializers.CharField()
+    poster = serializers.CharField(allow_null=True)
+
+
+class SearchAllSerializer(serializers.Serializer):
+    # Сериализация результатов общего поиска, сгруппированных по типу
     movies = MovieListSerializer(many=True)
+    actors = ActorListSerializer(many=True)
+
 
+class GenreDetailSerializer(serializers.ModelSerializer):
+    # Сериализация жанра, фильмы жанра отдаются постранично
     class Meta:
         model = Genre
-        fields = ('title', 'slug', 'movies')
+        fields = ('title', 'slug')
 
 
 class ActorDetailSerializer(serializers.ModelSerializer):
-    # Сериализация страницы актера
-    movie_cast = MovieListSerializer(many=True)
-
+    # Сериализация страницы актера, фильмография отдается постранично
     class Meta:
         model = Person
         fields = ('name', 'slug', 'photo', 'birth_date', 'career', 'gender',
-                  'biography', 'birth_place', 'movie_cast')
+                  'biography', 'birth_place')
 
 
 class MovieDetailSerializer(serializers.ModelSerializer):
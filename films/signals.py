@@ -1,15 +1,121 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 
-from .models import Movie, Person
+from .models import Movie, MovieTranslations, Person, Genre, Collection
 from .documents import MovieDocument, ActorDocument
+from . import cache
+from .indexing import enqueue
 
-@receiver(post_save, sender=Movie)
+M2M_ACTIONS = ('post_add', 'post_remove', 'pre_clear')
+
+
+def m2m_sides(instance, action, reverse, pk_set, accessors):
+    # id фильмов (или коллекций) и id связанных объектов, затронутых изменением связи
+    if action == 'pre_clear':
+        accessor = accessors[1] if reverse else accessors[0]
+        pk_set = set(getattr(instance, accessor).values_list('id', flat=True))
+    return (pk_set, {instance.pk}) if reverse else ({instance.pk}, pk_set)
+
+
+def movie_slugs(ids):
+    return Movie.objects.filter(id__in=ids).values_list('slug', flat=True)
+
+@receiver([post_save, post_delete], sender=Movie)
 def movie_handler(sender, instance, **kwargs):
-    # Индексация сохраняемого Фильма
-    instance.indexing()
+    # Индексация сохраняемого Фильма после фиксации транзакции
+    enqueue('movie', instance.id)
 
-@receiver(post_save, sender=Person)
+@receiver([post_save, post_delete], sender=MovieTranslations)
+def movie_translation_handler(sender, instance, **kwargs):
+    # Индексация Фильма при изменении его перевода
+    enqueue('movie', instance.movie_id)
+
+@receiver([post_save, post_delete], sender=Person)
 def actor_handler(sender, instance, **kwargs):
-    # Индексация сохраняемого Человека
-    instance.indexing()
+    # Индексация сохраняемого Человека после фиксации транзакции
+    enqueue('person', instance.id)
+
+@receiver([post_save, post_delete], sender=Person._parler_meta.root_model)
+def actor_translation_handler(sender, instance, **kwargs):
+    # Индексация Человека при изменении его перевода
+    enqueue('person', instance.master_id)
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+def movie_genres_handler(sender, instance, action, reverse, pk_set, **kwargs):
+    # Индексация Фильмов при изменении их жанров
+    if action in M2M_ACTIONS:
+        movies, genres = m2m_sides(instance, action, reverse, pk_set, ('genres', 'movies'))
+        for pk in movies:
+            enqueue('movie', pk)
+
+@receiver(post_save, sender=Genre._parler_meta.root_model)
+def genre_translation_handler(sender, instance, **kwargs):
+    # Индексация Фильмов жанра при изменении слага в переводе
+    for pk in Movie.objects.filter(genres=instance.master_id).values_list('id', flat=True):
+        enqueue('movie', pk)
+
+@receiver(post_save, sender=Movie)
+def movie_cache_handler(sender, instance, **kwargs):
+    # Сброс кеша страниц, на которых выводится Фильм
+    cache.invalidate_movies([instance.id])
+
+@receiver(post_save, sender=MovieTranslations)
+def movie_translation_cache_handler(sender, instance, created, **kwargs):
+    # Сброс кеша страниц Фильма только для языка перевода,
+    # новый перевод меняет список доступных переводов на всех языках
+    cache.invalidate_movies([instance.movie_id], None if created else instance.language_code)
+
+@receiver(post_save, sender=Person)
+def actor_cache_handler(sender, instance, **kwargs):
+    # Сброс кеша страниц, на которых выводится Человек
+    cache.invalidate_persons([instance.id])
+
+@receiver(post_save, sender=Person._parler_meta.root_model)
+def actor_translation_cache_handler(sender, instance, **kwargs):
+    # Сброс кеша страниц Человека только для языка перевода
+    cache.invalidate_persons([instance.master_id], instance.language_code)
+
+@receiver(post_save, sender=Genre)
+def genre_cache_handler(sender, instance, **kwargs):
+    # Сброс кеша страниц, на которых выводится Жанр
+    cache.invalidate_genres([instance.id])
+
+@receiver(post_save, sender=Genre._parler_meta.root_model)
+def genre_translation_cache_handler(sender, instance, **kwargs):
+    # Сброс кеша страниц Жанра только для языка перевода
+    cache.invalidate_genres([instance.master_id], instance.language_code)
+
+@receiver(post_save, sender=Collection)
+def collection_cache_handler(sender, instance, **kwargs):
+    # Сброс кеша страницы Коллекции
+    cache.invalidate_collections([instance.id])
+
+@receiver(m2m_changed, sender=Movie.cast.through)
+def cast_cache_handler(sender, instance, action, reverse, pk_set, **kwargs):
+    # Сброс кеша страниц Фильмов и Людей при изменении актерского состава
+    if action in M2M_ACTIONS:
+        movies, persons = m2m_sides(instance, action, reverse, pk_set, ('cast', 'movie_cast'))
+        cache.invalidate('movie', movie_slugs(movies))
+        cache.invalidate('actor', cache.translation_slugs(Person, persons))
+
+@receiver(m2m_changed, sender=Movie.directors.through)
+def directors_cache_handler(sender, instance, action, reverse, pk_set, **kwargs):
+    # Сброс кеша страниц Фильмов при изменении режиссеров
+    if action in M2M_ACTIONS:
+        movies, persons = m2m_sides(instance, action, reverse, pk_set, ('directors', 'movie_director'))
+        cache.invalidate('movie', movie_slugs(movies))
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+def genres_cache_handler(sender, instance, action, reverse, pk_set, **kwargs):
+    # Сброс кеша страниц Фильмов и Жанров при изменении жанров фильма
+    if action in M2M_ACTIONS:
+        movies, genres = m2m_sides(instance, action, reverse, pk_set, ('genres', 'movies'))
+        cache.invalidate('movie', movie_slugs(movies))
+        cache.invalidate('genre', cache.translation_slugs(Genre, genres))
+
+@receiver(m2m_changed, sender=Collection.movies.through)
+def collection_movies_cache_handler(sender, instance, action, reverse, pk_set, **kwargs):
+    # Сброс кеша страниц Коллекций при изменении их фильмов
+    if action in M2M_ACTIONS:
+        collections, movies = m2m_sides(instance, action, reverse, pk_set, ('movies', 'collections'))
+        cache.invalidate_collections(collections)
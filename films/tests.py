@@ -1,3 +1,1231 @@
-from django.test import TestCase
+import base64
+import datetime
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.http import QueryDict
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import translation
+from elasticsearch.exceptions import ConnectionError, ConnectionTimeout, RequestError, TransportError
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.response import Response
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from . import search, views
+from .connections import CircuitBreaker, CircuitOpen
+from .crawler import crawl
+from .documents import MovieDocument, ActorDocument
+from .images import save_images
+from .indexing import ThreadQueue, build_actions, bulk_index, export_actions, save_checkpoint
+from .models import Movie, MovieTranslations, Person, Genre, Collection, IndexingCheckpoint, TMDBPerson
+from .pagination import KeysetPagination, RatingKeysetPagination, SearchPagination
+from .parser import load_to_db
+from .queries import movie_last_modified, actor_last_modified, genre_last_modified, prefetch_collection_films
+from .search.base import SearchPage
+from .search.cache import SearchResultCache, bump_generation, result_cache
+from .search.filters import count_facets, freeze, parse_filters
+from .search.hydration import movie_from_source
+from .search.elastic import ElasticsearchBackend
+from .search.memory import KindIndex, MemoryTrigramBackend, Segment, memory_index, rank, read_segments, write_segments
+from .search.postgres import TrigramSearchBackend
+from .search.suggest import suggest
+from .tmdb_cache import PageCache
+
+
+class MovieDetailQueriesTest(TestCase):
+    # Количество запросов на странице фильма не зависит от размера связей
+
+    def setUp(self):
+        self.movie = Movie.objects.create(orig_title='Movie')
+        MovieTranslations.objects.create(movie=self.movie, language_code='ru', title='Фильм')
+        MovieTranslations.objects.create(movie=self.movie, language_code='en', title='Movie')
+
+    def add_people(self, quantity):
+        for i in range(quantity):
+            person = Person.objects.create(name=f'Person {i}', career='Actor')
+            self.movie.cast.add(person)
+            self.movie.directors.add(person)
+            self.movie.genres.add(Genre.objects.create(title=f'Genre {i}'))
+
+    def test_constant_query_count(self):
+        self.add_people(2)
+        # 8 запросов данных страницы и один запрос даты для Last-Modified
+        with self.assertNumQueries(9):
+            response = self.client.get(f'/ru/api/movie/{self.movie.slug}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['get_translate']['title'], 'Фильм')
+
+        self.add_people(10)
+        with self.assertNumQueries(9):
+            response = self.client.get(f'/ru/api/movie/{self.movie.slug}/')
+        self.assertEqual(len(response.data['get_cast']), 8)
+        self.assertEqual(len(response.data['genres']), 12)
+
+
+class CollectionFilmsTest(TestCase):
+    # Первые фильмы каждой коллекции одним оконным запросом
+
+    def setUp(self):
+        updated = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        self.collections = [Collection.objects.create(title=f'Collection {i}') for i in range(3)]
+        self.expected = {}
+        for number, (collection, quantity) in enumerate(zip(self.collections, (10, 12, 2))):
+            movies = []
+            for i in range(quantity):
+                movie = Movie.objects.create(orig_title=f'Movie {number}-{i}')
+                MovieTranslations.objects.create(movie=movie, language_code='ru', title=f'Фильм {number}-{i}')
+                if i % 2:
+                    MovieTranslations.objects.create(movie=movie, language_code='en', title=f'Movie {number}-{i}')
+                # Пары фильмов с одинаковой датой обновления, внутри пары порядок по id
+                Movie.objects.filter(pk=movie.pk).update(updated=updated + datetime.timedelta(days=i // 2))
+                movies.append(movie)
+            collection.movies.set(movies)
+            # Позже созданные фильмы новее или при равной дате имеют больший id
+            self.expected[collection.id] = [movie.id for movie in reversed(movies)][:8]
+
+    def test_limit_and_order(self):
+        with translation.override('en'):
+            # Коллекции, фильмы коллекций и переводы фильмов
+            with self.assertNumQueries(3):
+                collections = prefetch_collection_films(Collection.objects.order_by('id'))
+            with self.assertNumQueries(0):
+                films = {collection.id: collection.get_films() for collection in collections}
+                titles = [movie.get_translate().title for movie in films[self.collections[0].id][:2]]
+        self.assertEqual({pk: [movie.id for movie in movies] for pk, movies in films.items()}, self.expected)
+        # Фильм без перевода на активный язык выводится на языке по умолчанию
+        self.assertEqual(titles, ['Movie 0-9', 'Фильм 0-8'])
+
+    def test_list_queries(self):
+        # Коллекции, фильмы, переводы фильмов и две даты для Last-Modified
+        with self.assertNumQueries(5):
+            response = self.client.get('/ru/api/movie/collections/')
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual(len(results), 3)
+        for item in results:
+            self.assertEqual([movie['slug'] for movie in item['get_films']],
+                             [Movie.objects.get(pk=pk).slug for pk in self.expected[item['id']]])
+
+
+class MovieListTranslationsTest(TestCase):
+    # Переводы фильмов в списках загружаются одним запросом с языком по умолчанию при отсутствии перевода
+
+    def setUp(self):
+        self.genre = Genre.objects.create(title='Драма')
+
+    def add_movies(self, quantity):
+        for i in range(quantity):
+            movie = Movie.objects.create(orig_title=f'Movie {i}', imdb_rating=quantity - i)
+            MovieTranslations.objects.create(movie=movie, language_code='ru', title=f'Фильм {i}')
+            if i % 2:
+                MovieTranslations.objects.create(movie=movie, language_code='en', title=f'Movie {i}')
+            movie.genres.add(self.genre)
+
+    def get_titles(self, queries):
+        # Без кеша ответов и кеша переводов parler
+        cache.clear()
+        with self.assertNumQueries(queries):
+            response = self.client.get(f'/en/api/movie/genre/{self.genre.slug}/', {'page_size': 20})
+        self.assertEqual(response.status_code, 200)
+        return [movie['get_translate']['title'] for movie in response.data['movies']['results']]
+
+    def test_constant_queries_and_fallback(self):
+        self.add_movies(2)
+        # Дата для Last-Modified, жанр, перевод жанра на en и на языке по умолчанию, фильмы и их переводы
+        self.assertEqual(self.get_titles(6), ['Фильм 0', 'Movie 1'])
+
+        Movie.objects.all().delete()
+        self.add_movies(10)
+        titles = self.get_titles(6)
+        self.assertEqual(titles[:4], ['Фильм 0', 'Movie 1', 'Фильм 2', 'Movie 3'])
+        self.assertEqual(len(titles), 10)
+
+
+class LastModifiedTest(TestCase):
+    # Дата для условных запросов - последнее обновление объекта и его связей
+
+    def setUp(self):
+        self.movie = Movie.objects.create(orig_title='Movie')
+        self.other = Movie.objects.create(orig_title='Other')
+        self.actor = Person.objects.create(name='Актер', career='Actor')
+        self.director = Person.objects.create(name='Режиссер', career='Director', birth_date=datetime.date(1970, 1, 1))
+        self.genre = Genre.objects.create(title='Драма')
+        self.movie.cast.add(self.actor)
+        self.movie.directors.add(self.director)
+        self.movie.genres.add(self.genre)
+        self.other.genres.add(self.genre)
+        self.day = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        self.touch(Movie, self.movie, 0)
+        self.touch(Movie, self.other, 0)
+        self.touch(Person, self.actor, 0)
+        self.touch(Person, self.director, 0)
+
+    def touch(self, model, obj, days):
+        # updated с auto_now задается в обход save
+        updated = self.day + datetime.timedelta(days=days)
+        model.objects.filter(pk=obj.pk).update(updated=updated)
+        return updated
+
+    def test_movie(self):
+        self.assertEqual(movie_last_modified(self.movie.slug), self.day)
+        updated = self.touch(Movie, self.movie, 1)
+        self.assertEqual(movie_last_modified(self.movie.slug), updated)
+        updated = self.touch(Person, self.actor, 2)
+        self.assertEqual(movie_last_modified(self.movie.slug), updated)
+        updated = self.touch(Person, self.director, 3)
+        self.assertEqual(movie_last_modified(self.movie.slug), updated)
+        self.assertIsNone(movie_last_modified('missing'))
+
+    def test_movie_single_query(self):
+        # Актеры и режиссеры не соединяются друг с другом, запрос один при любом составе
+        for i in range(5):
+            self.movie.cast.add(Person.objects.create(name=f'Actor {i}', career='Actor',
+                                                      birth_date=datetime.date(1980, 1, i + 1)))
+            self.movie.directors.add(Person.objects.create(name=f'Director {i}', career='Director',
+                                                           birth_date=datetime.date(1990, 1, i + 1)))
+        with self.assertNumQueries(1):
+            movie_last_modified(self.movie.slug)
+
+    def test_actor(self):
+        slug = self.actor.slug
+        self.assertEqual(actor_last_modified(slug), self.day)
+        updated = self.touch(Movie, self.movie, 1)
+        self.assertEqual(actor_last_modified(slug), updated)
+        self.touch(Movie, self.other, 5)
+        self.assertEqual(actor_last_modified(slug), self.day + datetime.timedelta(days=1))
+        updated = self.touch(Person, self.actor, 6)
+        self.assertEqual(actor_last_modified(slug), updated)
+        self.assertIsNone(actor_last_modified('missing'))
+
+    def test_genre(self):
+        slug = self.genre.slug
+        self.assertEqual(genre_last_modified(slug), self.day)
+        updated = self.touch(Movie, self.other, 1)
+        self.assertEqual(genre_last_modified(slug), updated)
+        updated = self.touch(Movie, self.movie, 2)
+        self.assertEqual(genre_last_modified(slug), updated)
+        self.assertIsNone(genre_last_modified('missing'))
+
+
+class KeysetPaginationTest(TestCase):
+    # Страницы по курсору при одинаковых значениях поля сортировки
+
+    def setUp(self):
+        # Пары одинаковых дат обновления и рейтингов, порядок внутри пары по id
+        updated = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        for i in range(7):
+            movie = Movie.objects.create(orig_title=f'Movie {i}', imdb_rating=f'{i // 2}.5')
+            Movie.objects.filter(pk=movie.pk).update(updated=updated + datetime.timedelta(days=i // 2))
+
+    def paginate(self, pagination, params=None):
+        paginator = pagination()
+        paginator.page_size = 2
+        request = Request(APIRequestFactory().get('/movies/', params or {}))
+        page = paginator.paginate_queryset(Movie.objects.all(), request)
+        return [movie.id for movie in page], paginator.get_next_link(), paginator.get_previous_link()
+
+    def get_params(self, link):
+        return {name: values[0] for name, values in parse_qs(urlparse(link).query).items()}
+
+    def walk(self, pagination):
+        # Все страницы вперед, затем обратно по ссылкам previous
+        pages, link = [], None
+        while True:
+            page, link, previous = self.paginate(pagination, self.get_params(link) if link else None)
+            pages.append(page)
+            if link is None:
+                break
+        backward = [page]
+        while previous:
+            page, link, previous = self.paginate(pagination, self.get_params(previous))
+            backward.insert(0, page)
+        return pages, backward
+
+    def test_equal_updated(self):
+        expected = list(Movie.objects.order_by('-updated', '-id').values_list('id', flat=True))
+        pages, backward = self.walk(KeysetPagination)
+        self.assertEqual([pk for page in pages for pk in page], expected)
+        self.assertEqual(backward, pages)
+
+    def test_equal_rating(self):
+        expected = list(Movie.objects.order_by('-imdb_rating', '-id').values_list('id', flat=True))
+        pages, backward = self.walk(RatingKeysetPagination)
+        self.assertEqual([pk for page in pages for pk in page], expected)
+        self.assertEqual(backward, pages)
+
+    def test_invalid_cursor(self):
+        genre = Genre.objects.create(title='Драма')
+        wrong_length = base64.urlsafe_b64encode(b'{"r":0,"p":["5.5"]}').decode('ascii')
+        wrong_value = base64.urlsafe_b64encode(b'{"r":0,"p":["high","1"]}').decode('ascii')
+        for cursor in ('garbage', wrong_length, wrong_value):
+            response = self.client.get(f'/ru/api/movie/genre/{genre.slug}/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 400)
+
+
+PERSON_PAGE = """
+<img class="profile" src="//image.tmdb.org/t/p/w300_and_h450_bestv2_filter(blur)/{name}.jpg">
+<section class="facts"></section>
+<section>
+  <p><strong>Known For</strong> Acting</p>
+  <p><strong>Known Credits</strong> 10</p>
+  <p><strong>Gender</strong> Female</p>
+  <p><strong>Birthday</strong> 1970-05-04 (50 years old)</p>
+  <p><strong>Place of Birth</strong> -</p>
+</section>
+<h2 class="title">{name}</h2>
+<div class="biography"></div><div class="text">About {name}</div>
+"""
+
+# Сохраненные страницы TMDB в объеме, который нужен парсеру
+TMDB_PAGES = {
+    '/movie/': """
+        <div class="card style_1"><a class="image" href="/movie/1-heat"></a></div>
+        <div class="card style_1"><a class="image" href="/movie/2-missing"></a></div>
+    """,
+    '/movie/1-heat': """
+        <div class="title"><a href="/movie/1-heat">Heat</a>
+          <span class="certification">R</span>
+          <span class="release">12/15/1995 (US)</span>
+          <span class="genres"><a>Crime</a><a>Drama</a></span>
+          <span class="runtime">2h 50m</span>
+        </div>
+        <span class="icon icon-r79"></span>
+        <h3 class="tagline">A Los Angeles Crime Saga</h3>
+        <div class="overview">Thieves and detectives.</div>
+        <ol class="people">
+          <li class="profile"><a href="/person/1-director"></a><p class="character">Director, Writer</p></li>
+          <li class="profile"><a href="/person/5-producer"></a><p class="character">Producer</p></li>
+        </ol>
+        <ol class="people scroller">
+          <li class="card"><a href="/person/2-actor"></a></li>
+          <li class="card"><a href="/person/3-actress"></a></li>
+          <li class="card"><a href="/person/4-missing"></a></li>
+        </ol>
+        <img class="poster" src="//image.tmdb.org/t/p/w300_and_h450_bestv2_filter(blur)/heat.jpg">
+    """,
+    '/person/1-director': PERSON_PAGE.format(name='Director'),
+    '/person/2-actor': PERSON_PAGE.format(name='Actor'),
+    '/person/3-actress': PERSON_PAGE.format(name='Actress'),
+    '/t/p/original/heat.jpg': 'poster',
+    '/t/p/original/actor.jpg': 'photo',
+    '/t/p/original/actress.jpg': 'photo',
+}
+
+
+class TMDBStubHandler(BaseHTTPRequestHandler):
+    paths = []
+
+    def do_GET(self):
+        self.paths.append(self.path)
+        page = TMDB_PAGES.get(self.path.split('?')[0])
+        if page and self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200 if page else 404)
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+        if page:
+            self.wfile.write(page.encode('utf-8'))
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub(test):
+    # Локальный сервер со страницами TMDB_PAGES на время теста, возвращает его адрес
+    server = ThreadingHTTPServer(('127.0.0.1', 0), TMDBStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    test.addCleanup(server.server_close)
+    test.addCleanup(server.shutdown)
+    TMDBStubHandler.paths = []
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+class CrawlerTest(SimpleTestCase):
+    # Загрузка и разбор страниц с локального сервера вместо TMDB
+
+    def setUp(self):
+        self.host = start_stub(self)
+
+    def crawl(self, **options):
+        options = {'language': 'en', 'host': self.host, 'processes': 1, 'cache': None, **options}
+        return crawl(1, **options)
+
+    def test_crawl(self):
+        movies = self.crawl()
+
+        self.assertEqual(len(movies), 1)
+        movie = movies[0]
+        self.assertEqual(movie['translated_title'], 'Heat')
+        self.assertEqual(movie['release_date'], ['12', '15', '1995'])
+        self.assertEqual(movie['duration'], 170)
+        self.assertEqual(movie['genres'], ['Crime', 'Drama'])
+        self.assertEqual([person['name'] for person in movie['directors']], ['Director'])
+        self.assertEqual([person['name'] for person in movie['cast']], ['Actor', 'Actress'])
+        self.assertEqual(movie['cast'][0]['birth_date'], ['1970', '05', '04'])
+        self.assertEqual(movie['cast'][0]['photo'], 'https://image.tmdb.org/t/p/original/Actor.jpg')
+        self.assertEqual(movie['cast'][0]['tmdb_id'], 2)
+
+    def test_known_people(self):
+        movies = self.crawl(known={1, 2})
+
+        self.assertEqual(movies[0]['directors'], [{'tmdb_id': 1}])
+        self.assertEqual(movies[0]['cast'][0], {'tmdb_id': 2})
+        self.assertEqual(movies[0]['cast'][1]['name'], 'Actress')
+        self.assertNotIn('/person/1-director', TMDBStubHandler.paths)
+        self.assertNotIn('/person/2-actor', TMDBStubHandler.paths)
+
+    def test_parse_error(self):
+        # Страница, которую не удалось разобрать, пропускается без остановки загрузки
+        with mock.patch.dict(TMDB_PAGES, {'/person/3-actress': '<p>broken</p>'}):
+            movies = self.crawl()
+        self.assertEqual([person['name'] for person in movies[0]['cast']], ['Actor'])
+
+        with mock.patch.dict(TMDB_PAGES, {'/movie/1-heat': '<p>broken</p>'}):
+            self.assertEqual(self.crawl(), [])
+
+    def test_timeout(self):
+        with mock.patch.object(TMDBStubHandler, 'do_GET', lambda handler: threading.Event().wait(1)):
+            movies = self.crawl(timeout=0.1)
+        self.assertEqual(movies, [])
+
+    def test_cache(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        movies = self.crawl(cache=PageCache(directory.name, 1024 * 1024))
+        requested = len(TMDBStubHandler.paths)
+
+        self.assertEqual(self.crawl(cache=PageCache(directory.name, 1024 * 1024), offline=True), movies)
+        self.assertEqual(len(TMDBStubHandler.paths), requested)
+
+        expired = PageCache(directory.name, 1024 * 1024, {'list': 0, 'movie': 0, 'person': 0})
+        self.assertEqual(self.crawl(cache=expired), movies)
+        self.assertEqual(len(TMDBStubHandler.paths), requested * 2)
+
+    def test_cache_eviction(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = PageCache(directory.name, 2500)
+        cache.put(f'{self.host}/movie/1', None, 'a' * 1000, {})
+        cache.put(f'{self.host}/movie/2', None, 'a' * 1000, {})
+        cache.put(f'{self.host}/movie/3', None, 'b' * 1000, {})
+        self.assertEqual(cache.size, 2000)
+        cache.get(f'{self.host}/movie/1')
+        # Порядок чтения хранится в памяти, каталог при удалении не просматривается
+        with mock.patch.object(cache, 'entries', side_effect=AssertionError):
+            cache.put(f'{self.host}/movie/4', None, 'c' * 1000, {})
+
+        self.assertIsNotNone(cache.get(f'{self.host}/movie/1'))
+        self.assertIsNotNone(cache.get(f'{self.host}/movie/4'))
+        self.assertIsNone(cache.get(f'{self.host}/movie/3'))
+        self.assertEqual(cache.size, 2000)
+
+    def test_cache_restart(self):
+        # Порядок чтения после перезапуска восстанавливается по времени изменения файлов записей
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = PageCache(directory.name, 2500)
+        cache.put(f'{self.host}/movie/1', None, 'a' * 1000, {})
+        cache.put(f'{self.host}/movie/2', None, 'b' * 1000, {})
+        # Время изменения файлов обновляется с точностью системных часов
+        time.sleep(0.05)
+        cache.get(f'{self.host}/movie/1')
+
+        cache = PageCache(directory.name, 2500)
+        cache.put(f'{self.host}/movie/3', None, 'c' * 1000, {})
+        self.assertIsNotNone(cache.get(f'{self.host}/movie/1'))
+        self.assertIsNone(cache.get(f'{self.host}/movie/2'))
+
+    def test_cache_thread(self):
+        # Дисковые операции кеша выполняются вне потока цикла событий
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = PageCache(directory.name, 1024 * 1024)
+        threads = set()
+        for name in ('get', 'put'):
+            method = getattr(cache, name)
+
+            def wrapper(*args, method=method):
+                threads.add(threading.get_ident())
+                return method(*args)
+            patcher = mock.patch.object(cache, name, wrapper)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.crawl(cache=cache)
+        self.assertTrue(threads)
+        self.assertNotIn(threading.get_ident(), threads)
+
+
+def parsed_person(tmdb_id, name):
+    return {
+        'tmdb_id': tmdb_id, 'name': name, 'biography': None, 'career': 'Acting', 'gender': None,
+        'birth_date': ['1970', '05', str(tmdb_id)], 'birth_place': None, 'photo': f'https://image.tmdb.org/{name}.jpg',
+    }
+
+
+def parsed_movie(title, cast, genres=('Crime',)):
+    return {
+        'orig_title': title, 'translated_title': title, 'description': None, 'age_limit': 'R',
+        'tagline': None, 'imdb_rating': 7.9, 'release_date': ['12', '15', '1995'], 'duration': 170,
+        'genres': list(genres), 'directors': cast[:1], 'cast': cast,
+        'poster': f'https://image.tmdb.org/{title}.jpg',
+    }
+
+
+class LoaderTest(TestCase):
+    # Пакетная загрузка разобранных фильмов в базу
+
+    def setUp(self):
+        language = translation.override('en')
+        language.__enter__()
+        self.addCleanup(language.__exit__, None, None, None)
+
+    def test_load(self):
+        actor, actress = parsed_person(1, 'Actor'), parsed_person(2, 'Actress')
+        details, images = load_to_db([
+            parsed_movie('Heat', [actor, actress], ['Crime', 'Drama']),
+            parsed_movie('Ronin', [{'tmdb_id': 1}, parsed_person(3, 'Other')]),
+            parsed_movie('Heat', [actor]),
+        ])
+
+        self.assertEqual(details['Heat']['status'], 'created')
+        self.assertEqual(Movie.objects.count(), 2)
+        self.assertEqual(Person.objects.count(), 3)
+        self.assertEqual(Genre.objects.count(), 2)
+        heat = Movie.objects.get(orig_title='Heat')
+        self.assertEqual(heat.slug, f'{heat.id}-heat')
+        self.assertEqual(str(heat.release_date), '1995-12-15')
+        self.assertEqual(heat.translations.get().title, 'Heat')
+        self.assertEqual(set(heat.cast.values_list('translations__name', flat=True)), {'Actor', 'Actress'})
+        self.assertEqual(set(heat.genres.values_list('translations__slug', flat=True)), {'crime', 'drama'})
+        ronin = Movie.objects.get(orig_title='Ronin')
+        self.assertEqual(ronin.directors.get(), TMDBPerson.objects.get(tmdb_id=1).person)
+        self.assertEqual(len(images['posters']), 2)
+        self.assertEqual(len(images['photos']), 3)
+
+        heat.fullness = 55
+        heat.save()
+        heat.cast.clear()
+        details, images = load_to_db([parsed_movie('Heat', [{'tmdb_id': 2}])])
+        self.assertEqual(details['Heat']['status'], 'exists')
+        self.assertEqual(details['Heat']['cast'], {'Actress': 'added'})
+        self.assertEqual(heat.cast.get().name, 'Actress')
+        self.assertEqual(Person.objects.count(), 3)
+
+
+class ImagesTest(TestCase):
+    # Загрузка постеров и фото в хранилище после загрузки фильмов
+
+    def setUp(self):
+        self.host = start_stub(self)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.movie = Movie.objects.create(orig_title='Heat')
+        MovieTranslations.objects.create(movie=self.movie, language_code='en', title='Heat')
+        self.actor = Person.objects.create(name='Actor', career='Acting')
+        self.actress = Person.objects.create(name='Actress', career='Acting', birth_date='1970-05-04')
+
+    def test_save_images(self):
+        images = {
+            'posters': [(self.movie.id, 'en', f'{self.host}/t/p/original/heat.jpg')],
+            'photos': [
+                (self.actor.id, f'{self.host}/t/p/original/actor.jpg'),
+                (self.actress.id, f'{self.host}/t/p/original/actress.jpg'),
+            ],
+        }
+        save_images(images, workers=2)
+
+        poster = self.movie.translations.get().poster
+        self.assertTrue(poster.name.startswith('movie/posters/'))
+        self.assertEqual(poster.read(), b'poster')
+        self.actor.refresh_from_db()
+        self.actress.refresh_from_db()
+        self.assertTrue(self.actor.photo.name.endswith('.jpg'))
+        self.assertEqual(self.actor.photo.name, self.actress.photo.name)
+        self.assertEqual(len(TMDBStubHandler.paths), 3)
+
+        save_images(images, workers=2)
+        self.assertEqual(len(TMDBStubHandler.paths), 3)
+
+    def test_same_photo_and_birth_date(self):
+        # Одинаковое фото у людей с одной датой рождения нарушило бы unique_together, второй пропускается
+        twin = Person.objects.create(name='Twin', career='Acting', birth_date='1970-05-04', photo='movie/actors/old.jpg')
+        images = {
+            'posters': [(self.movie.id, 'en', f'{self.host}/t/p/original/heat.jpg')],
+            'photos': [
+                (self.actress.id, f'{self.host}/t/p/original/actress.jpg'),
+                (twin.id, f'{self.host}/t/p/original/actor.jpg'),
+            ],
+        }
+        save_images(images, workers=2)
+
+        self.actress.refresh_from_db()
+        twin.refresh_from_db()
+        self.assertTrue(self.actress.photo.name.endswith('.jpg'))
+        self.assertEqual(twin.photo.name, 'movie/actors/old.jpg')
+        self.assertEqual(self.movie.translations.get().poster.read(), b'poster')
+
+    def test_storage_error(self):
+        # Ошибка хранилища пропускает изображение, остальные сохраняются
+        storage = MovieTranslations._meta.get_field('poster').storage
+        save = storage.save
+
+        def failing_save(name, content, *args, **kwargs):
+            if name.startswith('movie/posters/'):
+                raise OSError('disk full')
+            return save(name, content, *args, **kwargs)
+        images = {
+            'posters': [(self.movie.id, 'en', f'{self.host}/t/p/original/heat.jpg')],
+            'photos': [(self.actor.id, f'{self.host}/t/p/original/actor.jpg')],
+        }
+        with mock.patch.object(storage, 'save', failing_save):
+            save_images(images, workers=2)
+
+        self.assertFalse(self.movie.translations.get().poster)
+        self.actor.refresh_from_db()
+        self.assertTrue(self.actor.photo.name.endswith('.jpg'))
+
+
+MOVIE_SOURCE = {
+    'id': 1, 'orig_title': 'Heat', 'slug': '1-heat', 'age_limit': 'R', 'imdb_rating': 7.9,
+    'release_date': '1995-12-15', 'cards': {'en': {'id': 1, 'title': 'Heat', 'description': None,
+                                                   'country': None, 'tagline': None, 'poster': None}},
+}
+
+
+class SearchResultCacheTest(TestCase):
+    # Кеш результатов поиска в памяти процесса
+
+    def setUp(self):
+        result_cache.clear()
+        self.addCleanup(result_cache.clear)
+
+    def test_index_results_without_database(self):
+        with translation.override('en'):
+            page = SearchPage([movie_from_source(MOVIE_SOURCE)], None, None)
+            with mock.patch.object(search, 'run_backends', return_value=(page, False)) as run_backends:
+                search.search_movies('heat')
+                with self.assertNumQueries(0):
+                    cached = search.search_movies('heat')
+        run_backends.assert_called_once()
+        self.assertEqual(cached.results[0].get_translate().title, 'Heat')
+
+    def test_lru_eviction(self):
+        cache = SearchResultCache(max_size=2)
+        cache.set('movie', 'a', (), 'page a')
+        cache.set('movie', 'b', (), 'page b')
+        self.assertEqual(cache.get('movie', 'a', ()), 'page a')
+        cache.set('movie', 'c', (), 'page c')
+
+        self.assertIsNone(cache.get('movie', 'b', ()))
+        self.assertEqual(cache.get('movie', 'a', ()), 'page a')
+        self.assertEqual(cache.get('movie', ' C ', ()), 'page c')
+
+    def test_timeout(self):
+        cache = SearchResultCache(timeout=300)
+        with mock.patch('films.search.cache.time.monotonic', return_value=1000):
+            cache.set('movie', 'a', (), 'page a')
+            cache.set('movie', 'b', (), 'page b', timeout=10)
+        with mock.patch('films.search.cache.time.monotonic', return_value=1100):
+            self.assertEqual(cache.get('movie', 'a', ()), 'page a')
+            self.assertIsNone(cache.get('movie', 'b', ()))
+        with mock.patch('films.search.cache.time.monotonic', return_value=1400):
+            self.assertIsNone(cache.get('movie', 'a', ()))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_bump_generation(self):
+        cache = SearchResultCache()
+        cache.set('movie', 'a', (), 'movie page')
+        cache.set('person', 'a', (), 'person page')
+        bump_generation('movie')
+
+        self.assertIsNone(cache.get('movie', 'a', ()))
+        self.assertEqual(cache.get('person', 'a', ()), 'person page')
+
+    def test_run_backends(self):
+        primary, fallback = mock.Mock(), mock.Mock()
+        primary.search_movies.return_value = 'primary page'
+        fallback.search_movies.return_value = 'fallback page'
+        with mock.patch.object(search, 'get_backends', return_value=[primary, fallback]):
+            self.assertEqual(search.run_backends('search_movies', 'heat'), ('primary page', False))
+            primary.search_movies.side_effect = ConnectionError('N/A', 'refused', None)
+            self.assertEqual(search.run_backends('search_movies', 'heat'), ('fallback page', True))
+
+    def test_fallback_results(self):
+        page = SearchPage([], None, None)
+        with mock.patch.object(search, 'run_backends', return_value=(page, True)), \
+                mock.patch.object(result_cache, 'set') as cache_set:
+            search.search_movies('heat')
+        self.assertEqual(cache_set.call_args[0][4], result_cache.fallback_timeout)
+
+
+class FallbackSearchTest(TestCase):
+    # Поиск запасным движком, когда Elasticsearch недоступен
+
+    def setUp(self):
+        result_cache.clear()
+        self.addCleanup(result_cache.clear)
+        patcher = mock.patch.object(ElasticsearchBackend, 'search_movies',
+                                    side_effect=ConnectionError('N/A', 'refused', None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(ElasticsearchBackend, 'search_persons',
+                                    side_effect=ConnectionError('N/A', 'refused', None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.movies = {}
+        for title, translation_title in (('Heat', 'Схватка'), ('Heathers', 'Смертельное влечение'), ('Alien', 'Чужой')):
+            movie = Movie.objects.create(orig_title=title)
+            MovieTranslations.objects.create(movie=movie, language_code='ru', title=translation_title)
+            self.movies[title] = movie
+        self.person = Person.objects.create(name='Аль Пачино', career='Actor')
+
+    def use_backends(self, fallback):
+        patcher = mock.patch.object(search, '_backends', [ElasticsearchBackend(), fallback])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_slugs(self, url, query):
+        with mock.patch('sys.stdout'):
+            response = self.client.get(url, {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [item['slug'] for item in response.data['results']]
+
+    def check_search(self):
+        slugs = self.get_slugs('/ru/api/movie/', 'heat')
+        self.assertEqual(slugs[:2], [self.movies['Heat'].slug, self.movies['Heathers'].slug])
+        self.assertNotIn(self.movies['Alien'].slug, slugs)
+        self.assertEqual(self.get_slugs('/ru/api/movie/', 'Схватка'), [self.movies['Heat'].slug])
+        self.assertEqual(self.get_slugs('/ru/api/movie/actors/', 'Пачино'), [self.person.slug])
+
+    def test_memory_fallback(self):
+        # Индекс процесса строится из базы этого теста
+        for name, value in (('kinds', None), ('path', None)):
+            patcher = mock.patch.object(memory_index, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.use_backends(MemoryTrigramBackend())
+        self.check_search()
+
+    @skipUnless(connection.vendor == 'postgresql', 'pg_trgm similarity requires PostgreSQL')
+    def test_trigram_fallback(self):
+        self.use_backends(TrigramSearchBackend())
+        self.check_search()
+
+
+def search_response(*sources):
+    # Ответ Elasticsearch с найденными _source в порядке релевантности
+    hits = [{'_source': source, 'sort': [1.0, source['id']]} for source in sources]
+    return Response(Search(), {'hits': {'hits': hits, 'total': {'value': len(hits), 'relation': 'eq'}}})
+
+
+class SearchAllTest(TestCase):
+    # Общий поиск фильмов и людей одним запросом _msearch и запасным движком
+
+    def setUp(self):
+        result_cache.clear()
+        self.addCleanup(result_cache.clear)
+        patcher = mock.patch.object(search, '_backends', [ElasticsearchBackend('index'), MemoryTrigramBackend()])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, query):
+        with mock.patch('sys.stdout'):
+            response = self.client.get('/ru/api/movie/search/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_multi_search(self):
+        movie = {'id': 1, 'orig_title': 'Heat', 'slug': '1-heat', 'age_limit': 'R', 'imdb_rating': 7.9,
+                 'release_date': '1995-12-15', 'cards': {'ru': {'id': 1, 'title': 'Схватка', 'description': None,
+                                                                'country': None, 'tagline': None, 'poster': None}}}
+        person = {'id': 2, 'image': None, 'cards': {'ru': {'name': 'Аль Пачино', 'slug': '2-al-pacino'}}}
+        responses = [search_response(movie), search_response(person)]
+        with mock.patch('films.search.elastic.breaker.call', return_value=responses) as breaker_call:
+            data = self.get('heat')
+            with self.assertNumQueries(0):
+                cached = self.get('heat')
+
+        breaker_call.assert_called_once()
+        # Фильмы и люди запрошены одним _msearch: заголовок и тело на каждый индекс
+        self.assertEqual(len(breaker_call.call_args[0][0].__self__.to_dict()), 4)
+        self.assertEqual([item['slug'] for item in data['movies']], ['1-heat'])
+        self.assertEqual(data['movies'][0]['get_translate']['title'], 'Схватка')
+        self.assertEqual([(item['name'], item['slug']) for item in data['actors']], [('Аль Пачино', '2-al-pacino')])
+        self.assertEqual(cached, data)
+
+    def test_elasticsearch_down(self):
+        heat = Movie.objects.create(orig_title='Heat')
+        MovieTranslations.objects.create(movie=heat, language_code='ru', title='Схватка')
+        alien = Movie.objects.create(orig_title='Alien')
+        MovieTranslations.objects.create(movie=alien, language_code='ru', title='Чужой')
+        person = Person.objects.create(name='Аль Пачино', career='Actor')
+        for name, value in (('kinds', None), ('path', None)):
+            patcher = mock.patch.object(memory_index, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        error = ConnectionError('N/A', 'refused', None)
+        with mock.patch('films.search.elastic.breaker.call', side_effect=error), \
+                mock.patch.object(result_cache, 'set', wraps=result_cache.set) as cache_set:
+            movies = self.get('Схватка')
+            actors = self.get('Пачино')
+
+        self.assertEqual([item['slug'] for item in movies['movies']], [heat.slug])
+        self.assertEqual(movies['actors'], [])
+        self.assertEqual(actors['movies'], [])
+        self.assertEqual([item['slug'] for item in actors['actors']], [person.slug])
+        # Результаты запасного движка кешируются на короткое время
+        self.assertEqual({call[0][4] for call in cache_set.call_args_list}, {result_cache.fallback_timeout})
+
+    def test_empty_query(self):
+        with mock.patch('films.search.elastic.breaker.call') as breaker_call:
+            self.assertEqual(self.get(' '), {'movies': [], 'actors': []})
+        breaker_call.assert_not_called()
+
+
+def tied_match_sql(sources, query):
+    # Совпадения без pg_trgm: по две строки на фильм, у фильмов 1-3 и остальных одинаковые оценки
+    table = connection.ops.quote_name(Movie._meta.db_table)
+    sql = (
+        f'SELECT id, CASE WHEN id <= 3 THEN 0.75 ELSE 0.5 END AS similarity FROM {table} '
+        f'UNION ALL SELECT id, 0.25 AS similarity FROM {table}'
+    )
+    return sql, []
+
+
+class SearchPaginationTest(TestCase):
+    # Страницы поиска по курсору (оценка, id) не повторяют и не пропускают результаты с равной оценкой
+
+    def setUp(self):
+        self.movies = [Movie.objects.create(orig_title='Heat') for i in range(7)]
+        for movie in self.movies:
+            MovieTranslations.objects.create(movie=movie, language_code='ru', title='Схватка')
+
+    def walk(self, query):
+        pages, params = [], {'page_size': 2}
+        while True:
+            paginator = SearchPagination()
+            request = Request(APIRequestFactory().get('/search/', params))
+            pages.append([movie.id for movie in paginator.paginate_search(
+                TrigramSearchBackend().search_movies, query, request
+            )])
+            link = paginator.get_next_link()
+            if link is None:
+                return pages
+            params = {name: values[0] for name, values in parse_qs(urlparse(link).query).items()}
+
+    def test_ties(self):
+        with mock.patch('films.search.postgres.match_sql', tied_match_sql):
+            pages = self.walk('heat')
+        ids = [movie.id for movie in self.movies]
+        self.assertEqual([pk for page in pages for pk in page], ids)
+        self.assertEqual(pages[0], ids[:2])
+
+    @skipUnless(connection.vendor == 'postgresql', 'pg_trgm similarity requires PostgreSQL')
+    def test_ties_postgres(self):
+        # Одинаковые названия дают одинаковую схожесть у всех фильмов
+        pages = self.walk('Heat')
+        self.assertEqual([pk for page in pages for pk in page], [movie.id for movie in self.movies])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/ru/api/movie/', {'search': 'heat', 'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+
+
+class BenchmarkFixtureTest(TestCase):
+    # Фикстура для benchmark_analyzers загружается в текущую схему
+    fixtures = ['benchmark_movies']
+
+    def test_load(self):
+        self.assertEqual(Movie.objects.count(), 500)
+        self.assertEqual(Person.objects.count(), 300)
+        movie = Movie.objects.prefetch_related('translations').get(pk=1)
+        self.assertEqual({t.language_code for t in movie.translations.all()}, {'ru', 'en'})
+        self.assertTrue(movie.cast.exists())
+
+
+class SuggestTest(SimpleTestCase):
+    # Тип подсказки не зависит от версии индекса, на которую указывает алиас
+
+    def test_versioned_index(self):
+        options = [
+            {'text': 'Heat', '_index': f'{MovieDocument._index._name}-20261018141200000000',
+             '_source': {'slug': '1-heat', 'image': None}},
+            {'text': 'Actor', '_index': ActorDocument._index._name,
+             '_source': {'slug': '2-actor', 'image': None}},
+        ]
+        response = Response(Search(), {'suggest': {'names': [{'options': options}]}})
+        with mock.patch('films.search.suggest.breaker.call', return_value=response):
+            suggestions = suggest('he')
+        self.assertEqual([item['type'] for item in suggestions], ['movie', 'actor'])
+        self.assertEqual(suggestions[0]['slug'], '1-heat')
+
+    def test_missing_image(self):
+        # Документ без постера или фото не содержит поля image в _source
+        options = [{'text': 'Heat', '_index': MovieDocument._index._name, '_source': {'slug': '1-heat'}}]
+        response = Response(Search(), {'suggest': {'names': [{'options': options}]}})
+        with mock.patch('films.search.suggest.breaker.call', return_value=response):
+            suggestions = suggest('he')
+        self.assertEqual(suggestions, [{'type': 'movie', 'title': 'Heat', 'slug': '1-heat', 'poster': None}])
+
+
+MEMORY_MOVIES = [
+    (1, {'orig_title': ['Heat'], 'translations': ['Схватка']}),
+    (2, {'orig_title': ['The Heat'], 'translations': ['Копы в юбках']}),
+    (3, {'orig_title': ['Heathers'], 'translations': ['Смертельное влечение']}),
+    (4, {'orig_title': ['Alien'], 'translations': ['Чужой']}),
+]
+
+
+class MemoryIndexTest(SimpleTestCase):
+    # Триграммный индекс в памяти: файл сегментов, ранжирование и изменения после построения
+
+    def setUp(self):
+        self.segment = Segment.build('movie', MEMORY_MOVIES)
+
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as root:
+            path = f'{root}/search-index.bin'
+            write_segments(path, {'movie': self.segment})
+            loaded = read_segments(path)['movie']
+            self.assertEqual(list(loaded.ids), [1, 2, 3, 4])
+            self.assertEqual(loaded.average, self.segment.average)
+            for query in ('heat', 'схватка', 'чужой', 'missing'):
+                self.assertEqual(KindIndex('movie', loaded).match(query),
+                                 KindIndex('movie', self.segment).match(query))
+
+    def test_rank(self):
+        scores = KindIndex('movie', self.segment).match('heat')
+        self.assertEqual(set(scores), {1, 2, 3})
+        # Короткое название с полным совпадением выше более длинных
+        self.assertEqual(rank(scores, 3).results[0], 1)
+
+        first = rank(scores, 2, total=True)
+        self.assertEqual(first.total, 3)
+        second = rank(scores, 2, first.after)
+        self.assertEqual(first.results + second.results, rank(scores, 3).results)
+        self.assertIsNone(second.after)
+
+    def test_rank_ties(self):
+        # При равной оценке порядок по id, страницы не повторяют и не пропускают документы
+        scores = {5: 1.0, 3: 1.0, 4: 1.0, 1: 2.0}
+        first = rank(scores, 2)
+        second = rank(scores, 2, first.after)
+        self.assertEqual(first.results + second.results, [1, 3, 4, 5])
+
+    def test_update(self):
+        index = KindIndex('movie', self.segment)
+        index.update([(4, {'orig_title': ['Heat Wave'], 'translations': []}),
+                      (5, {'orig_title': ['Heat'], 'translations': []})], [1, 4, 5])
+        self.assertEqual(set(index.match('heat')), {2, 3, 4, 5})
+        self.assertNotIn(4, index.match('alien'))
+
+        # Удаление: объект исключается из сегмента без новой версии
+        index.update([], [2])
+        self.assertEqual(set(index.match('heat')), {3, 4, 5})
+
+
+class FiltersTest(TestCase):
+    # Фильтры поиска фильмов и фасеты, посчитанные с фильтрами остальных групп
+
+    def setUp(self):
+        self.drama = Genre.objects.create(title='Драма')
+        self.comedy = Genre.objects.create(title='Комедия')
+        self.movies = []
+        for i, (year, rating, age_limit, genres) in enumerate([
+            (1995, '8.3', '18+', [self.drama]),
+            (1995, '7.1', '12+', [self.drama, self.comedy]),
+            (2010, '6.5', '12+', [self.comedy]),
+            (None, '4.0', None, []),
+        ]):
+            movie = Movie.objects.create(
+                orig_title=f'Movie {i}', imdb_rating=rating, age_limit=age_limit,
+                release_date=datetime.date(year, 1, 1) if year else None,
+            )
+            movie.genres.set(genres)
+            self.movies.append(movie)
+
+    def test_parse_filters(self):
+        params = QueryDict('genre=drama,comedy&genre=war&year_from=1990&rating_from=7.5&age_limit=&year_to=')
+        self.assertEqual(parse_filters(params), {
+            'genre': ['drama', 'comedy', 'war'],
+            'year': (1990, None),
+            'rating': 7.5,
+        })
+        self.assertEqual(parse_filters(QueryDict('')), {})
+        with self.assertRaises(ValidationError):
+            parse_filters(QueryDict('year_from=nineties'))
+
+    def test_freeze(self):
+        key = freeze({'genre': ['drama', 'comedy'], 'year': (1990, None), 'rating': 7.5})
+        self.assertEqual(key, (('genre', ('drama', 'comedy')), ('rating', 7.5), ('year', (1990, None))))
+        self.assertEqual(key, freeze({'rating': 7.5, 'year': [1990, None], 'genre': ('drama', 'comedy')}))
+        hash(key)
+
+    def test_count_facets(self):
+        facets = count_facets(Movie.objects.all(), {'genre': [self.drama.slug], 'age_limit': ['12+']})
+        # Фасет жанров не учитывает фильтр по жанру, остальные фасеты учитывают
+        self.assertEqual(facets['genre'], [(self.comedy.id, 2), (self.drama.id, 1)])
+        self.assertEqual(facets['year'], [(1995, 1)])
+        self.assertEqual(facets['rating'], [(7, 1), (6, 1), (5, 1)])
+        self.assertCountEqual(facets['age_limit'], [('12+', 1), ('18+', 1)])
+
+    def test_memory_candidates(self):
+        # Фильтры проверяются в базе только для лучших совпадений
+        scores = {movie.id: 10 - i for i, movie in enumerate(self.movies)}
+        backend = MemoryTrigramBackend()
+        backend.max_candidates = 2
+        with mock.patch('films.search.memory.memory_index') as index:
+            index.match.return_value = scores
+            page = backend.search_movies('movie', 10, total=True, filters={'age_limit': ['12+']}, facets=True)
+        self.assertEqual([movie.id for movie in page.results], [self.movies[1].id])
+        self.assertEqual(page.total, 1)
+        self.assertCountEqual(page.facets['age_limit'], [('12+', 1), ('18+', 1)])
+
+
+class ThreadQueueTest(SimpleTestCase):
+    # Фоновая очередь индексации: объединение повторов, повторные попытки и отправка при выходе
+
+    def setUp(self):
+        self.flushed = []
+        self.failed = set()
+        for name, value in (('DELAY', 0.1), ('RETRY_DELAY', 0), ('MAX_ATTEMPTS', 3)):
+            patcher = mock.patch(f'films.indexing.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('films.indexing.flush', self.flush)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('films.indexing.close_old_connections')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.queue = ThreadQueue()
+
+    def flush(self, kind, ids):
+        self.flushed.append((kind, set(ids)))
+        return self.failed & set(ids)
+
+    def wait(self, calls):
+        # Ждет calls отправок и завершения обработки пачки фоновым потоком
+        deadline = time.monotonic() + 5
+        while len(self.flushed) < calls or self.queue.busy:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_dedupe(self):
+        self.queue.put('movie', [1, 2])
+        self.queue.put('movie', [2, 3])
+        self.queue.put('person', [1])
+        self.wait(2)
+        self.assertCountEqual(self.flushed, [('movie', {1, 2, 3}), ('person', {1})])
+
+    def test_retry(self):
+        self.failed = {2}
+        self.queue.put('movie', [1, 2])
+        self.wait(3)
+        time.sleep(0.2)
+        # После MAX_ATTEMPTS попыток неудачные объекты не возвращаются в очередь
+        self.assertEqual(self.flushed, [('movie', {1, 2}), ('movie', {2}), ('movie', {2})])
+        self.assertEqual(self.queue.pending, {'movie': set(), 'person': set()})
+
+    def test_close(self):
+        with mock.patch('films.indexing.DELAY', 10):
+            self.queue.put('movie', [1, 2])
+            self.queue.close()
+        self.assertEqual(self.flushed, [('movie', {1, 2})])
+
+
+class BulkIndexingTest(TestCase):
+    # Действия bulk для индексации: документы порциями, удаления и сбор ошибок
+
+    def setUp(self):
+        genre = Genre.objects.create(title='Драма')
+        self.movies = []
+        for i in range(3):
+            movie = Movie.objects.create(orig_title=f'Movie {i}', release_date=datetime.date(1990 + i, 1, 1))
+            MovieTranslations.objects.create(movie=movie, language_code='ru', title=f'Фильм {i}')
+            movie.genres.add(genre)
+            self.movies.append(movie)
+
+    def test_export_actions(self):
+        # На порцию: фильмы, переводы, жанры и переводы жанров, затем пустая порция
+        with self.assertNumQueries(9):
+            actions = list(export_actions(Movie.objects.all(), 'movie-test', chunk_size=2))
+        self.assertEqual([action['_id'] for action in actions], [movie.id for movie in self.movies])
+        action = actions[0]
+        self.assertEqual(action['_index'], 'movie-test')
+        self.assertNotIn('_op_type', action)
+        self.assertEqual(action['_source']['orig_title'], 'Movie 0')
+        self.assertEqual(action['_source']['translations'], ['Фильм 0'])
+        self.assertEqual(action['_source']['genres'], ['drama'])
+        self.assertEqual(action['_source']['release_year'], 1990)
+
+    def test_build_actions(self):
+        # Удаленные объекты удаляются из индекса
+        missing = self.movies[-1].id + 1
+        actions = list(build_actions('movie', [self.movies[0].id, missing]))
+        self.assertEqual(actions[0]['_id'], self.movies[0].id)
+        self.assertEqual(actions[1], {'_op_type': 'delete', '_index': MovieDocument._index._name, '_id': missing})
+
+    def test_bulk_index(self):
+        error = {'index': {'_id': 2, 'status': 400, 'error': 'mapper_parsing_exception'}}
+        with mock.patch('films.indexing.parallel_bulk', return_value=[(True, {}), (False, error), (True, {})]) as bulk:
+            success, errors, elapsed = bulk_index('client', iter([]), chunk_size=2, thread_count=3)
+        self.assertEqual((success, errors), (2, [error]))
+        self.assertGreaterEqual(elapsed, 0)
+        self.assertEqual(bulk.call_args[1]['chunk_size'], 2)
+        self.assertEqual(bulk.call_args[1]['thread_count'], 3)
+        self.assertFalse(bulk.call_args[1]['raise_on_error'])
+
+
+class IndexMoviesCommandTest(TestCase):
+    # Алиас и время запуска index_movies меняются только при индексации без ошибок
+
+    def setUp(self):
+        self.es = mock.MagicMock()
+        self.errors = []
+        command = 'films.management.commands.index_movies'
+        for name, value in (
+            ('get_client', mock.Mock(return_value=self.es)),
+            ('bulk_index', mock.Mock(side_effect=lambda *args: (1, self.errors, 0.1))),
+            ('create_versioned_index', mock.Mock(side_effect=lambda document, profile: f'{document._index._name}-1')),
+            ('swap_alias', mock.Mock(return_value=['old'])),
+        ):
+            patcher = mock.patch(f'{command}.{name}', value)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def call(self, *args):
+        with mock.patch('sys.stdout'):
+            call_command('index_movies', *args)
+
+    def test_rebuild(self):
+        self.call()
+        self.assertEqual(self.swap_alias.call_count, 2)
+        self.es.indices.delete.assert_any_call(index='old')
+        self.assertEqual(IndexingCheckpoint.objects.count(), 2)
+
+    def test_rebuild_errors(self):
+        self.errors = [{'index': {'_id': 1, 'error': 'mapper_parsing_exception'}}]
+        with self.assertRaises(CommandError):
+            self.call()
+        # Неполный индекс удаляется, алиас остается на старом индексе
+        self.swap_alias.assert_not_called()
+        self.es.indices.delete.assert_called_once_with(index=f'{MovieDocument._index._name}-1')
+        self.assertFalse(IndexingCheckpoint.objects.exists())
+
+    def test_update_errors(self):
+        started = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        for document in (MovieDocument, ActorDocument):
+            save_checkpoint(document._index._name, started)
+        self.errors = [{'index': {'_id': 1, 'error': 'timeout'}}]
+        with self.assertRaises(CommandError):
+            self.call('--since')
+        self.create_versioned_index.assert_not_called()
+        self.assertEqual(set(IndexingCheckpoint.objects.values_list('last_run', flat=True)), {started})
+
+
+class CircuitBreakerTest(SimpleTestCase):
+    # Размыкатель учитывает только недоступность Elastic search
+
+    def raise_error(self, breaker, error):
+        def request():
+            raise error
+        with self.assertRaises(type(error)):
+            breaker.call(request)
+
+    def test_client_errors(self):
+        breaker = CircuitBreaker(failure_threshold=2)
+        for i in range(5):
+            self.raise_error(breaker, RequestError(400, 'parsing_exception', {}))
+        self.assertEqual(breaker.call(lambda: 'ok'), 'ok')
+
+    def test_unavailable(self):
+        breaker = CircuitBreaker(failure_threshold=3)
+        self.raise_error(breaker, ConnectionError('N/A', 'refused', None))
+        self.raise_error(breaker, ConnectionTimeout('TIMEOUT', 'timed out', None))
+        self.raise_error(breaker, TransportError(503, 'unavailable', {}))
+        with self.assertRaises(CircuitOpen):
+            breaker.call(lambda: 'ok')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                       'LOCATION': 'response-cache-tests'}})
+class ResponseCacheTest(TestCase):
+    # Кеш ответов страниц и его сброс сигналами при изменении данных
+
+    def setUp(self):
+        self.movie = Movie.objects.create(orig_title='Heat')
+        self.translation = MovieTranslations.objects.create(movie=self.movie, language_code='ru', title='Схватка')
+        self.actor = Person.objects.create(name='Актер', career='Actor')
+        self.genre = Genre.objects.create(title='Криминал')
+
+    def get(self, url):
+        response = self.client.get(f'/ru/api/movie/{url}')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_hit(self):
+        with mock.patch('films.views.movie_detail_queryset', wraps=views.movie_detail_queryset) as queryset:
+            first = self.get(f'{self.movie.slug}/')
+            second = self.get(f'{self.movie.slug}/')
+        self.assertEqual(queryset.call_count, 1)
+        self.assertEqual(first, second)
+
+    def test_movie_save(self):
+        self.get(f'{self.movie.slug}/')
+        self.translation.title = 'Жара'
+        self.translation.save()
+        self.assertEqual(self.get(f'{self.movie.slug}/')['get_translate']['title'], 'Жара')
+
+        self.movie.age_limit = '18+'
+        self.movie.save()
+        self.assertEqual(self.get(f'{self.movie.slug}/')['age_limit'], '18+')
+
+    def test_cast_change(self):
+        self.assertEqual(self.get(f'{self.movie.slug}/')['get_cast'], [])
+        self.assertEqual(self.get(f'actor/{self.actor.slug}/')['movie_cast']['results'], [])
+
+        self.movie.cast.add(self.actor)
+        self.assertEqual(len(self.get(f'{self.movie.slug}/')['get_cast']), 1)
+        self.assertEqual(len(self.get(f'actor/{self.actor.slug}/')['movie_cast']['results']), 1)
+
+    def test_collection_list_validator(self):
+        # Перевод фильма меняет список коллекций, хотя даты обновления не меняются
+        collection = Collection.objects.create(title='Лучшее')
+        collection.movies.add(self.movie)
+        response = self.client.get('/ru/api/movie/collections/')
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/ru/api/movie/collections/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.translation.title = 'Жара'
+        self.translation.save()
+        response = self.client.get('/ru/api/movie/collections/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Жара', response.content.decode('utf-8'))
+
+    def test_genre_change(self):
+        self.assertEqual(self.get(f'{self.movie.slug}/')['genres'], [])
+        self.assertEqual(self.get(f'genre/{self.genre.slug}/')['movies']['results'], [])
+
+        self.movie.genres.add(self.genre)
+        self.assertEqual(len(self.get(f'{self.movie.slug}/')['genres']), 1)
+        self.assertEqual(len(self.get(f'genre/{self.genre.slug}/')['movies']['results']), 1)
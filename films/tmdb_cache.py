@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import time
+from collections import Counter, OrderedDict
+from urllib.parse import urlencode, urlparse
+
+
+# Время жизни страниц по умолчанию в секундах по типам страниц
+TTL = {
+    'list': 6 * 60 * 60,
+    'movie': 7 * 24 * 60 * 60,
+    'person': 30 * 24 * 60 * 60,
+}
+
+
+def get_page_type(url):
+    # Тип страницы TMDB по пути: список фильмов, фильм или человек
+    path = urlparse(url).path.rstrip('/')
+    if path.startswith('/person/'):
+        return 'person'
+    if path.startswith('/movie/'):
+        return 'movie'
+    return 'list'
+
+
+def write_file(path, data):
+    # Запись с атомарной заменой, читатели видят старый или новый файл целиком
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+class PageCache:
+    """
+    Дисковый кеш страниц TMDB. Запись о запросе (URL и параметры)
+    хранит ETag, Last-Modified, время загрузки и хеш содержимого,
+    само содержимое хранится один раз под своим хешем. При превышении
+    max_size байт удаляются давно не читанные записи и содержимое,
+    на которое они больше не ссылаются. Порядок чтения записей хранится
+    в памяти, каталог кеша просматривается один раз при первой записи.
+    Методы выполняют дисковые операции синхронно и не рассчитаны
+    на одновременный вызов из нескольких потоков
+    """
+
+    def __init__(self, path, max_size, ttl=None):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = {**TTL, **(ttl or {})}
+        self.index = None
+        self.refs = None
+        self.size = 0
+
+    def get_key(self, url, params=None):
+        address = url + ('?' + urlencode(sorted(params.items())) if params else '')
+        return hashlib.sha256(address.encode('utf-8')).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, 'entries', key[:2], f'{key}.json')
+
+    def object_path(self, digest):
+        return os.path.join(self.path, 'objects', digest[:2], digest)
+
+    def scan(self):
+        """
+        Записи от давно читанных к недавно читанным по времени изменения файлов,
+        ссылки записей на содержимое и общий размер содержимого
+        """
+        entries = sorted(self.entries(), key=lambda item: item[1])
+        self.index = OrderedDict((key, entry['object']) for key, accessed, entry in entries)
+        self.refs = Counter(self.index.values())
+        self.size = 0
+        for digest in self.refs:
+            try:
+                self.size += os.path.getsize(self.object_path(digest))
+            except OSError:
+                pass
+
+    def entries(self):
+        root = os.path.join(self.path, 'entries')
+        for directory, dirs, files in os.walk(root):
+            for name in files:
+                if name.endswith('.json'):
+                    path = os.path.join(directory, name)
+                    try:
+                        accessed = os.path.getmtime(path)
+                        with open(path, 'rb') as f:
+                            entry = json.load(f)
+                    except (OSError, ValueError):
+                        continue
+                    yield name[:-len('.json')], accessed, entry
+
+    def touch(self, key):
+        # Запись становится последней в очереди на удаление
+        if self.index is not None and key in self.index:
+            self.index.move_to_end(key)
+
+    def get(self, url, params=None):
+        """
+        Запись с содержимым страницы или None. Чтение обновляет
+        время изменения файла записи, по нему порядок чтения
+        восстанавливается при следующем запуске
+        """
+        key = self.get_key(url, params)
+        path = self.entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = json.load(f)
+            with open(self.object_path(entry['object']), 'rb') as f:
+                entry['body'] = f.read().decode('utf-8')
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        self.touch(key)
+        return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry['stored'] < self.ttl[get_page_type(entry['url'])]
+
+    def get_validators(self, entry):
+        # Заголовки условного запроса для проверки записи на сервере
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, url, params, body, headers):
+        if self.index is None:
+            self.scan()
+        data = body.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        key = self.get_key(url, params)
+        old = self.index.pop(key, None)
+        if not os.path.exists(self.object_path(digest)):
+            write_file(self.object_path(digest), data)
+            self.size += len(data)
+        self.save_entry(key, {
+            'url': url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'stored': time.time(),
+            'object': digest,
+        })
+        self.index[key] = digest
+        self.refs[digest] += 1
+        if old:
+            self.release(old)
+        self.evict()
+
+    def revalidated(self, url, params, entry, headers):
+        # Сервер подтвердил запись ответом 304, она снова свежая
+        entry = {name: value for name, value in entry.items() if name != 'body'}
+        entry['stored'] = time.time()
+        entry['etag'] = headers.get('ETag', entry.get('etag'))
+        entry['last_modified'] = headers.get('Last-Modified', entry.get('last_modified'))
+        key = self.get_key(url, params)
+        self.save_entry(key, entry)
+        self.touch(key)
+
+    def save_entry(self, key, entry):
+        write_file(self.entry_path(key), json.dumps(entry).encode('utf-8'))
+
+    def release(self, digest):
+        # Содержимое удаляется, когда на него не осталось ссылок
+        self.refs[digest] -= 1
+        if self.refs[digest] > 0:
+            return
+        del self.refs[digest]
+        path = self.object_path(digest)
+        try:
+            self.size -= os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        # Удаление давно не читанных записей без просмотра каталога
+        while self.size > self.max_size and self.index:
+            key, digest = self.index.popitem(last=False)
+            try:
+                os.remove(self.entry_path(key))
+            except OSError:
+                continue
+            self.release(digest)
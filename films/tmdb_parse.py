@@ -1,4 +1,5 @@
-import requests
+import re
+
 from bs4 import BeautifulSoup
 from django.utils.translation import gettext as _
 
@@ -17,52 +18,43 @@ def get_text_if_not_None(data):
         return None
 
 
-def get_html(url, params=None):
-    r = requests.get(url, headers=HEADERS, params=params)
-    return r
+def get_tmdb_id(link):
+    # ID человека на TMDB из ссылки вида /person/1234-name
+    match = re.search(r'/person/(\d+)', link)
+    return int(match.group(1)) if match else None
 
 
-def get_links(html):
+def get_links(html, host=HOST):
     soup = BeautifulSoup(html, 'html.parser')
     items = soup.find_all('div', class_='card style_1')
 
     movie_links = []
     for item in items:
         movie_links.append(
-            HOST + item.find('a', class_='image').get('href')
+            host + item.find('a', class_='image').get('href')
         )
     return movie_links
 
 
-def get_directors(soup):
+def get_directors(soup, host=HOST):
+    # Ссылки на страницы режиссеров и создателей
     peoples = soup.find_all('li', class_='profile')
-    profiles = []
+    links = []
     for person in peoples:
         character = person.find('p', class_='character').get_text()
         if 'Director' in character or _('Создатель') in character:
-            link = HOST + person.find('a').get('href')
-            html = get_html(link)
-            if html.status_code == 200:
-                profiles.append(get_person(html.text))
-            else:
-                print(_('Error in parsing directors'))
-    return profiles
+            links.append(host + person.find('a').get('href'))
+    return links
 
 
-def get_cast(soup):
+def get_cast(soup, host=HOST):
+    # Ссылки на страницы актеров
     peoples = soup.find_all('li', class_='card')
-    cast = []
-    for person in peoples:
-        link = HOST + person.find('a').get('href')
-        html = get_html(link)
-        if html.status_code == 200:
-            cast.append(get_person(html.text))
-        else:
-            print(_('Error in parsing cast'))
-    return cast
+    return [host + person.find('a').get('href') for person in peoples]
 
 
-def get_movie(html):
+def get_movie(html, host=HOST):
+    # Данные фильма, вместо режиссеров и актеров ссылки на их страницы
     soup = BeautifulSoup(html, 'html.parser')
 
     title = soup.find('div', class_='title')
@@ -98,8 +90,8 @@ def get_movie(html):
     else:
         duration_minutes = None
     genres = title.find('span', class_='genres').find_all('a')
-    directors = get_directors(soup.find('ol', class_='people'))
-    cast = get_cast(soup.find('ol', class_='people scroller'))
+    directors = get_directors(soup.find('ol', class_='people'), host)
+    cast = get_cast(soup.find('ol', class_='people scroller'), host)
     poster = soup.find('img', class_='poster').get('src')
 
     movie = {
@@ -149,11 +141,3 @@ def get_person(html):
         'photo': photo
     }
     return person
-
-
-def parse_content(url):
-    html = get_html(url)
-    if html.status_code == 200:
-        return get_movie(html.text)
-    else:
-        print(_('Error in parsing content'))
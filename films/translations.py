@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.db.models import Prefetch
+from django.utils.translation import get_language
+
+
+def get_fallback_language():
+    # Язык из настроек PARLER, который используется при отсутствии перевода
+    return settings.PARLER_LANGUAGES.get('default', {}).get('fallback', settings.LANGUAGE_CODE)
+
+
+def get_lookup_languages(language=None):
+    # Активный язык и язык по умолчанию без повторов
+    language = language or get_language()
+    fallback = get_fallback_language()
+    return [language] if language == fallback else [language, fallback]
+
+
+def pick_translation(translations, language=None):
+    """
+    Выбирает перевод для активного языка из уже загруженных переводов,
+    при его отсутствии возвращает перевод на языке по умолчанию или None
+    """
+    by_language = {t.language_code: t for t in translations}
+    for code in get_lookup_languages(language):
+        if code in by_language:
+            return by_language[code]
+    return None
+
+
+def resolve_translations(movies, language=None):
+    """
+    Загружает переводы активного языка для списка фильмов одним запросом
+    и сохраняет их в атрибуте _translation каждого фильма
+    """
+    from .models import MovieTranslations
+
+    movies = [movie for movie in movies if not hasattr(movie, '_translation')]
+    if not movies:
+        return
+    languages = get_lookup_languages(language)
+    translations = {}
+    queryset = MovieTranslations.objects.filter(
+        movie_id__in={movie.id for movie in movies},
+        language_code__in=languages,
+    )
+    for translation in queryset:
+        translations.setdefault(translation.movie_id, []).append(translation)
+    for movie in movies:
+        movie._translation = pick_translation(translations.get(movie.id, ()), language)
+
+
+
+def translations_prefetch(model, language=None):
+    # Prefetch переводов модели parler только для активного языка и языка по умолчанию
+    translations = model._parler_meta.root_model.objects.filter(
+        language_code__in=get_lookup_languages(language)
+    )
+    return Prefetch('translations', queryset=translations)
+
+
+def translated_prefetch(lookup, queryset, language=None):
+    """
+    Prefetch для связанных моделей parler, который вместе с объектами
+    загружает только переводы активного языка и языка по умолчанию
+    """
+    return Prefetch(lookup, queryset=queryset.prefetch_related(
+        translations_prefetch(queryset.model, language)
+    ))
@@ -6,6 +6,9 @@ urlpatterns = [
     path('', views.MovieSearchViewSet.as_view()),                       # Поиск Фильмов
     path('parse/', views.MovieParser.as_view()),                        # Парсинг указанного кол-ва страниц на tmdb
     path('actors/', views.ActorSearchViewSet.as_view()),                # Поиск Людей
+    path('search/', views.SearchAllView.as_view()),                     # Поиск Фильмов и Людей
+    path('suggest/', views.SuggestView.as_view()),                      # Подсказки для поиска
+    path('search-stats/', views.SearchCacheStatsView.as_view()),        # Статистика кеша поиска
     path('collections/', views.CollectionListView.as_view()),           # Список Коллекций
     path('collection/<int:pk>/', views.CollectionDetailView.as_view()), # Детали Коллекции
     path('actor/<slug:slug>/', views.ActorDetailView.as_view()),        # Информация о Человеке
@@ -1,10 +1,16 @@
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.db.models import Q
+from rest_framework.permissions import IsAdminUser
 from .parser import parse
 from . import serializers
 from .models import Movie, Genre, Person, Collection, MovieTranslations
-from .documents import MovieDocument, ActorDocument
+from . import search
+from .search.suggest import suggest, SUGGEST_SIZE
+from .queries import (movie_detail_queryset, prefetch_collection_films, movie_last_modified,
+                      actor_last_modified, genre_last_modified, collection_last_modified,
+                      collections_last_modified)
+from .pagination import KeysetPagination, RatingKeysetPagination, SearchPagination
+from .cache import cached_response, conditional_response
 from django.http.response import JsonResponse
 from rest_framework.parsers import JSONParser
 from django.views.generic import UpdateView
@@ -12,13 +18,77 @@ from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 
 
+SEARCH_PAGE_PARAMETERS = [
+    openapi.Parameter(
+        name='page_size',
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_INTEGER,
+        required=False,
+        description='Number of results per page'
+    ),
+    openapi.Parameter(
+        name='cursor',
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_STRING,
+        required=False,
+        description='Cursor of the next page from the previous response'
+    ),
+    openapi.Parameter(
+        name='total',
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_BOOLEAN,
+        required=False,
+        description='Include the total number of matches in count'
+    ),
+]
+
+MOVIE_FILTER_PARAMETERS = [
+    openapi.Parameter(
+        name='genre',
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_STRING,
+        required=False,
+        description='Genre slugs separated by commas'
+    ),
+    openapi.Parameter(
+        name='year_from',
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_INTEGER,
+        required=False,
+        description='Earliest release year'
+    ),
+    openapi.Parameter(
+        name='year_to',
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_INTEGER,
+        required=False,
+        description='Latest release year'
+    ),
+    openapi.Parameter(
+        name='rating_from',
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_NUMBER,
+        required=False,
+        description='Minimal IMDB rating'
+    ),
+    openapi.Parameter(
+        name='age_limit',
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_STRING,
+        required=False,
+        description='Age limits separated by commas'
+    ),
+]
+
+
 
 class MovieSearchViewSet(APIView):
     """
     View for Search among Movies
 
     get:
-        Return a list of matching movies.
+        Return a page of matching movies ordered by relevance.
+        The first page also contains genre, year, rating and age limit facets.
     """
 
     @swagger_auto_schema(
@@ -31,37 +101,26 @@ class MovieSearchViewSet(APIView):
                 type=openapi.TYPE_STRING,
                 required=True,
                 description='Movie search query'
-            )
+            ),
+            *SEARCH_PAGE_PARAMETERS,
+            *MOVIE_FILTER_PARAMETERS
         ],
         responses={200: serializers.MovieListSerializer(many=True)}
     )
     def get(self, request):
         query = request.query_params.get('search')
-        ids = []
         if query:
-            try:
-                s = MovieDocument.search()
-                s = s.query('multi_match', query=query, fields=["orig_title", "translations"])
-                response = s.execute()
-                response_dict = response.to_dict()
-                hits = response_dict['hits']['hits']
-                ids = [hit['_source']['id'] for hit in hits]
-                try:
-                    quantity = int(request.query_params.get('q'))
-                    queryset = Movie.objects.filter(id__in=ids)[:quantity]
-                except:
-                    queryset = Movie.objects.filter(id__in=ids)
-                movie_list = list(queryset)
-                movie_list.sort(key=lambda movie: ids.index(movie.id))
-                serializer = serializers.MovieListSerializer(movie_list, many=True, context={'request': request})
-            except Exception as e:
-                print(e)
-                movies = Movie.objects.filter(
-                    Q(translations__title__icontains=query) |
-                    Q(orig_title__icontains=query)
-                ).distinct()
-                serializer = serializers.MovieListSerializer(movies, many=True, context={'request': request})
-            return Response(serializer.data)
+            paginator = SearchPagination()
+            movies = paginator.paginate_search(
+                search.search_movies, query, request,
+                filters=search.parse_filters(request.query_params),
+                facets=not request.query_params.get(paginator.cursor_query_param),
+            )
+            serializer = serializers.MovieListSerializer(movies, many=True, context={'request': request})
+            data = paginator.get_paginated_data(serializer.data)
+            if paginator.page.facets is not None:
+                data['facets'] = search.describe_facets(paginator.page.facets)
+            return Response(data)
 
 
 
@@ -70,7 +129,7 @@ class ActorSearchViewSet(APIView):
     View for Search for people
 
     get:
-        Return a list of matching persons.
+        Return a page of matching persons ordered by relevance.
     """
 
     @swagger_auto_schema(
@@ -83,7 +142,8 @@ class ActorSearchViewSet(APIView):
                 type=openapi.TYPE_STRING,
                 required=True,
                 description='Person search query'
-            )
+            ),
+            *SEARCH_PAGE_PARAMETERS
         ],
         responses={
             200: serializers.ActorListSerializer(many=True)
@@ -91,28 +151,97 @@ class ActorSearchViewSet(APIView):
     )
     def get(self, request):
         query = request.query_params.get('search')
-        ids = []
         if query:
-            try:
-                s = ActorDocument.search()
-                s = s.query('multi_match', query=query, fields=["name",])
-                response = s.execute()
-                response_dict = response.to_dict()
-                hits = response_dict['hits']['hits']
-                ids = [hit['_source']['id'] for hit in hits]
-                try:
-                    quantity = int(request.query_params.get('q'))
-                    queryset = Person.objects.filter(id__in=ids)[:quantity]
-                except:
-                    queryset = Person.objects.filter(id__in=ids)
-                actor_list = list(queryset)
-                actor_list.sort(key=lambda actor: ids.index(actor.id))
-                serializer = serializers.ActorListSerializer(actor_list, many=True)
-            except Exception as e:
-                print(e)
-                actors = Person.objects.filter(translations__name__icontains=query)
-                serializer = serializers.ActorListSerializer(actors, many=True, context={'request': request})
-            return Response(serializer.data)
+            paginator = SearchPagination()
+            actors = paginator.paginate_search(search.search_persons, query, request)
+            serializer = serializers.ActorListSerializer(actors, many=True, context={'request': request})
+            return paginator.get_paginated_response(serializer.data)
+
+
+
+class SearchAllView(APIView):
+    """
+    View for Search among movies and people at once
+
+    get:
+        Return the first matching movies and persons grouped by type.
+    """
+
+    @swagger_auto_schema(
+        operation_id='search_all',
+        operation_summary='Search among movies and people',
+        manual_parameters=[
+            openapi.Parameter(
+                name='search',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                required=True,
+                description='Movie or person search query'
+            ),
+            SEARCH_PAGE_PARAMETERS[0]
+        ],
+        responses={200: serializers.SearchAllSerializer()}
+    )
+    def get(self, request):
+        query = request.query_params.get('search', '').strip()
+        if not query:
+            return Response({'movies': [], 'actors': []})
+        pages = search.search_all(query, SearchPagination().get_page_size(request))
+        serializer = serializers.SearchAllSerializer(
+            {'movies': pages['movie'].results, 'actors': pages['person'].results},
+            context={'request': request}
+        )
+        return Response(serializer.data)
+
+
+
+class SuggestView(APIView):
+    """
+    View for typeahead suggestions
+
+    get:
+        Return movies and people whose title or name starts with the query.
+    """
+
+    @swagger_auto_schema(
+        operation_id='suggest',
+        operation_summary='Suggest movies and people',
+        manual_parameters=[
+            openapi.Parameter(
+                name='search',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                required=True,
+                description='Beginning of a title or a name'
+            )
+        ],
+        responses={200: serializers.SuggestionSerializer(many=True)}
+    )
+    def get(self, request):
+        query = request.query_params.get('search', '').strip()
+        if not query:
+            return Response([])
+        size = search.get_size(request.query_params.get('q'), default=SUGGEST_SIZE)
+        serializer = serializers.SuggestionSerializer(suggest(query, size), many=True)
+        return Response(serializer.data)
+
+
+
+class SearchCacheStatsView(APIView):
+    """
+    View for search result cache statistics
+
+    get:
+        Return hit and miss counters of the search result cache.
+    """
+    permission_classes = (IsAdminUser,)
+
+    @swagger_auto_schema(
+        operation_id='search_cache_stats',
+        operation_summary='Take search cache statistics',
+    )
+    def get(self, request):
+        return Response(search.result_cache.stats())
 
 
 
@@ -121,17 +250,21 @@ class CollectionListView(APIView):
     View for list of Collections
 
     get:
-        Return all collections, ordered by most recently updated.
+        Return a page of collections, ordered by most recently updated.
     """
+    pagination_class = KeysetPagination
 
     @swagger_auto_schema(
         operation_summary='Take list of collections',
         responses={200: serializers.CollectionListSerializer(many=True)}
     )
+    @conditional_response(collections_last_modified, 'collections')
     def get(self, request):
-        collections = Collection.objects.all()
+        paginator = self.pagination_class()
+        collections = paginator.paginate_queryset(Collection.objects.all(), request, view=self)
+        collections = prefetch_collection_films(collections)
         serializer = serializers.CollectionListSerializer(collections, many=True, context={'request': request})
-        return Response(serializer.data)
+        return paginator.get_paginated_response(serializer.data)
 
 
 
@@ -148,8 +281,10 @@ class MovieDetailView(APIView):
         operation_summary='Take detail about the movie',
         responses={200: serializers.MovieDetailSerializer()}
     )
+    @conditional_response(movie_last_modified, 'movie', 'slug')
+    @cached_response('movie', 'slug')
     def get(self, request, slug):
-        movie = Movie.objects.get(slug=slug)
+        movie = movie_detail_queryset().get(slug=slug)
         serializer = serializers.MovieDetailSerializer(movie, context={'request': request})
         return Response(serializer.data)
 
@@ -166,6 +301,8 @@ class CollectionDetailView(APIView):
         operation_description='Return detail for requested collection.',
         responses={200: serializers.CollectionDetailSerializer()}
     )
+    @conditional_response(collection_last_modified, 'collection', 'pk')
+    @cached_response('collection', 'pk')
     def get(self, request, pk):
         collection = Collection.objects.get(id=pk)
         serializer = serializers.CollectionDetailSerializer(collection, context={'request': request})
@@ -178,18 +315,26 @@ class ActorDetailView(APIView):
     View for requested Person
 
     get:
-        Return detail for requested person.
+        Return detail for requested person and a page of their movies.
     """
+    pagination_class = KeysetPagination
 
     @swagger_auto_schema(
         operation_id='actor_detail',
         operation_summary='Take detail about the person',
         responses={200: serializers.CollectionDetailSerializer()}
     )
+    @conditional_response(actor_last_modified, 'actor', 'slug')
+    @cached_response('actor', 'slug')
     def get(self, request, slug):
         actor = Person.objects.get(translations__slug=slug)
+        paginator = self.pagination_class()
+        movies = paginator.paginate_queryset(actor.movie_cast.all(), request, view=self)
         serializer = serializers.ActorDetailSerializer(actor, context={'request': request})
-        return Response(serializer.data)
+        movies = serializers.MovieListSerializer(movies, many=True, context={'request': request})
+        data = serializer.data
+        data['movie_cast'] = paginator.get_paginated_data(movies.data)
+        return Response(data)
 
 
 
@@ -198,18 +343,26 @@ class GenreView(APIView):
     View for requested Genre
 
     get:
-        Return detail for requested genre and list of related movies.
+        Return detail for requested genre and a page of related movies.
     """
+    pagination_class = RatingKeysetPagination
 
     @swagger_auto_schema(
         operation_id='genre_detail',
         operation_summary='Take detail about the genre',
         responses={200: serializers.GenreDetailSerializer()}
     )
+    @conditional_response(genre_last_modified, 'genre', 'slug')
+    @cached_response('genre', 'slug')
     def get(self, request, slug):
         genre = Genre.objects.get(translations__slug=slug)
+        paginator = self.pagination_class()
+        movies = paginator.paginate_queryset(genre.movies.all(), request, view=self)
         serializer = serializers.GenreDetailSerializer(genre)
-        return Response(serializer.data)
+        movies = serializers.MovieListSerializer(movies, many=True, context={'request': request})
+        data = serializer.data
+        data['movies'] = paginator.get_paginated_data(movies.data)
+        return Response(data)
 
 
 